@@ -0,0 +1,102 @@
+"""
+Benchmark the solver output parser against the previous line-splitting parser.
+
+Each corpus file is parsed as-is and inflated with a long thinking preamble
+(the size of a 10k-token reasoning trace), both in one piece and fed as small
+streamed deltas.
+
+Usage:
+    python -m benchmarks.bench_parser
+    python -m benchmarks.bench_parser --thinking-tokens 20000 --repeat 50
+"""
+import argparse
+import glob
+import os
+import time
+
+from src.parsing import SolutionParser, parse_solution
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus", "parser")
+
+
+def legacy_process_response(response: str) -> dict:
+    # The parser `solver` used before src.parsing, kept here as the baseline.
+    if "</think>" in response:
+        response = response.split("</think>")[-1].strip()
+    step_pattern = "## Step"
+    answer_parttern = "## Final Answer:"
+    steps = []
+    current_step = ""
+    answer = ""
+    for i in response.split("\n"):
+        if answer_parttern in i:
+            answer = i.split(answer_parttern)[-1].strip() + "\n\n"
+        elif step_pattern in i:
+            if current_step.strip() != "":
+                steps.append(current_step.strip())
+            current_step = i.strip() + "\n\n"
+        else:
+            current_step += i.strip() + "\n\n"
+    if current_step:
+        steps.append(current_step.strip())
+    return {"steps": steps, "answer": answer}
+
+
+def legacy_stream(deltas: list) -> dict:
+    text = ""
+    for delta in deltas:
+        text += delta
+    return legacy_process_response(text)
+
+
+def stream(deltas: list, json_mode: bool) -> dict:
+    parser = SolutionParser(json_mode=json_mode)
+    for delta in deltas:
+        parser.feed(delta)
+    return parser.finish()
+
+
+def thinking_preamble(tokens: int) -> str:
+    # Roughly four characters per token, in short lines like real reasoning.
+    line = "Let me check this step again, maybe compute $3 \\cdot 4 = 12$ first.\n"
+    return "<think>\n" + line * max(1, tokens * 4 // len(line)) + "</think>\n"
+
+
+def chunk(text: str, size: int) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the solver output parser.")
+    parser.add_argument("--thinking-tokens", type=int, default=10000)
+    parser.add_argument("--chunk-size", type=int, default=8, help="Characters per streamed delta")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    preamble = thinking_preamble(args.thinking_tokens)
+    print(f"{'case':<42} {'bytes':>8} {'legacy ms':>10} {'parser ms':>10} {'stream legacy':>14} {'stream parser':>14}")
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.txt"))):
+        name = os.path.basename(path)
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        json_mode = name.startswith("json")
+        for label, sample in ((name, text), (name + " +thinking", preamble + text.split("</think>")[-1])):
+            deltas = chunk(sample, args.chunk_size)
+            results = [
+                timed(lambda: legacy_process_response(sample), args.repeat),
+                timed(lambda: parse_solution(sample, json_mode=json_mode), args.repeat),
+                timed(lambda: legacy_stream(deltas), args.repeat),
+                timed(lambda: stream(deltas, json_mode), args.repeat),
+            ]
+            print(f"{label:<42} {len(sample):>8} " + " ".join(f"{r * 1000:>{w}.3f}" for r, w in zip(results, (10, 10, 14, 14))))
+
+
+if __name__ == "__main__":
+    main()
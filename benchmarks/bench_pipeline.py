@@ -0,0 +1,181 @@
+"""
+End-to-end benchmark of the STEMMate pipeline against the mock OpenAI server.
+
+Drives `process_image_and_solve_with_progress`, `process_image_and_augment_questions`
+or the Gradio queue (through gradio_client) at a fixed concurrency and reports
+latency percentiles, model calls per question and memory per request.
+
+Usage:
+    python -m benchmarks.bench_pipeline --start-mock --target solve --questions 200 --concurrency 32
+    python -m benchmarks.bench_pipeline --base-url http://127.0.0.1:8000 --target gradio --concurrency 8
+Extra arguments after `--` are passed to the mock server, e.g. `-- --latency lognormal:1,0.5`.
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from PIL import Image, ImageDraw
+
+
+def synthetic_images(count: int, seed: int = 0) -> list:
+    """PNG bytes of distinct question-like images."""
+    rng = random.Random(seed)
+    images = []
+    for i in range(count):
+        image = Image.new("RGB", (1200, 800), (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        draw.text((40, 40), f"Question {i}: A train travels {rng.randint(50, 500)} km ...", fill=(0, 0, 0))
+        for _ in range(50):
+            x, y = rng.randint(0, 1199), rng.randint(100, 799)
+            draw.line((x, y, x + rng.randint(5, 60), y), fill=(0, 0, 0), width=2)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else float("nan")
+
+
+def start_mock(port: int, extra: list) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.mock_server", "--port", str(port), *extra])
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Mock server did not start")
+
+
+async def run_async(target: str, images: list, concurrency: int) -> tuple:
+    # Imported here, after OPENAI_API_BASE_URL points at the mock server.
+    from src.utils import process_image_and_solve_with_progress, process_image_and_augment_questions
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(image: bytes):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if target == "solve":
+                    async for _ in process_image_and_solve_with_progress(image, True, None, None, "Lecture/Direct Instruction", "Yoda"):
+                        pass
+                else:
+                    await process_image_and_augment_questions(image, 3)
+            except Exception as e:
+                errors += 1
+                print(f"Request failed: {type(e).__name__}: {e}")
+                return
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[one(image) for image in images])
+    return latencies, errors
+
+
+def run_gradio(images: list, concurrency: int, port: int) -> tuple:
+    from gradio_client import Client, handle_file
+    from main import demo
+
+    demo.queue(default_concurrency_limit=concurrency, max_size=len(images) + concurrency)
+    demo.launch(server_port=port, prevent_thread_lock=True, quiet=True)
+    client = Client(f"http://127.0.0.1:{port}/", verbose=False)
+    directory = tempfile.mkdtemp()
+    paths = []
+    for i, image in enumerate(images):
+        path = os.path.join(directory, f"{i}.png")
+        with open(path, "wb") as f:
+            f.write(image)
+        paths.append(path)
+
+    latencies, errors = [], 0
+
+    def one(path: str):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            client.submit(
+                handle_file(path), True, ["Qwen/Qwen3-Next-80B-A3B-Thinking"], "Lecture/Direct Instruction", "Yoda",
+                api_name="/solve_with_progress",
+            ).result()
+        except Exception as e:
+            errors += 1
+            print(f"Request failed: {type(e).__name__}: {e}")
+            return
+        latencies.append(time.perf_counter() - start)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, paths))
+    finally:
+        demo.close()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the STEMMate pipeline against the mock server.")
+    parser.add_argument("--target", choices=("solve", "augment", "gradio"), default="solve")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="Mock server URL, without /v1")
+    parser.add_argument("--start-mock", action="store_true", help="Start the mock server on the --base-url port")
+    parser.add_argument("--gradio-port", type=int, default=7861)
+    parser.add_argument("--seed", type=int, default=0)
+    args, mock_args = parser.parse_known_args()
+    mock_args = [a for a in mock_args if a != "--"]
+
+    os.environ["OPENAI_API_BASE_URL"] = args.base_url.rstrip("/") + "/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ.pop("STEMMATE_CACHE_DIR", None)
+
+    mock = start_mock(int(args.base_url.rsplit(":", 1)[-1].split("/")[0]), mock_args) if args.start_mock else None
+    try:
+        images = synthetic_images(args.questions, args.seed)
+        httpx.post(f"{args.base_url}/stats/reset")
+        tracemalloc.start()
+        start = time.perf_counter()
+        if args.target == "gradio":
+            latencies, errors = run_gradio(images, args.concurrency, args.gradio_port)
+        else:
+            latencies, errors = asyncio.run(run_async(args.target, images, args.concurrency))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        calls = httpx.get(f"{args.base_url}/stats").json()
+    finally:
+        if mock is not None:
+            mock.terminate()
+
+    done = len(latencies)
+    in_flight = max(1, min(args.concurrency, args.questions))
+    print(f"target={args.target} questions={args.questions} concurrency={args.concurrency} errors={errors}")
+    print(f"throughput: {done / elapsed * 60:.1f} questions/min over {elapsed:.1f}s")
+    print(
+        f"latency: p50={percentile(latencies, 50):.2f}s p95={percentile(latencies, 95):.2f}s "
+        f"p99={percentile(latencies, 99):.2f}s max={max(latencies, default=float('nan')):.2f}s"
+    )
+    print(f"model calls per question: {calls['total'] / max(1, args.questions):.2f} {calls['calls']}")
+    print(
+        f"memory: peak traced {peak / 2**20:.1f} MiB, ~{peak / in_flight / 2**20:.2f} MiB per in-flight request, "
+        f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Measure cold start: import time of the app modules and latency of the first
+request, each in a fresh interpreter, against the mock OpenAI server.
+
+Usage:
+    python -m benchmarks.bench_startup --start-mock
+    python -m benchmarks.bench_startup --runs 5 --skip-gradio
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.bench_pipeline import start_mock
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = [m for m in ("openai", "httpx", "PIL.Image", "numpy", "gradio", "pandas") if m in sys.modules]
+print(json.dumps({{"seconds": seconds, "loaded": heavy}}))
+"""
+
+REQUEST_SNIPPET = """
+import asyncio, json, time
+start = time.perf_counter()
+from src import services
+from src.clients import warm_up
+imported = time.perf_counter() - start
+warmup = None
+if {warm}:
+    start = time.perf_counter()
+    warm_up()
+    warmup = time.perf_counter() - start
+
+async def main():
+    timings = []
+    for i in range(2):
+        start = time.perf_counter()
+        await services.agenerate("Solve the following problem step-by-step and provide the final answer: %d + 1" % i, model="mock")
+        timings.append(time.perf_counter() - start)
+    return timings
+
+first, second = asyncio.run(main())
+print(json.dumps({{"import": imported, "warmup": warmup, "first": first, "second": second}}))
+"""
+
+
+def run(snippet: str, env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-c", snippet], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def mean(values: list) -> float:
+    return sum(values) / len(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time and first-request latency.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--start-mock", action="store_true")
+    parser.add_argument("--skip-gradio", action="store_true", help="Do not time `import main`")
+    args, mock_args = parser.parse_known_args()
+    mock_args = [a for a in mock_args if a != "--"]
+
+    env = {
+        **os.environ,
+        "OPENAI_API_BASE_URL": args.base_url.rstrip("/") + "/v1",
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "mock"),
+        "PYTHONPATH": os.getcwd(),
+    }
+    mock = start_mock(int(args.base_url.rsplit(":", 1)[-1]), ["--latency", "fixed:0.05"] + mock_args) if args.start_mock else None
+    try:
+        modules = ["src.services", "src.utils"] + ([] if args.skip_gradio else ["main"])
+        for module in modules:
+            results = [run(IMPORT_SNIPPET.format(module=module), env) for _ in range(args.runs)]
+            print(f"import {module:<14} {mean([r['seconds'] for r in results]) * 1000:8.1f} ms  loads: {', '.join(results[0]['loaded']) or '-'}")
+
+        for warm in (False, True):
+            results = [run(REQUEST_SNIPPET.format(warm=warm), env) for _ in range(args.runs)]
+            label = "with warm_up()" if warm else "cold"
+            line = (
+                f"request {label:<15} import {mean([r['import'] for r in results]) * 1000:7.1f} ms  "
+                f"first {mean([r['first'] for r in results]) * 1000:7.1f} ms  "
+                f"second {mean([r['second'] for r in results]) * 1000:7.1f} ms"
+            )
+            if warm:
+                line += f"  warm_up {mean([r['warmup'] for r in results]) * 1000:7.1f} ms"
+            print(line)
+    finally:
+        if mock is not None:
+            mock.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Fuzz the solver output parser with the corpus in benchmarks/corpus/parser.
+
+Checks that every corpus file parses to its expected answer and step count,
+that streaming the same text in random deltas gives the same result as parsing
+it in one piece, and that mutated outputs (truncated, shuffled, with injected
+markdown noise) never raise. Captured model outputs can be added to the corpus
+together with an entry in expected.json.
+
+Usage:
+    python -m benchmarks.fuzz_parser --iterations 2000 --seed 0
+"""
+import argparse
+import glob
+import json
+import os
+import random
+
+from src.parsing import SolutionParser, parse_solution
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus", "parser")
+NOISE = ["\n", "## ", "**", "$$", "$", "```", "\\[", "\\]", "</think>", "<think>", "Step 3:", "Final Answer:", "\\boxed{", "}", " ", "\r"]
+
+
+def random_deltas(rng: random.Random, text: str) -> list:
+    deltas, i = [], 0
+    while i < len(text):
+        j = i + rng.randint(1, 16)
+        deltas.append(text[i:j])
+        i = j
+    return deltas
+
+
+def mutate(rng: random.Random, text: str) -> str:
+    lines = text.split("\n")
+    for _ in range(rng.randint(1, 5)):
+        op = rng.choice(("truncate", "shuffle", "noise", "drop", "duplicate"))
+        if op == "truncate":
+            text = "\n".join(lines)
+            lines = text[:rng.randint(0, len(text))].split("\n")
+        elif op == "shuffle":
+            rng.shuffle(lines)
+        elif op == "noise" and lines:
+            i = rng.randrange(len(lines))
+            at = rng.randint(0, len(lines[i]))
+            lines[i] = lines[i][:at] + rng.choice(NOISE) + lines[i][at:]
+        elif op == "drop" and lines:
+            lines.pop(rng.randrange(len(lines)))
+        elif op == "duplicate" and lines:
+            i = rng.randrange(len(lines))
+            lines.insert(i, lines[i])
+    return "\n".join(lines)
+
+
+def check(rng: random.Random, text: str, json_mode: bool) -> dict:
+    expected = parse_solution(text, json_mode=json_mode)
+    assert isinstance(expected["answer"], str) and all(isinstance(step, str) for step in expected["steps"])
+    parser = SolutionParser(json_mode=json_mode)
+    for delta in random_deltas(rng, text):
+        parser.feed(delta)
+    streamed = parser.finish()
+    assert streamed == expected, f"streamed {streamed!r} != parsed {expected!r}"
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz the solver output parser.")
+    parser.add_argument("--iterations", type=int, default=500, help="Mutations per corpus file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with open(os.path.join(CORPUS_DIR, "expected.json"), encoding="utf-8") as f:
+        expectations = json.load(f)
+
+    failures = 0
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.txt"))):
+        name = os.path.basename(path)
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        json_mode = name.startswith("json")
+
+        result = check(rng, text, json_mode)
+        expected = expectations.get(name)
+        if expected and (result["answer"] != expected["answer"] or len(result["steps"]) != expected["steps"]):
+            failures += 1
+            print(f"FAIL {name}: got answer {result['answer']!r} with {len(result['steps'])} steps, expected {expected}")
+
+        for i in range(args.iterations):
+            mutated = mutate(rng, text)
+            try:
+                check(rng, mutated, json_mode)
+            except Exception as e:
+                failures += 1
+                print(f"FAIL {name} mutation {i}: {type(e).__name__}: {e}\n{mutated!r}")
+                break
+    print(f"{'FAILED' if failures else 'OK'}: {failures} failure(s)")
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
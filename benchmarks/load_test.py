@@ -0,0 +1,143 @@
+"""
+Load test showing how solve throughput scales with the number of replicas.
+
+For k = 1..N replicas, `--users-per-replica * k` simulated users send solves
+for `--duration` seconds. Each user sticks to one replica, like a Gradio
+session does, and users are spread round-robin across the first k replicas.
+The test prints requests/sec and latency percentiles per step.
+
+Either point it at running replicas (e.g. Modal deployments or containers behind
+session affinity) or let it start local replicas of main.py against the mock
+server:
+    python -m benchmarks.load_test --start-local 4 --duration 60
+    python -m benchmarks.load_test --replicas https://a.modal.run,https://b.modal.run
+Local replicas share STEMMATE_SHARED_CACHE (set it to a redis:// URL to share
+cache entries and session results between the processes).
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from PIL import Image, ImageDraw
+
+from benchmarks.bench_pipeline import percentile, start_mock
+
+
+def question_image(directory: str, index: int) -> str:
+    path = os.path.join(directory, f"load-{index}.png")
+    image = Image.new("RGB", (800, 400), "white")
+    ImageDraw.Draw(image).text((20, 20), f"Question {index}: what is {index} + {index}?", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    with open(path, "wb") as f:
+        f.write(buffer.getvalue())
+    return path
+
+
+def start_replicas(count: int, mock_url: str, first_port: int) -> tuple:
+    processes, urls = [], []
+    for i in range(count):
+        port = first_port + i
+        env = {
+            **os.environ,
+            "GRADIO_SERVER_PORT": str(port),
+            "OPENAI_API_BASE_URL": mock_url + "/v1",
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "mock"),
+        }
+        processes.append(subprocess.Popen([sys.executable, "main.py"], env=env, stdout=subprocess.DEVNULL))
+        urls.append(f"http://127.0.0.1:{port}/")
+    deadline = time.monotonic() + 120
+    for url in urls:
+        while True:
+            try:
+                httpx.get(url, timeout=2)
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Replica {url} did not start")
+                time.sleep(0.5)
+    return processes, urls
+
+
+def run_step(urls: list, users: int, duration: float, directory: str) -> tuple:
+    from gradio_client import Client, handle_file
+
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+    counter = iter(range(10 ** 9))
+
+    def user(url: str):
+        nonlocal errors
+        client = Client(url, verbose=False)
+        while time.monotonic() < stop:
+            with lock:
+                index = next(counter)
+            path = question_image(directory, index)
+            start = time.perf_counter()
+            try:
+                client.submit(
+                    handle_file(path), True, ["Qwen/Qwen3-Next-80B-A3B-Thinking"], "Lecture/Direct Instruction", "Yoda",
+                    api_name="/solve_with_progress",
+                ).result()
+            except Exception:
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=user, args=(urls[i % len(urls)],)) for i in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure solve throughput against 1..N replicas.")
+    parser.add_argument("--replicas", help="Comma-separated replica URLs")
+    parser.add_argument("--start-local", type=int, default=0, help="Start this many local replicas of main.py")
+    parser.add_argument("--mock-port", type=int, default=8000)
+    parser.add_argument("--first-port", type=int, default=7870)
+    parser.add_argument("--users-per-replica", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    args, mock_args = parser.parse_known_args()
+    mock_args = [a for a in mock_args if a != "--"]
+
+    processes = []
+    directory = tempfile.mkdtemp()
+    try:
+        if args.start_local:
+            mock_url = f"http://127.0.0.1:{args.mock_port}"
+            processes.append(start_mock(args.mock_port, mock_args))
+            replica_processes, urls = start_replicas(args.start_local, mock_url, args.first_port)
+            processes += replica_processes
+        elif args.replicas:
+            urls = [url.strip() for url in args.replicas.split(",") if url.strip()]
+        else:
+            parser.error("pass --replicas or --start-local")
+
+        print(f"{'replicas':>8} {'users':>6} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'errors':>7}")
+        for k in range(1, len(urls) + 1):
+            users = args.users_per_replica * k
+            latencies, errors, elapsed = run_step(urls[:k], users, args.duration, directory)
+            print(
+                f"{k:>8} {users:>6} {len(latencies) / elapsed:>8.2f} {percentile(latencies, 50):>7.2f} "
+                f"{percentile(latencies, 95):>7.2f} {percentile(latencies, 99):>7.2f} {errors:>7}"
+            )
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+OpenAI-compatible stub server for offline benchmarks.
+
+Serves POST /v1/chat/completions (plain and streamed) with synthetic responses
+shaped like STEMMate's prompts expect, or with recorded responses replayed from
+a JSONL file of {"match": "<substring of the prompt>", "content": "..."}.
+Latency, streaming speed and errors are configurable; GET /stats returns the
+calls served per model and POST /stats/reset clears them.
+
+Usage:
+    python -m benchmarks.mock_server --port 8000 --latency lognormal:1.5,0.4 --error-rate 0.02
+    OPENAI_API_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock python main.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+QUESTION_TEMPLATES = (
+    "A cyclist rides ${a}$ km in ${b}$ minutes. What is her average speed in km/h?",
+    "A tank holds ${a}$ litres and drains at ${b}$ litres per minute. How long until it is empty?",
+    "Solve for $x$: ${a}x + {b} = 0$.",
+    "The sides of a rectangle are ${a}$ cm and ${b}$ cm. Find the length of its diagonal.",
+    "A shop discounts a ${a}$ dollar jacket by ${b}\\%$. What is the sale price?",
+    "Two dice are rolled {a} times. How many double sixes do you expect?",
+    "A ball is thrown upwards at ${a}$ m/s. After how many seconds does it reach its highest point?",
+    "Find the sum of the first ${a}$ terms of the arithmetic sequence starting at ${b}$ with difference $3$.",
+)
+
+
+def parse_distribution(spec: str):
+    """
+    Build a sampler from "fixed:S", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA" (seconds).
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockBackend:
+    """Generates responses and failures for the stub endpoint."""
+
+    def __init__(
+        self,
+        latency: str = "fixed:0.5",
+        token_delay: float = 0.005,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        hang_rate: float = 0.0,
+        agreement: float = 0.8,
+        thinking_tokens: int = 0,
+        responses_path: str = None,
+    ):
+        self.latency = parse_distribution(latency)
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.hang_rate = hang_rate
+        self.agreement = agreement
+        self.thinking_tokens = thinking_tokens
+        self.recorded = []
+        if responses_path:
+            with open(responses_path, encoding="utf-8") as f:
+                self.recorded = [json.loads(line) for line in f if line.strip()]
+        self.calls = Counter()
+
+    def failure(self):
+        """An (status, type) pair to fail the call with, "hang", or None."""
+        roll = random.random()
+        if roll < self.error_rate:
+            return 500, "server_error"
+        roll -= self.error_rate
+        if roll < self.rate_limit_rate:
+            return 429, "rate_limit_exceeded"
+        roll -= self.rate_limit_rate
+        if roll < self.hang_rate:
+            return "hang"
+        return None
+
+    def content(self, messages: list) -> str:
+        prompt, has_image = _prompt_text(messages)
+        for record in self.recorded:
+            if record["match"] in prompt:
+                return record["content"]
+        if has_image:
+            return self._question(prompt)
+        if "Solve the following problem step-by-step" in prompt:
+            return self._solution(prompt)
+        if "## Question" in prompt:
+            return self._questions(prompt)
+        return "## Solution:\nLet us walk through it together. " + "Each step follows from the previous one. " * 40
+
+    def _question(self, prompt: str) -> str:
+        # Distinct images give distinct questions, so caches do not hide model calls.
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        return f"Question {digest}: A train travels $120$ km in $1.5$ hours. What is its average speed in km/h?"
+
+    def _questions(self, prompt: str) -> str:
+        # Random picks from a few templates, so some questions are near-duplicates
+        # the question bank has to drop.
+        count = re.search(r"(?:Generate|Number of questions:) (\d+)", prompt)
+        count = int(count.group(1)) if count else 3
+        questions = []
+        for i in range(1, count + 1):
+            template = random.choice(QUESTION_TEMPLATES)
+            questions.append(f"## Question {i}:\n" + template.format(a=random.randint(2, 99), b=random.randint(2, 99)))
+        return "\n\n".join(questions)
+
+    def _solution(self, prompt: str) -> str:
+        answer = "80" if random.random() < self.agreement else str(random.randint(1, 200))
+        thinking = ""
+        if self.thinking_tokens:
+            thinking = "Let me think about this carefully. " * (self.thinking_tokens // 7) + "</think>\n"
+        return thinking + (
+            "## Step 1: Identify the quantities\nDistance $d = 120$ km, time $t = 1.5$ h.\n\n"
+            "## Step 2: Apply the formula\n$$\nv = \\frac{d}{t} = \\frac{120}{1.5}\n$$\n\n"
+            f"## Step 3: Compute\n$v = {answer}$ km/h.\n\n"
+            f"## Final Answer: {answer}\n"
+        )
+
+
+def _prompt_text(messages: list) -> tuple:
+    parts, has_image = [], False
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                parts.append(part["text"])
+            elif part.get("type") == "image_url":
+                has_image = True
+                parts.append(hashlib.sha256(part["image_url"]["url"].encode()).hexdigest())
+    return "\n".join(parts), has_image
+
+
+def _tokens(text: str) -> list:
+    # Roughly word-sized deltas, keeping whitespace and newlines attached.
+    tokens, start = [], 0
+    for i, char in enumerate(text):
+        if char in " \n" and i + 1 > start:
+            tokens.append(text[start:i + 1])
+            start = i + 1
+    if start < len(text):
+        tokens.append(text[start:])
+    return tokens
+
+
+def create_app(backend: MockBackend) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/stats")
+    def stats():
+        return {"calls": dict(backend.calls), "total": sum(backend.calls.values())}
+
+    @app.post("/stats/reset")
+    def reset():
+        backend.calls.clear()
+        return {"ok": True}
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": model, "object": "model", "owned_by": "mock"} for model in backend.calls]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        backend.calls[model] += 1
+
+        failure = backend.failure()
+        if failure == "hang":
+            await asyncio.sleep(3600)
+        elif failure:
+            status, kind = failure
+            return JSONResponse({"error": {"message": f"Injected {kind}", "type": kind}}, status_code=status)
+
+        content = backend.content(body.get("messages", []))
+        tokens = _tokens(content)
+        usage = {"prompt_tokens": len(_prompt_text(body.get("messages", []))[0]) // 4, "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        await asyncio.sleep(backend.latency())
+
+        if not body.get("stream"):
+            await asyncio.sleep(backend.token_delay * len(tokens))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        def chunk(delta: dict, finish_reason=None, chunk_usage=None, choices=True) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else [],
+            }
+            if chunk_usage is not None:
+                data["usage"] = chunk_usage
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                await asyncio.sleep(backend.token_delay)
+                yield chunk({"content": token})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk({}, chunk_usage=usage, choices=False)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="fixed:0.5", help="Time to first token: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls failing with HTTP 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of calls that never answer")
+    parser.add_argument("--agreement", type=float, default=0.8, help="Probability a solver returns the majority answer")
+    parser.add_argument("--thinking-tokens", type=int, default=0, help="Length of a </think>-terminated preamble in solutions")
+    parser.add_argument("--responses", help="JSONL of recorded {match, content} responses to replay")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    backend = MockBackend(
+        latency=args.latency,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        hang_rate=args.hang_rate,
+        agreement=args.agreement,
+        thinking_tokens=args.thinking_tokens,
+        responses_path=args.responses,
+    )
+    uvicorn.run(create_app(backend), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,73 @@
 from dotenv import load_dotenv
 
 load_dotenv()
+import os
 import gradio as gr
-from src.utils import process_image_and_solve_with_progress, process_image_and_augment_questions
+from contextlib import aclosing
+from src.utils import process_image_and_solve_with_progress, process_image_and_augment_questions, reexplain, model_queue
+from src.question_bank import QUESTION_BATCH_SIZE
+from src.scheduler import scheduler, INTERACTIVE, BULK, Overloaded
+from src.extraction import extract, PREFETCH_EXTRACTION
 
-def solve_with_progress(image, enable_multi_model, selected_models, progress=gr.Progress(), lecturing_methods="Demonstration", characteristic="enthusiastic and encouraging"):
+def user_key(request: gr.Request) -> str:
+    """Rate-limit key of the browser session making the request"""
+    if request is None:
+        return "anonymous"
+    return request.session_hash or (request.client.host if request.client else "anonymous")
+
+async def solve_with_progress(image, enable_multi_model, selected_models, progress=gr.Progress(), lecturing_methods="Demonstration", characteristic="enthusiastic and encouraging", request: gr.Request = None):
     """Wrapper function to show progress during solving"""
     if image is None:
-        yield "Please upload an image first.", {}, ""
+        yield "Please upload an image first.", "", "", "", [], None
+        return
     
     progress(0.1, desc="Processing image...")
+    # Charged for the models that will run: the full queue when none are selected.
+    cost = len(selected_models or model_queue) if enable_multi_model else 1
     try:
-        result = process_image_and_solve_with_progress(image, enable_multi_model, selected_models, progress, lecturing_methods, characteristic)
-        for i in result:
-            yield i
+        async with scheduler.admit(user_key(request), INTERACTIVE, cost=cost) as admission:
+            if admission.degraded:
+                # Under load, answer with one model rather than queue everyone.
+                enable_multi_model = False
+            result = process_image_and_solve_with_progress(image, enable_multi_model, selected_models, progress, lecturing_methods, characteristic)
+            async with aclosing(result) as result:
+                async for i in result:
+                    yield i
+    except Overloaded as e:
+        yield str(e), "", "", "", [], None
     except Exception as e:
-        yield f"Error: {str(e)}", {}, ""
+        yield f"Error: {str(e)}", "", "", "", [], None
+
+async def reexplain_with_progress(session_id, lecturing_methods, characteristic, request: gr.Request = None):
+    """Re-style the last explanation of this session without solving again"""
+    try:
+        async with scheduler.admit(user_key(request), INTERACTIVE):
+            async with aclosing(reexplain(session_id, lecturing_methods, characteristic)) as result:
+                async for explanation in result:
+                    yield explanation
+    except Overloaded as e:
+        yield str(e)
+
+async def augment_questions(image, num_augmented, request: gr.Request = None):
+    """Generate practice questions as bulk work, behind interactive solves"""
+    if image is None:
+        return "Please upload an image first."
+    try:
+        async with scheduler.admit(user_key(request), BULK, cost=-(-int(num_augmented) // QUESTION_BATCH_SIZE)):
+            return await process_image_and_augment_questions(image, num_augmented)
+    except Overloaded as e:
+        return str(e)
+
+async def prefetch_question(image, request: gr.Request = None):
+    """Extract the question on upload, while the user is still choosing settings"""
+    if image is None or not PREFETCH_EXTRACTION:
+        return
+    try:
+        async with scheduler.admit(user_key(request), INTERACTIVE):
+            await extract(image).result()
+    except Exception:
+        # Solve and Generate extract again and report the error themselves.
+        pass
 
 # Custom CSS for better styling
 custom_css = """
@@ -35,12 +87,15 @@ custom_css = """
 
 with gr.Blocks(css=custom_css, title="STEMMate") as demo:
     gr.Markdown("# 🧮 STEMMate", elem_classes=["title"])
+    # Id of the last finished solve of this browser session, reused by "Re-explain".
+    session_id = gr.State(None)
 
     with gr.Tabs():
         with gr.Tab("Question generator"):
             with gr.Column():
-                image_input = gr.Image(type="pil", label="Upload Image", height=400)
-                num_questions_slider = gr.Slider(1, 5, value=3, step=1, label="Number of Questions to Generate")
+                # Uploads arrive as files, passed to the vision model without decoding.
+                question_image_input = gr.Image(type="filepath", label="Upload Image", height=400)
+                num_questions_slider = gr.Slider(1, 20, value=3, step=1, label="Number of Questions to Generate")
                 generate_btn = gr.Button("Generate Question", variant="primary", size="lg")
                 question_output = gr.Markdown(
                     label="Generated Question",
@@ -53,9 +108,10 @@ with gr.Blocks(css=custom_css, title="STEMMate") as demo:
                     ]
                 )
 
+                question_image_input.upload(fn=prefetch_question, inputs=[question_image_input], show_progress="hidden")
                 generate_btn.click(
-                    fn=process_image_and_augment_questions,  # Placeholder function
-                    inputs=[image_input, num_questions_slider],
+                    fn=augment_questions,
+                    inputs=[question_image_input, num_questions_slider],
                     outputs=[question_output]
                 )
         with gr.Tab("📚 Solver"):
@@ -65,7 +121,7 @@ with gr.Blocks(css=custom_css, title="STEMMate") as demo:
                 with gr.Column(scale=1):
                     gr.Markdown("## 📸 Input")
                     image_input = gr.Image(
-                        type="pil", 
+                        type="filepath",
                         label="Upload Math Question Image",
                         height=400
                     )
@@ -121,6 +177,7 @@ with gr.Blocks(css=custom_css, title="STEMMate") as demo:
                         )
                     
                     solve_btn = gr.Button("🚀 Solve Question", variant="primary", size="lg")
+                    reexplain_btn = gr.Button("🎭 Re-explain", variant="secondary")
                     clear_btn = gr.Button("🗑️ Clear All", variant="secondary")
                     
                 with gr.Column(scale=2):
@@ -175,16 +232,23 @@ with gr.Blocks(css=custom_css, title="STEMMate") as demo:
                             )
             
             # Event handlers
+            image_input.upload(fn=prefetch_question, inputs=[image_input], show_progress="hidden")
             solve_btn.click(
                 fn=solve_with_progress,
                 inputs=[image_input, enable_multi_model, selected_models, lecturing_methods, characteristic],
-                outputs=[question_output, steps_output, answer_output, explanation_output],
+                outputs=[question_output, steps_output, answer_output, explanation_output, model_comparison, session_id],
                 show_progress=True
             )
+
+            reexplain_btn.click(
+                fn=reexplain_with_progress,
+                inputs=[session_id, lecturing_methods, characteristic],
+                outputs=[explanation_output]
+            )
             
             clear_btn.click(
-                fn=lambda: (None, "", {}, "", "", []),
-                outputs=[image_input, question_output, steps_output, answer_output, explanation_output, model_comparison]
+                fn=lambda: (None, "", {}, "", "", [], None),
+                outputs=[image_input, question_output, steps_output, answer_output, explanation_output, model_comparison, session_id]
             )
 
             gr.Markdown(
@@ -193,12 +257,20 @@ with gr.Blocks(css=custom_css, title="STEMMate") as demo:
 - Enable multi-model consensus for better accuracy
 - Check the detailed steps tab for complete solutions
 - Use the settings to customize which models to use
+- Change the style or tutor and press Re-explain to get a new explanation without solving again
 """)
 
+# Events run concurrently per worker; the pipeline is I/O bound, so this can be
+# far above the Gradio default of 1. Requests beyond the queue size are rejected.
+demo.queue(
+    default_concurrency_limit=int(os.getenv("STEMMATE_QUEUE_CONCURRENCY", "32")),
+    max_size=int(os.getenv("STEMMATE_QUEUE_MAX_SIZE", "256")),
+)
+
 if __name__ == "__main__":
     demo.launch(
         server_name="0.0.0.0",
-        server_port=7860,
+        server_port=int(os.getenv("GRADIO_SERVER_PORT", "7860")),
         share=False,
         debug=True
     )
\ No newline at end of file
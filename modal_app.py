@@ -5,11 +5,32 @@ from modal import FilePatternMatcher
 
 app = modal.App("STEMMate")
 
+# Scaling, read when deploying. The Gradio queue keeps a session on the container
+# that accepted it, so scale out (STEMMATE_MAX_CONTAINERS > 1) only behind
+# session affinity; per-container concurrency is the main lever otherwise.
+MIN_CONTAINERS = int(os.getenv("STEMMATE_MIN_CONTAINERS", "0"))
+MAX_CONTAINERS = int(os.getenv("STEMMATE_MAX_CONTAINERS", "1"))
+CONTAINER_CONCURRENCY = int(os.getenv("STEMMATE_CONTAINER_CONCURRENCY", "100"))
+CONTAINER_MEMORY = int(os.getenv("STEMMATE_CONTAINER_MEMORY", "2048"))
+
+# Persistent data (the question bank and the index of solved questions) lives on a Volume, so it survives cold
+# starts and is seen by every container that starts after it was committed.
+DATA_DIR = "/data"
+data_volume = modal.Volume.from_name("stemmate-data", create_if_missing=True)
+
 # Define image with dependencies
 image = (
     modal.Image.debian_slim(python_version="3.12")
     .pip_install_from_requirements("requirements.txt")
     .apt_install("rsync")  # Use Modal's built-in method for apt installs
+    .env({
+        # Share cache entries and session results between containers.
+        "STEMMATE_SHARED_CACHE": os.getenv("STEMMATE_SHARED_CACHE", "modal"),
+        "STEMMATE_QUEUE_CONCURRENCY": os.getenv("STEMMATE_QUEUE_CONCURRENCY", "32"),
+        "STEMMATE_QUEUE_MAX_SIZE": os.getenv("STEMMATE_QUEUE_MAX_SIZE", "256"),
+        "STEMMATE_QUESTION_BANK": f"{DATA_DIR}/questions.sqlite",
+        "STEMMATE_SOLUTION_INDEX": f"{DATA_DIR}/solutions.sqlite",
+    })
 )
 
 # Add source code to image (exclude virtual envs)
@@ -20,29 +41,66 @@ image = image.add_local_dir(
     ignore=FilePatternMatcher("**/venv/**", "**/.venv/**", "**/__pycache__/**")
 )
 
-@app.function(
+# Imports are captured in a memory snapshot, so cold starts skip loading
+# gradio and the pipeline; the HTTP pool is opened after restore, since sockets
+# cannot be snapshotted.
+@app.cls(
     image=image,
     secrets=[modal.Secret.from_name("openai-secrets")],
     timeout=600,
-    max_containers=1,
-    memory=8192,
+    min_containers=MIN_CONTAINERS,
+    max_containers=MAX_CONTAINERS,
+    memory=CONTAINER_MEMORY,
+    enable_memory_snapshot=True,
+    volumes={DATA_DIR: data_volume},
 )
-@modal.asgi_app()
-def gradio_app():
-    import sys
-    sys.path.append("/app")
-    
-    # Check environment variables
-    print(f"API Key loaded: {'✓' if os.getenv('OPENAI_API_KEY') else '✗'}")
-    print(f"Base URL: {os.getenv('OPENAI_API_BASE_URL', 'Not set')}")
-    
-    # Import and setup Gradio app
-    from main import demo
-    from fastapi import FastAPI
-    
-    app = FastAPI()
-    demo.queue(max_size=20)
-    
-    # Mount Gradio app
-    from gradio.routes import mount_gradio_app
-    return mount_gradio_app(app=app, blocks=demo, path="/")
\ No newline at end of file
+@modal.concurrent(max_inputs=CONTAINER_CONCURRENCY)
+class GradioApp:
+    @modal.enter(snap=True)
+    def load(self):
+        import sys
+        sys.path.append("/app")
+
+        import main  # noqa: F401 - gradio, the UI and the pipeline modules
+        import openai  # noqa: F401 - imported lazily by src.clients otherwise
+        import PIL.Image  # noqa: F401
+
+    @modal.enter(snap=False)
+    def warm_up(self):
+        # Check environment variables
+        print(f"API Key loaded: {'✓' if os.getenv('OPENAI_API_KEY') else '✗'}")
+        print(f"Base URL: {os.getenv('OPENAI_API_BASE_URL', 'Not set')}")
+
+        from src.clients import warm_up
+        warm_up()
+
+    @modal.exit()
+    def save(self):
+        # Volumes also commit in the background; this keeps the last writes.
+        data_volume.commit()
+
+    @modal.asgi_app()
+    def gradio_app(self):
+        from contextlib import asynccontextmanager
+
+        from main import demo
+        from fastapi import FastAPI
+        from fastapi.responses import PlainTextResponse
+        from src import tracing
+        from src.clients import awarm_up
+
+        @asynccontextmanager
+        async def lifespan(app):
+            # Open the async pool on the loop that will serve requests.
+            await awarm_up()
+            yield
+
+        app = FastAPI(lifespan=lifespan)
+
+        @app.get("/metrics", response_class=PlainTextResponse)
+        def metrics():
+            return tracing.prometheus_text()
+
+        # Mount Gradio app
+        from gradio.routes import mount_gradio_app
+        return mount_gradio_app(app=app, blocks=demo, path="/")
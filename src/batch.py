@@ -0,0 +1,185 @@
+"""
+Batch solving for whole worksheets, exams and problem banks.
+
+Usage:
+    python -m src.batch <image directory or manifest> --output results.jsonl
+
+A manifest is either a text file with one image path per line or a JSONL file
+with {"id": ..., "image": ...} records. Results are appended to the output as
+each image finishes, so an interrupted run resumes where it stopped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+from src.utils import solve_image, model_queue
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def load_items(source: str) -> list:
+    """
+    Collect (id, image path) pairs from a directory or a manifest file.
+    Args:
+        source (str): Image directory, text manifest or JSONL manifest.
+    Returns:
+        list: (id, path) pairs in a stable order.
+    """
+    if os.path.isdir(source):
+        items = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    items.append((os.path.relpath(path, source), path))
+        return sorted(items)
+
+    base = os.path.dirname(os.path.abspath(source))
+    items = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if source.endswith(".jsonl"):
+                record = json.loads(line)
+                path = record["image"]
+                item_id = str(record.get("id", path))
+            else:
+                path = item_id = line
+            items.append((item_id, path if os.path.isabs(path) else os.path.join(base, path)))
+    return items
+
+
+def completed_ids(output_path: str) -> set:
+    """Ids already solved successfully in an existing output file (the checkpoint)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a truncated last line; that item is simply redone.
+                continue
+            if "error" not in record:
+                done.add(record["id"])
+    return done
+
+
+async def solve_batch(
+    items: list,
+    output_path: str,
+    concurrency: int = 8,
+    models: list = None,
+    **solve_kwargs
+) -> dict:
+    """
+    Solve every image with bounded concurrency, appending one JSON line per image.
+    Items already present in the output are skipped.
+    Args:
+        items (list): (id, image path) pairs.
+        output_path (str): JSONL file the results are appended to.
+        concurrency (int): Number of images processed at the same time.
+        models (list): Models used for consensus.
+        **solve_kwargs: Extra arguments for `solve_image`.
+    Returns:
+        dict: Counts of solved, failed and skipped images, of the questions
+        solved on them (a page may hold several) and the throughput of both.
+    """
+    done = completed_ids(output_path)
+    pending = [(item_id, path) for item_id, path in items if item_id not in done]
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+
+    stats = {"solved": 0, "failed": 0, "skipped": len(items) - len(pending), "questions": 0}
+    start = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        async def worker():
+            while True:
+                try:
+                    item_id, path = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    result = await solve_image(path, models=models, **solve_kwargs)
+                    write({"id": item_id, "image": path, **result})
+                    stats["solved"] += 1
+                    stats["questions"] += len(result.get("parts") or [result])
+                except Exception as e:
+                    write({"id": item_id, "image": path, "error": str(e)})
+                    stats["failed"] += 1
+                finished = stats["solved"] + stats["failed"]
+                elapsed = time.perf_counter() - start
+                print(f"[{finished}/{len(pending)}] {item_id} ({stats['questions'] / elapsed * 60:.1f} questions/min)")
+
+        await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = elapsed
+    stats["questions_per_minute"] = stats["questions"] / elapsed * 60 if elapsed else 0.0
+    stats["images_per_minute"] = stats["solved"] / elapsed * 60 if elapsed else 0.0
+    return stats
+
+
+def export_parquet(output_path: str, parquet_path: str):
+    """Convert the JSONL results to Parquet (requires pandas with pyarrow or fastparquet)."""
+    import pandas as pd
+
+    # Failed attempts stay in the JSONL log; keep only the latest record per image.
+    frame = pd.read_json(output_path, lines=True).drop_duplicates("id", keep="last")
+    if "steps" in frame:
+        frame["steps"] = frame["steps"].map(lambda steps: json.dumps(steps, ensure_ascii=False))
+    if "parts" in frame:
+        # Per-question results of multi-question pages; empty for single questions.
+        frame["parts"] = frame["parts"].map(lambda parts: json.dumps(parts, ensure_ascii=False) if isinstance(parts, list) else "")
+    frame.to_parquet(parquet_path, index=False)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Solve a directory or manifest of question images.")
+    parser.add_argument("source", help="Image directory, text manifest or JSONL manifest")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL results file (also the checkpoint)")
+    parser.add_argument("--parquet", help="Also export the results to this Parquet file")
+    parser.add_argument("--concurrency", type=int, default=8, help="Images processed at the same time")
+    parser.add_argument("--models", nargs="+", default=model_queue, help="Models used for consensus")
+    parser.add_argument("--lecturing-method", default="Lecture/Direct Instruction")
+    parser.add_argument("--characteristic", default="Yoda")
+    parser.add_argument("--language", default="Vietnamese")
+    parser.add_argument("--no-explanation", action="store_true", help="Skip the personalized explanation")
+    args = parser.parse_args()
+
+    stats = asyncio.run(solve_batch(
+        load_items(args.source),
+        args.output,
+        concurrency=args.concurrency,
+        models=args.models,
+        lecturing_method=args.lecturing_method,
+        characteristic=args.characteristic,
+        language=args.language,
+        explain=not args.no_explanation,
+    ))
+    print(
+        f"Solved {stats['solved']} images ({stats['questions']} questions), failed {stats['failed']}, "
+        f"skipped {stats['skipped']} in {stats['seconds']:.1f}s "
+        f"({stats['questions_per_minute']:.1f} questions/min, {stats['images_per_minute']:.1f} images/min)"
+    )
+    if args.parquet:
+        export_parquet(args.output, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Directory for the persistent cache tier; the disk tier is disabled when unset.
+CACHE_DIR = os.getenv("STEMMATE_CACHE_DIR")
+DISK_CACHE_MAX_ENTRIES = int(os.getenv("STEMMATE_DISK_CACHE_MAX_ENTRIES", "100000"))
+# Cache tier shared by every replica: "modal" (a Modal Dict per cache), a
+# redis:// URL, or "memory" for an in-process stand-in; disabled when unset.
+SHARED_CACHE = os.getenv("STEMMATE_SHARED_CACHE")
+
+
+class LRUCache:
+    """In-process LRU cache with an entry limit and optional TTL."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, created = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, created: float = None):
+        with self._lock:
+            self._data[key] = (value, created or time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Persistent cache tier storing JSON-serializable values in SQLite."""
+
+    # Trimming to max_entries runs once every this many writes.
+    PRUNE_EVERY = 256
+
+    def __init__(self, path: str, ttl: float = None, max_entries: int = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl is not None and time.time() - created > self.ttl:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return json.loads(value), created
+
+    def set(self, key: str, value, created: float = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value), created or time.time()),
+            )
+            self._writes += 1
+            if self.max_entries is not None and self._writes % self.PRUNE_EVERY == 0:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def evict_expired(self) -> int:
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+            return cursor.rowcount
+
+
+class MemoryStore:
+    """
+    In-process stand-in for a shared store, for local runs and tests: every
+    instance with the same name sees the same entries, like replicas sharing a
+    Modal Dict or Redis would.
+    """
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, name: str, ttl: float = None):
+        self.ttl = ttl
+        with self._stores_lock:
+            self._data = self._stores.setdefault(name, {})
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, created = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._data[key]
+                return None
+        return json.loads(value), created
+
+    def set(self, key: str, value, created: float = None):
+        # Stored serialized so values behave as they would in a remote store.
+        with self._lock:
+            self._data[key] = (json.dumps(value), created or time.time())
+
+
+class ModalDictStore:
+    """Shared tier backed by a Modal Dict, visible to every container of the app."""
+
+    def __init__(self, name: str, ttl: float = None):
+        import modal
+
+        self.ttl = ttl
+        self._dict = modal.Dict.from_name(f"stemmate-{name}", create_if_missing=True)
+
+    def get(self, key: str):
+        entry = self._dict.get(key)
+        if entry is None:
+            return None
+        value, created = entry
+        if self.ttl is not None and time.time() - created > self.ttl:
+            self._dict.pop(key, None)
+            return None
+        return json.loads(value), created
+
+    def set(self, key: str, value, created: float = None):
+        self._dict[key] = (json.dumps(value), created or time.time())
+
+
+class RedisStore:
+    """Shared tier on any Redis-compatible server; entries expire through Redis TTLs."""
+
+    def __init__(self, name: str, url: str, ttl: float = None):
+        import redis
+
+        self.prefix = f"stemmate:{name}:"
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        raw = self._redis.get(self.prefix + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry["value"], entry["created"]
+
+    def set(self, key: str, value, created: float = None):
+        created = created or time.time()
+        expire = None
+        if self.ttl is not None:
+            expire = max(1, int(self.ttl - (time.time() - created)))
+        self._redis.set(self.prefix + key, json.dumps({"value": value, "created": created}), ex=expire)
+
+
+def make_shared_store(name: str, ttl: float = None, backend: str = SHARED_CACHE):
+    """
+    Build the shared tier selected by STEMMATE_SHARED_CACHE, or None when unset.
+    """
+    if not backend:
+        return None
+    if backend == "memory":
+        return MemoryStore(name, ttl)
+    if backend == "modal":
+        return ModalDictStore(name, ttl)
+    if backend.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(name, backend, ttl)
+    raise ValueError(f"Unknown STEMMATE_SHARED_CACHE backend: {backend}")
+
+
+class TieredCache:
+    """
+    Memory LRU in front of an optional persistent tier and an optional tier
+    shared between replicas, with hit/miss counters. Values found in a lower
+    tier are promoted to memory keeping their original age, so the TTL is
+    measured from when the value was first produced.
+    """
+
+    def __init__(self, name: str, memory: LRUCache, disk: SQLiteCache = None, shared=None):
+        self.name = name
+        self.memory = memory
+        self.disk = disk
+        self.shared = shared
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        value = self._get_local(key)
+        if value is None and self.shared is not None:
+            value = self._promote_shared(key, self.shared.get(key))
+        if value is None:
+            self.misses += 1
+        return value
+
+    async def aget(self, key: str):
+        """Async version of `get`; the shared tier is a network call, made off the event loop."""
+        value = self._get_local(key)
+        if value is None and self.shared is not None:
+            value = self._promote_shared(key, await asyncio.to_thread(self.shared.get, key))
+        if value is None:
+            self.misses += 1
+        return value
+
+    def _get_local(self, key: str):
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                value, created = entry
+                self.memory.set(key, value, created)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+        return None
+
+    def _promote_shared(self, key: str, entry):
+        if entry is None:
+            return None
+        value, created = entry
+        self.memory.set(key, value, created)
+        self.hits += 1
+        self.shared_hits += 1
+        return value
+
+    def set(self, key: str, value):
+        created = self._set_local(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value, created)
+
+    async def aset(self, key: str, value):
+        """Async version of `set`."""
+        created = self._set_local(key, value)
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.set, key, value, created)
+
+    def _set_local(self, key: str, value) -> float:
+        created = time.time()
+        self.memory.set(key, value, created)
+        if self.disk is not None:
+            self.disk.set(key, value, created)
+        return created
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self.memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def make_cache(name: str, max_entries: int = 1024, ttl: float = None) -> TieredCache:
+    """
+    Build a cache with a memory tier, a SQLite tier when STEMMATE_CACHE_DIR is set
+    and a shared tier when STEMMATE_SHARED_CACHE is set.
+    Args:
+        name (str): Cache name, also used as the SQLite file name.
+        max_entries (int): Size limit of the in-process tier.
+        ttl (float): Seconds before an entry expires, or None to keep it forever.
+    Returns:
+        TieredCache: The configured cache.
+    """
+    disk = None
+    if CACHE_DIR:
+        disk = SQLiteCache(os.path.join(CACHE_DIR, f"{name}.sqlite"), ttl=ttl, max_entries=DISK_CACHE_MAX_ENTRIES)
+    return TieredCache(name, LRUCache(max_entries, ttl=ttl), disk, make_shared_store(name, ttl))
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution (threads)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: str, fn):
+        """
+        Run fn() unless a call with the same key is already running, in which case
+        wait for it and share its result (or exception).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """
+    Coalesce concurrent coroutines with the same key into one task. The shared
+    task is cancelled only when every caller waiting on it has been cancelled.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key: str, fn):
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(fn()), 0]
+            self._calls[key] = entry
+            entry[0].add_done_callback(lambda task: self._forget(key, task))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+
+    def _forget(self, key: str, task):
+        entry = self._calls.get(key)
+        if entry is not None and entry[0] is task:
+            del self._calls[key]
+
+
+class _Stream:
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self.task = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class AsyncStreamFlight:
+    """
+    Coalesce concurrent streams with the same key into one producer task whose
+    items are fanned out to every reader, late joiners included. The producer is
+    cancelled only when every reader has gone away.
+    """
+
+    def __init__(self):
+        self._streams = {}
+
+    async def follow(self, key: str, open_stream):
+        """
+        Yield the items of open_stream() (an async iterator), started now or
+        joined if a stream with the same key is already running.
+        Raises:
+            Exception: The error the shared stream failed with.
+        """
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self._streams[key] = _Stream()
+            stream.task = asyncio.ensure_future(self._produce(key, stream, open_stream()))
+        stream.readers += 1
+        seen = 0
+        try:
+            while True:
+                changed = stream.changed
+                while seen < len(stream.items):
+                    seen += 1
+                    yield stream.items[seen - 1]
+                if stream.done:
+                    break
+                await changed.wait()
+            if stream.error is not None:
+                raise stream.error
+        finally:
+            stream.readers -= 1
+            if stream.readers == 0 and not stream.done:
+                # New readers start over instead of joining a cancelled stream.
+                stream.task.cancel()
+                self._forget(key, stream)
+
+    async def _produce(self, key: str, stream: _Stream, items):
+        try:
+            async for item in items:
+                stream.items.append(item)
+                stream.notify()
+        except Exception as e:
+            stream.error = e
+        finally:
+            stream.done = True
+            self._forget(key, stream)
+            stream.notify()
+
+    def _forget(self, key: str, stream: _Stream):
+        if self._streams.get(key) is stream:
+            del self._streams[key]
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+
+from src.scheduler import PrioritySemaphore
+
+# Connection pool tuning, shared by every model call in the process.
+MAX_CONNECTIONS = int(os.getenv("STEMMATE_MAX_CONNECTIONS", "256"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("STEMMATE_MAX_KEEPALIVE_CONNECTIONS", "64"))
+KEEPALIVE_EXPIRY = float(os.getenv("STEMMATE_KEEPALIVE_EXPIRY", "120"))
+
+# Upper bound of in-flight requests per model, overridable per model with a JSON
+# mapping, e.g. STEMMATE_MODEL_CONCURRENCY='{"openai/gpt-oss-20b": 128}'.
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("STEMMATE_DEFAULT_MODEL_CONCURRENCY", "64"))
+MODEL_CONCURRENCY = json.loads(os.getenv("STEMMATE_MODEL_CONCURRENCY", "{}"))
+
+
+def _pool_limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+# Clients are built on first use rather than at import, so importing the app
+# stays cheap and no sockets exist before a Modal memory snapshot is taken.
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    """The shared synchronous OpenAI client, created on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import httpx
+                from openai import OpenAI
+
+                # Retries and deadlines are handled per stage by src.resilience.
+                _client = OpenAI(
+                    api_key= os.getenv("OPENAI_API_KEY"),
+                    base_url= os.getenv("OPENAI_API_BASE_URL"),
+                    http_client=httpx.Client(limits=_pool_limits()),
+                    max_retries=0,
+                )
+    return _client
+
+
+def get_async_client():
+    """The shared asynchronous OpenAI client, created on first use."""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                import httpx
+                from openai import AsyncOpenAI
+
+                _async_client = AsyncOpenAI(
+                    api_key= os.getenv("OPENAI_API_KEY"),
+                    base_url= os.getenv("OPENAI_API_BASE_URL"),
+                    http_client=httpx.AsyncClient(limits=_pool_limits()),
+                    max_retries=0,
+                )
+    return _async_client
+
+
+def warm_up(timeout: float = 10.0) -> bool:
+    """
+    Build the synchronous client and open a pooled connection to the endpoint
+    with a cheap request, so the first student does not pay for DNS and TLS.
+    Returns:
+        bool: Whether the warmup request succeeded.
+    """
+    try:
+        get_client().models.list(timeout=timeout)
+        return True
+    except Exception as e:
+        print(f"Warmup request failed: {e}")
+        return False
+
+
+async def awarm_up(timeout: float = 10.0) -> bool:
+    """
+    Async version of `warm_up`. Run it on the event loop that serves requests:
+    pooled async connections belong to the loop that opened them.
+    """
+    try:
+        await get_async_client().models.list(timeout=timeout)
+        return True
+    except Exception as e:
+        print(f"Warmup request failed: {e}")
+        return False
+
+
+_model_semaphores = {}
+
+
+def model_semaphore(model: str) -> PrioritySemaphore:
+    """
+    Get the semaphore bounding concurrent async calls to the given model. When
+    the model is saturated, calls of interactive requests go before bulk ones.
+    Args:
+        model (str): The model name.
+    Returns:
+        PrioritySemaphore: The shared semaphore for that model.
+    """
+    semaphore = _model_semaphores.get(model)
+    if semaphore is None:
+        semaphore = PrioritySemaphore(
+            MODEL_CONCURRENCY.get(model, DEFAULT_MODEL_CONCURRENCY), metric="stemmate_model", model=model
+        )
+        _model_semaphores[model] = semaphore
+    return semaphore
@@ -0,0 +1,263 @@
+import json
+import math
+import os
+import re
+from fractions import Fraction
+
+from src.parsing import normalize_answer
+from src.routing import router
+
+try:
+    import sympy
+except ImportError:  # Optional: symbolic answers then fall back to text comparison.
+    sympy = None
+
+# Relative and absolute tolerance for numeric answers.
+ANSWER_RTOL = float(os.getenv("STEMMATE_ANSWER_RTOL", "1e-6"))
+ANSWER_ATOL = float(os.getenv("STEMMATE_ANSWER_ATOL", "1e-9"))
+# Largest relative error of a rounded decimal still taken for the exact value,
+# so "0.33" stands for 1/3 but "0.3" does not.
+ROUNDED_ANSWER_RTOL = float(os.getenv("STEMMATE_ROUNDED_ANSWER_RTOL", "0.01"))
+# Weight each model's vote by how often it agreed with past consensus answers.
+WEIGHTED_VOTING = os.getenv("STEMMATE_WEIGHTED_VOTING", "0") == "1"
+# Static vote weights per model, e.g. STEMMATE_MODEL_WEIGHTS='{"openai/gpt-oss-20b": 0.5}'.
+MODEL_WEIGHTS = json.loads(os.getenv("STEMMATE_MODEL_WEIGHTS", "{}"))
+
+_CHOICE_RE = re.compile(r"^(?:(?:option|choice|answer)\s*:?\s*)?\(?([A-E])\)?(?:[.):]\s*.*)?$", re.IGNORECASE)
+_DECIMAL_RE = re.compile(r"^[-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?$", re.IGNORECASE)
+_FRACTION_RE = re.compile(r"^([-+]?)\s*\\[dt]?frac\{\s*([-+]?\d+)\s*\}\{\s*([-+]?\d+)\s*\}$")
+_THOUSANDS_RE = re.compile(r"^[-+]?\d{1,3}(?:,\d{3})+(?:\.\d+)?$")
+_ASSIGNMENT_RE = re.compile(r"^[a-zA-Z]\w*\s*=\s*(.+)$")
+_UNIT_RE = re.compile(
+    r"^(.*?\d)\s*(?:\\(?:text|mathrm|operatorname)\{[^{}]*\}|\^\{?\\circ\}?|°|\\?%|"
+    r"\s[a-zA-Zµ]+(?:\s*[/^·*]\s*[a-zA-Z0-9]+)*)$"
+)
+_SYMPY_ALLOWED_RE = re.compile(r"^[0-9a-z+\-*/^()., ]+$")
+_SYMPY_NAMES = {"sqrt", "pi", "e", "i", "log", "ln", "exp", "sin", "cos", "tan"}
+_LATEX_TO_SYMPY = (
+    (re.compile(r"\\[dt]?frac\{([^{}]*)\}\{([^{}]*)\}"), r"((\1)/(\2))"),
+    (re.compile(r"\\sqrt\{([^{}]*)\}"), r"sqrt(\1)"),
+    (re.compile(r"\\left|\\right"), ""),
+    (re.compile(r"\\cdot|\\times"), "*"),
+    (re.compile(r"\\pi"), "pi"),
+    (re.compile(r"\\ln"), "log"),
+    (re.compile(r"\\(sin|cos|tan|log|exp)"), r"\1"),
+    (re.compile(r"[{}]"), lambda m: "(" if m.group() == "{" else ")"),
+)
+
+
+class Answer:
+    """
+    Canonical form of a model's final answer: a multiple-choice letter, an exact
+    or approximate number, a symbolic expression (with SymPy) or plain text.
+    """
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.text = normalize_answer(raw or "")
+        self.kind, self.value, self.decimals = _classify(self.text)
+
+    def __bool__(self):
+        return bool(self.text)
+
+    def matches(self, other: "Answer") -> bool:
+        """Whether two answers are equivalent, e.g. "0.5", "1/2" and "$\\frac{1}{2}$"."""
+        if self.kind != other.kind:
+            return False
+        if self.kind == "number":
+            return _numbers_match(self, other)
+        if self.kind == "expr":
+            try:
+                return bool(sympy.simplify(self.value - other.value) == 0)
+            except Exception:
+                return self.value == other.value
+        return self.value == other.value
+
+
+def _classify(text: str) -> tuple:
+    choice = _CHOICE_RE.match(text)
+    if choice and (text[:1].isupper() or not text[:1].isalpha()):
+        return "choice", choice.group(1).upper(), None
+
+    assignment = _ASSIGNMENT_RE.match(text)
+    if assignment:
+        text = assignment.group(1).strip()
+    unit = _UNIT_RE.match(text)
+    if unit:
+        text = unit.group(1).strip()
+    text = text.replace("\\,", "").replace("{,}", ".").replace("\\!", "")
+
+    number = _parse_number(text)
+    if number is not None:
+        return "number", number[0], number[1]
+
+    if sympy is not None:
+        expr = _parse_expression(text)
+        if expr is not None:
+            if not expr.free_symbols:
+                try:
+                    value = float(expr.evalf())
+                except (TypeError, ValueError):
+                    return "expr", expr, None
+                if math.isfinite(value):
+                    return "number", value, None
+            return "expr", expr, None
+    return "text", re.sub(r"\s+", "", text).lower(), None
+
+
+def _parse_number(text: str):
+    """(value, decimals written) for plain, fractional or thousands-separated numbers."""
+    if _THOUSANDS_RE.match(text):
+        text = text.replace(",", "")
+    if _DECIMAL_RE.match(text):
+        decimals = len(text.split(".", 1)[1]) if "." in text and "e" not in text.lower() else None
+        return Fraction(text), decimals
+    fraction = _FRACTION_RE.match(text)
+    if fraction:
+        sign, numerator, denominator = fraction.groups()
+        text = f"{sign}{numerator}/{denominator}"
+    parts = text.replace(" ", "").split("/")
+    if len(parts) == 2 and all(_DECIMAL_RE.match(part) for part in parts):
+        try:
+            return Fraction(parts[0]) / Fraction(parts[1]), None
+        except ZeroDivisionError:
+            return None
+    return None
+
+
+def _parse_expression(text: str):
+    for pattern, replacement in _LATEX_TO_SYMPY:
+        text = pattern.sub(replacement, text)
+    text = text.replace("^", "**")
+    # Only evaluate arithmetic over a fixed vocabulary; answers are model output.
+    if not _SYMPY_ALLOWED_RE.match(text.replace("**", "^")):
+        return None
+    if any(name not in _SYMPY_NAMES and len(name) > 1 for name in re.findall(r"[a-z]+", text)):
+        return None
+    try:
+        return sympy.sympify(text, locals={"ln": sympy.log, "e": sympy.E, "i": sympy.I}, rational=True)
+    except Exception:
+        return None
+
+
+def _numbers_match(a: Answer, b: Answer) -> bool:
+    if a.value == b.value:
+        return True
+    x, y = float(a.value), float(b.value)
+    if math.isclose(x, y, rel_tol=ANSWER_RTOL, abs_tol=ANSWER_ATOL):
+        return True
+    # A rounded decimal matches the exact value it rounds from, e.g. "0.33" and
+    # "1/3", but "0.3" is too coarse to be the same vote.
+    return any(
+        exact.decimals is None and rounds_to(rounded, float(exact.value))
+        for rounded, exact in ((a, b), (b, a))
+    )
+
+
+def rounds_to(rounded: Answer, exact: float) -> bool:
+    """
+    Whether a decimal answer is the exact value rounded to the digits written,
+    e.g. "1.33" for 4/3, with enough precision to stand for it.
+    """
+    if rounded.kind != "number" or rounded.decimals is None:
+        return False
+    error = abs(float(rounded.value) - exact)
+    return error <= 0.5 * 10 ** -rounded.decimals and error <= ROUNDED_ANSWER_RTOL * abs(exact)
+
+
+def answers_match(a: str, b: str) -> bool:
+    """Whether two raw answer strings are equivalent."""
+    return Answer(a).matches(Answer(b))
+
+
+def model_weight(model: str) -> float:
+    """
+    Vote weight of a model: its static weight, times its historical rate of
+    agreeing with the consensus when weighted voting is enabled.
+    """
+    weight = float(MODEL_WEIGHTS.get(model, 1.0))
+    if WEIGHTED_VOTING:
+        weight *= router.stats(model).agreement_rate
+    return weight
+
+
+class AnswerTally:
+    """
+    Weighted votes grouped by equivalent answer. The outcome is decided as soon
+    as the leading answer outweighs the runner-up even if every model that has
+    not answered yet voted for the runner-up.
+    """
+
+    def __init__(self):
+        self.groups = []
+        self.votes = []
+
+    def add(self, model: str, answer: str, weight: float = 1.0):
+        """
+        Count a model's answer; empty answers count as abstentions.
+        Returns:
+            dict | None: The group the answer joined.
+        """
+        parsed = Answer(answer)
+        if not parsed:
+            self.votes.append((model, parsed, weight, None))
+            return None
+        for group in self.groups:
+            if group["answer"].matches(parsed):
+                break
+        else:
+            group = {"answer": parsed, "weight": 0.0, "models": []}
+            self.groups.append(group)
+        group["weight"] += weight
+        group["models"].append(model)
+        self.votes.append((model, parsed, weight, group))
+        return group
+
+    def ranked(self) -> list:
+        # Stable sort: ties go to the answer that arrived first.
+        return sorted(self.groups, key=lambda group: -group["weight"])
+
+    def leader(self):
+        ranked = self.ranked()
+        return ranked[0] if ranked else None
+
+    def _margin(self) -> float:
+        ranked = self.ranked()
+        if not ranked:
+            return 0.0
+        return ranked[0]["weight"] - (ranked[1]["weight"] if len(ranked) > 1 else 0.0)
+
+    def decided(self, remaining_weight: float) -> bool:
+        """Whether the leader can no longer be overtaken by `remaining_weight` more votes."""
+        return bool(self.groups) and self._margin() > remaining_weight
+
+    def models_needed(self, weights: list, remaining_weight: float) -> int:
+        """
+        Fewest of the next models (with the given weights, in order) that decide
+        the outcome if they all agree with the leader; all of them if none do.
+        """
+        margin, remaining = self._margin(), remaining_weight
+        for i, weight in enumerate(weights, 1):
+            margin += weight
+            remaining -= weight
+            if margin > remaining:
+                return i
+        return len(weights)
+
+    def answer(self):
+        """The leading answer text, or None when no model answered."""
+        leader = self.leader()
+        return leader["answer"].text if leader else None
+
+    def agrees(self, model: str) -> bool:
+        leader = self.leader()
+        return leader is not None and model in leader["models"]
+
+    def rows(self) -> list:
+        """[Model, Answer, Confidence] rows for the model comparison table."""
+        total = sum(group["weight"] for group in self.groups)
+        rows = []
+        for model, parsed, weight, group in self.votes:
+            confidence = group["weight"] / total if group and total else 0.0
+            rows.append([model.split("/")[-1], parsed.text, round(confidence, 2)])
+        return rows
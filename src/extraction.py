@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+
+from src import tracing
+from src.imaging import prepare_image
+from src.services import aimage_parser_stream
+
+# Start extracting the question as soon as an image is uploaded, so OCR runs
+# while the user picks settings.
+PREFETCH_EXTRACTION = os.getenv("STEMMATE_PREFETCH_EXTRACTION", "1") == "1"
+# Extractions kept for uploads that may still be solved or used for questions.
+MAX_EXTRACTIONS = int(os.getenv("STEMMATE_MAX_EXTRACTIONS", "64"))
+
+
+class Extraction:
+    """
+    One running extraction of an upload: encodes the image once, streams the
+    question from `image_parser` and lets any number of readers follow it.
+    """
+
+    def __init__(self, image):
+        self.text = ""
+        self.done = False
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._run(image))
+
+    async def _run(self, image) -> str:
+        try:
+            encoded = await asyncio.to_thread(prepare_image, image)
+            async for delta in aimage_parser_stream(encoded.data, mime_type=encoded.mime_type):
+                self.text += delta
+                self._notify()
+        finally:
+            self.done = True
+            self._notify()
+        return self.text
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        """
+        Yield the question extracted so far each time it grows.
+        Raises:
+            Exception: The error the extraction failed with.
+        """
+        seen = 0
+        while True:
+            changed = self._changed
+            if len(self.text) > seen:
+                seen = len(self.text)
+                yield self.text
+            if self.done:
+                break
+            await changed.wait()
+        await self.task
+
+    async def result(self) -> str:
+        # Shielded: a reader giving up does not stop it for the others.
+        return await asyncio.shield(self.task)
+
+
+_extractions = OrderedDict()
+
+
+def _read(image):
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as f:
+            return f.read()
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    return None
+
+
+def _forget(key: str, extraction: Extraction):
+    if extraction.task.cancelled() or extraction.task.exception() is not None:
+        if _extractions.get(key) is extraction:
+            del _extractions[key]
+
+
+def extract(image) -> Extraction:
+    """
+    The extraction of an upload, started now or joined if the same image is
+    already being (or was recently) extracted, e.g. by the upload event or the
+    other tab. Must be called from the event loop.
+    Args:
+        image: Path to the uploaded file, image bytes or a PIL Image.
+    Returns:
+        Extraction: The running or finished extraction.
+    """
+    raw = _read(image)
+    if raw is None:
+        # Decoded images cannot be matched to uploads; extract them on their own.
+        return Extraction(image)
+    key = hashlib.sha256(raw).hexdigest()
+    extraction = _extractions.get(key)
+    if extraction is not None:
+        _extractions.move_to_end(key)
+        tracing.inc("stemmate_extractions_total", result="joined")
+        return extraction
+    extraction = _extractions[key] = Extraction(raw)
+    extraction.task.add_done_callback(lambda _: _forget(key, extraction))
+    while len(_extractions) > MAX_EXTRACTIONS:
+        _extractions.popitem(last=False)
+    tracing.inc("stemmate_extractions_total", result="started")
+    return extraction
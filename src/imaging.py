@@ -0,0 +1,130 @@
+import base64
+import io
+import os
+import time
+from dataclasses import dataclass
+
+from src import tracing
+
+# Longest side sent to the vision model; larger uploads are downscaled.
+MAX_IMAGE_SIDE = int(os.getenv("STEMMATE_MAX_IMAGE_SIDE", "2048"))
+# Encoding used when an image has to be re-encoded: JPEG, WEBP or PNG.
+IMAGE_FORMAT = os.getenv("STEMMATE_IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("STEMMATE_IMAGE_QUALITY", "90"))
+GRAYSCALE = os.getenv("STEMMATE_IMAGE_GRAYSCALE", "0") == "1"
+
+_PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP"}
+_ORIENTATION_TAG = 0x0112
+
+
+@dataclass
+class EncodedImage:
+    data: str
+    mime_type: str
+    original_bytes: int
+    encoded_bytes: int
+    seconds: float
+    passthrough: bool
+
+
+def _flatten(image):
+    from PIL import Image
+
+    # JPEG has no alpha channel; paste transparent uploads onto white so dark
+    # text on a transparent background stays readable.
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB") if image.mode not in ("RGB", "L") else image
+
+
+def _orientation(image) -> int:
+    # EXIF orientation; 1 is upright. Phones often store photos rotated with a
+    # tag instead, which vision models ignore.
+    return image.getexif().get(_ORIENTATION_TAG, 1)
+
+
+def prepare_image(image) -> EncodedImage:
+    """
+    Turn an upload into the base64 payload sent to the vision model. Uploads that
+    are already upright, small enough and in a supported format are passed
+    through as-is; others are rotated as their EXIF orientation says, downscaled
+    to MAX_IMAGE_SIDE and encoded once as IMAGE_FORMAT.
+    Args:
+        image: PIL Image, raw image bytes or a path to an image file.
+    Returns:
+        EncodedImage: The base64 data, its mime type and size/timing stats.
+    """
+    encoded = _encode(image)
+    tracing.record(
+        "image_encoding",
+        encoded.seconds,
+        original_bytes=encoded.original_bytes,
+        encoded_bytes=encoded.encoded_bytes,
+        passthrough=encoded.passthrough,
+    )
+    return encoded
+
+
+def _encode(image) -> EncodedImage:
+    # Pillow is only needed once an image arrives.
+    from PIL import Image, ImageOps
+
+    start = time.perf_counter()
+    raw = None
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as f:
+            raw = f.read()
+    elif isinstance(image, (bytes, bytearray)):
+        raw = bytes(image)
+
+    if raw is not None:
+        image = Image.open(io.BytesIO(raw))
+        orientation = _orientation(image)
+        if (
+            orientation == 1
+            and image.format in _PASSTHROUGH_FORMATS
+            and max(image.size) <= MAX_IMAGE_SIDE
+            and not GRAYSCALE
+        ):
+            return EncodedImage(
+                data=base64.b64encode(raw).decode("ascii"),
+                mime_type=Image.MIME[image.format],
+                original_bytes=len(raw),
+                encoded_bytes=len(raw),
+                seconds=time.perf_counter() - start,
+                passthrough=True,
+            )
+        # Let the JPEG decoder skip straight to a reduced scale when possible.
+        image.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        original_bytes = len(raw)
+    else:
+        orientation = _orientation(image)
+        original_bytes = image.width * image.height * len(image.getbands())
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+
+    if max(image.size) > MAX_IMAGE_SIDE:
+        scale = MAX_IMAGE_SIDE / max(image.size)
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.Resampling.LANCZOS,
+        )
+    if GRAYSCALE:
+        image = image.convert("L")
+    if IMAGE_FORMAT != "PNG":
+        image = _flatten(image)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=IMAGE_FORMAT, quality=IMAGE_QUALITY)
+    data = base64.b64encode(buffer.getbuffer()).decode("ascii")
+    return EncodedImage(
+        data=data,
+        mime_type=Image.MIME[IMAGE_FORMAT],
+        original_bytes=original_bytes,
+        encoded_bytes=buffer.tell(),
+        seconds=time.perf_counter() - start,
+        passthrough=False,
+    )
@@ -0,0 +1,162 @@
+import json
+import os
+from dataclasses import dataclass, field
+
+from src import tracing
+from src.resilience import measured_latency
+
+# JSON or YAML file describing models and the candidates of each stage; entries
+# are merged over the defaults below by model and stage name.
+MODEL_REGISTRY_PATH = os.getenv("STEMMATE_MODEL_REGISTRY")
+# Policy per stage, e.g. STEMMATE_MODEL_POLICIES='{"image_parser": "fastest"}'.
+MODEL_POLICIES = json.loads(os.getenv("STEMMATE_MODEL_POLICIES", "{}"))
+
+FASTEST = "fastest"
+CHEAPEST = "cheapest"
+MOST_ACCURATE = "most_accurate"
+POLICIES = (FASTEST, CHEAPEST, MOST_ACCURATE)
+
+# Sampling parameters of models the registry does not describe.
+DEFAULT_PARAMS = {"reasoning_effort": "low", "top_p": 0.7}
+
+# Costs are USD per million tokens, latency a prior in seconds used until calls
+# are measured, accuracy a relative score used by the most_accurate policy.
+DEFAULT_MODELS = [
+    {"name": "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8", "vision": True, "input_cost": 0.27,
+     "output_cost": 0.85, "context": 1048576, "latency": 4.0, "accuracy": 0.8, "params": {"top_p": 0.7}},
+    {"name": "meta-llama/Llama-4-Scout-17B-16E-Instruct", "vision": True, "input_cost": 0.18,
+     "output_cost": 0.59, "context": 1048576, "latency": 3.0, "accuracy": 0.7, "params": {"top_p": 0.7}},
+    {"name": "google/gemma-3n-E4B-it", "input_cost": 0.02, "output_cost": 0.04, "context": 32768,
+     "latency": 2.0, "accuracy": 0.5, "params": {"top_p": 0.7}},
+    {"name": "Qwen/Qwen3-235B-A22B-fp8-tput", "reasoning": True, "input_cost": 0.2, "output_cost": 0.6,
+     "context": 262144, "latency": 20.0, "accuracy": 0.85},
+    {"name": "Qwen/Qwen3-Next-80B-A3B-Thinking", "reasoning": True, "input_cost": 0.15, "output_cost": 1.5,
+     "context": 262144, "latency": 30.0, "accuracy": 0.9},
+    {"name": "openai/gpt-oss-20b", "reasoning": True, "input_cost": 0.05, "output_cost": 0.2,
+     "context": 131072, "latency": 10.0, "accuracy": 0.75},
+]
+# Candidates per stage, the capabilities they need and the default policy.
+# OCR mistakes cannot be caught by validation, so parsing asks the most
+# accurate model first and only falls back to the smaller one.
+DEFAULT_STAGES = {
+    "image_parser": {
+        "policy": MOST_ACCURATE, "requires": ["vision"],
+        "models": ["meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8", "meta-llama/Llama-4-Scout-17B-16E-Instruct"],
+    },
+    "question_generator": {
+        "policy": CHEAPEST,
+        "models": ["meta-llama/Llama-4-Scout-17B-16E-Instruct", "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"],
+    },
+    "personalized_explanation": {
+        "policy": CHEAPEST,
+        "models": ["google/gemma-3n-E4B-it", "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"],
+    },
+}
+
+
+@dataclass
+class ModelSpec:
+    name: str
+    vision: bool = False
+    reasoning: bool = False
+    input_cost: float = 0.0
+    output_cost: float = 0.0
+    context: int = 131072
+    latency: float = 10.0
+    accuracy: float = 0.5
+    params: dict = field(default_factory=lambda: dict(DEFAULT_PARAMS))
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        """USD cost of a call with the given token counts."""
+        return (self.input_cost * input_tokens + self.output_cost * output_tokens) / 1e6
+
+
+def load_config(path: str) -> dict:
+    """Read a registry file: JSON, or YAML (needs PyYAML) for .yaml/.yml files."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+class ModelRegistry:
+    """
+    Models with their capabilities, cost, context limit and latency, and the
+    candidates of each stage. A stage's cascade is its candidates that can take
+    the request, ordered by policy: a call tries them in turn and escalates when
+    the output fails validation.
+    """
+
+    def __init__(self, models: list = DEFAULT_MODELS, stages: dict = DEFAULT_STAGES, policies: dict = None):
+        self.models = {entry["name"]: ModelSpec(**entry) for entry in models}
+        self.stages = {stage: dict(config) for stage, config in stages.items()}
+        for stage, policy in (policies or {}).items():
+            self.stages.setdefault(stage, {})["policy"] = policy
+
+    @classmethod
+    def from_config(cls, path: str = MODEL_REGISTRY_PATH, policies: dict = MODEL_POLICIES) -> "ModelRegistry":
+        """The default registry, with the entries of the file at path (if any) merged over it."""
+        models = {entry["name"]: entry for entry in DEFAULT_MODELS}
+        stages = {stage: dict(config) for stage, config in DEFAULT_STAGES.items()}
+        if path:
+            config = load_config(path)
+            for entry in config.get("models", []):
+                models[entry["name"]] = {**models.get(entry["name"], {}), **entry}
+            for stage, entry in config.get("stages", {}).items():
+                stages[stage] = {**stages.get(stage, {}), **entry}
+        return cls(list(models.values()), stages, policies)
+
+    def spec(self, model: str) -> ModelSpec:
+        """The model's description; unknown models get the defaults."""
+        return self.models.get(model) or ModelSpec(model)
+
+    def params(self, model: str) -> dict:
+        """Sampling parameters sent with every call to the model."""
+        return dict(self.spec(model).params)
+
+    def latency(self, stage: str, model: str) -> float:
+        measured = measured_latency(stage, model)
+        return self.spec(model).latency if measured is None else measured
+
+    def policy(self, stage: str, policy: str = None) -> str:
+        """The policy given, or the stage's default."""
+        policy = policy or self.stages[stage].get("policy", MOST_ACCURATE)
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown model policy: {policy}")
+        return policy
+
+    def cascade(self, stage: str, policy: str = None, input_tokens: int = 0, output_tokens: int = 0) -> list:
+        """
+        Models to try for a stage, in order.
+        Args:
+            stage (str): "image_parser", "question_generator" or "personalized_explanation".
+            policy (str): "fastest", "cheapest" or "most_accurate"; the stage's default when None.
+            input_tokens (int): Prompt tokens, to skip models with too small a context.
+            output_tokens (int): Completion tokens allowed, for context and cost.
+        Returns:
+            list: Model names; at least one.
+        """
+        config = self.stages[stage]
+        policy = self.policy(stage, policy)
+        specs = [self.spec(model) for model in config["models"]]
+        capable = [
+            spec for spec in specs
+            if all(getattr(spec, capability) for capability in config.get("requires", []))
+            and spec.context >= input_tokens + output_tokens
+        ] or specs
+        if policy == FASTEST:
+            capable.sort(key=lambda spec: self.latency(stage, spec.name))
+        elif policy == CHEAPEST:
+            # Expected cost per call, with a nominal completion when none is given.
+            capable.sort(key=lambda spec: spec.cost(input_tokens or 1000, output_tokens or 1000))
+        else:
+            capable.sort(key=lambda spec: -spec.accuracy)
+        return [spec.name for spec in capable]
+
+    def escalated(self, stage: str, model: str, reason: str):
+        tracing.inc("stemmate_cascade_escalations_total", stage=stage, model=model, reason=reason)
+
+
+registry = ModelRegistry.from_config()
@@ -0,0 +1,266 @@
+import json
+import re
+
+# Step headings as models actually write them: "## Step 1:", "### Step 2 -",
+# "**Step 3:**" or a bare "Step 4:" at the start of a line.
+STEP_RE = re.compile(r"^\s*(?:#{1,6}\s*\**\s*step\b|\*\*\s*step\s*\d+|step\s*\d+\s*[:.)])", re.IGNORECASE)
+# "## Final Answer: 42", "**Final Answer:** 42" or "Final Answer: 42"; the answer
+# may also follow on the next non-empty line.
+ANSWER_HEADING_RE = re.compile(r"#{1,6}\s*\**\s*final\s+answer\s*\**\s*:?\s*\**\s*(.*)$", re.IGNORECASE)
+ANSWER_LINE_RE = re.compile(r"^\s*\**\s*final\s+answer\s*\**\s*:\s*\**\s*(.*)$", re.IGNORECASE)
+_WRAPPERS = (("$$", "$$"), ("$", "$"), ("\\(", "\\)"), ("\\[", "\\]"), ("**", "**"), ("`", "`"))
+
+
+def _boxed(text: str):
+    """Content of the last \\boxed{...} in text, respecting nested braces."""
+    start = text.rfind("\\boxed{")
+    if start == -1:
+        return None
+    depth = 0
+    for i in range(start + len("\\boxed"), len(text)):
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start + len("\\boxed{"):i]
+    return None
+
+
+def normalize_answer(answer: str) -> str:
+    """
+    Strip the formatting models wrap around a final answer, so "$\\boxed{42}$.",
+    "**42**" and "42" all become "42".
+    Args:
+        answer (str): The raw answer text.
+    Returns:
+        str: The normalized answer.
+    """
+    answer = " ".join(answer.split())
+    while True:
+        previous = answer
+        boxed = _boxed(answer)
+        if boxed is not None and answer.startswith(("\\boxed{", "$\\boxed{", "$$\\boxed{", "\\(\\boxed{", "\\[\\boxed{")):
+            answer = boxed.strip()
+        answer = answer.rstrip(".").strip()
+        for left, right in _WRAPPERS:
+            inner = answer[len(left):len(answer) - len(right)]
+            if len(answer) >= len(left) + len(right) and answer.startswith(left) and answer.endswith(right) and left not in inner:
+                answer = inner.strip()
+                break
+        if answer == previous:
+            return answer
+
+
+class SolutionParser:
+    """
+    Single-pass parser of solver output into {"steps": [...], "answer": str}.
+    Text is consumed line by line, either all at once (`parse_solution`) or as
+    it streams in (`feed`), and every character is looked at a constant number
+    of times regardless of the output length.
+
+    Anything before a `</think>` tag and inside `<think>...</think>` is dropped.
+    Step headings are recognised in the usual markdown variants, but not inside
+    display math or code blocks, whose lines are kept together. In JSON mode the
+    output is expected to be {"steps": [...], "answer": ...} and falls back to
+    the markdown format when it does not parse.
+    """
+
+    def __init__(self, json_mode: bool = False):
+        self.json_mode = json_mode
+        self._pending = []
+        self._raw = [] if json_mode else None
+        self._thinking = False
+        self._think_tail = ""
+        self._reset()
+
+    def _reset(self):
+        self._current = []
+        self._block = None
+        self._awaiting_answer = False
+        self._answered = False
+        self._last_boxed = None
+        self.steps = []
+        self.answer = ""
+
+    def feed(self, delta: str) -> bool:
+        """
+        Consume a text delta.
+        Args:
+            delta (str): The newly streamed text.
+        Returns:
+            bool: True when a step was completed or the answer was found.
+        """
+        if self._raw is not None:
+            self._raw.append(delta)
+            return False
+        if self._thinking:
+            delta = self._skip_thinking(delta)
+            if not delta:
+                return False
+        if "\n" not in delta:
+            self._pending.append(delta)
+            return False
+        head, *lines = delta.split("\n")
+        self._pending.append(head)
+        lines.insert(0, "".join(self._pending))
+        self._pending = [lines.pop()]
+        changed = False
+        for line in lines:
+            changed = self._consume(line) or changed
+        if self._thinking and self._pending:
+            # A <think> opened in this delta; the unfinished line is thinking too.
+            rest = self._skip_thinking("".join(self._pending))
+            self._pending = []
+            if rest:
+                changed = self.feed(rest) or changed
+        return changed
+
+    def _skip_thinking(self, text: str):
+        # Scan for the closing tag without splitting lines, keeping only enough of
+        # the tail to catch a tag split across deltas.
+        window = self._think_tail + text
+        end = window.find("</think>")
+        if end == -1:
+            self._think_tail = window[-len("</think>"):]
+            return None
+        self._thinking = False
+        self._think_tail = ""
+        self._reset()
+        return window[end + len("</think>"):]
+
+    def _consume(self, line: str) -> bool:
+        if "</think>" in line:
+            self._thinking = False
+            self._reset()
+            line = line.rsplit("</think>", 1)[-1]
+        if self._thinking:
+            return False
+        if "<think>" in line:
+            self._thinking = True
+            self._think_tail = ""
+            line = line.split("<think>", 1)[0]
+
+        stripped = line.strip()
+        # A step or answer heading always ends a block, so an unclosed "$$" cannot
+        # swallow the rest of the solution.
+        if self._block is not None and not (
+            stripped.startswith("#") and (STEP_RE.match(stripped) or ANSWER_HEADING_RE.match(stripped))
+        ):
+            self._current[-1] += "\n" + stripped
+            if self._closes_block(stripped):
+                self._block = None
+            return False
+        if "\\boxed{" in stripped:
+            self._last_boxed = _boxed(stripped) or self._last_boxed
+
+        # Substring checks first: most lines are neither answers nor step headings.
+        match = ("nswer" in stripped or "NSWER" in stripped) and (
+            ANSWER_HEADING_RE.search(stripped) or ANSWER_LINE_RE.match(stripped)
+        )
+        if match:
+            completed = self._close_step()
+            self.answer = normalize_answer(match.group(1))
+            self._awaiting_answer = not self.answer
+            self._answered = True
+            return completed or bool(self.answer)
+        if self._awaiting_answer and stripped:
+            self.answer = normalize_answer(stripped)
+            self._awaiting_answer = False
+            return True
+        if ("tep" in stripped or "TEP" in stripped) and STEP_RE.match(stripped):
+            completed = self._close_step()
+            self._answered = False
+            self._current = [stripped]
+            return completed
+        if self._answered or not stripped:
+            return False
+
+        self._current.append(stripped)
+        self._block = self._opens_block(stripped)
+        return False
+
+    @staticmethod
+    def _opens_block(line: str):
+        if line.startswith("```") and line.count("```") == 1:
+            return "```"
+        if line.count("$$") % 2 == 1:
+            return "$$"
+        if line.startswith("\\[") and "\\]" not in line:
+            return "\\]"
+        return None
+
+    def _closes_block(self, line: str) -> bool:
+        if self._block == "$$":
+            return line.count("$$") % 2 == 1
+        return self._block in line
+
+    def _close_step(self) -> bool:
+        step = "\n\n".join(self._current).strip()
+        self._current = []
+        self._block = None
+        if step:
+            self.steps.append(step)
+        return bool(step)
+
+    def finish(self) -> dict:
+        """Flush the remaining text and return the parsed steps and answer."""
+        if self._raw is not None:
+            text = "".join(self._raw)
+            self._raw = None
+            solution = parse_json_solution(text)
+            if solution is not None:
+                return solution
+            self.feed(text)
+        if self._pending:
+            self._consume("".join(self._pending))
+            self._pending = []
+        self._close_step()
+        if not self.answer and self._last_boxed:
+            self.answer = normalize_answer(self._last_boxed)
+        return {
+            "steps": self.steps,
+            "answer": self.answer
+        }
+
+
+def parse_json_solution(text: str):
+    """
+    Parse a structured-output solution {"steps": [...], "answer": ...}.
+    Args:
+        text (str): The model output, possibly preceded by thinking or wrapped in a code fence.
+    Returns:
+        dict | None: The solution, or None when the output is not such a JSON object.
+    """
+    text = text.rsplit("</think>", 1)[-1]
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("steps"), list) or "answer" not in data:
+        return None
+    return {
+        "steps": [str(step).strip() for step in data["steps"] if str(step).strip()],
+        "answer": normalize_answer(str(data["answer"])),
+    }
+
+
+def parse_solution(response: str, json_mode: bool = False) -> dict:
+    """
+    Parse a complete solver response.
+    Args:
+        response (str): The model output.
+        json_mode (bool): Whether the output was requested as JSON.
+    Returns:
+        dict: A dictionary containing the steps and final answer.
+    """
+    # Thinking is discarded anyway; cut it off before the line-by-line pass.
+    end = response.rfind("</think>")
+    if end != -1:
+        response = response[end + len("</think>"):]
+    parser = SolutionParser(json_mode=json_mode)
+    parser.feed(response)
+    return parser.finish()
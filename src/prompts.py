@@ -0,0 +1,247 @@
+import json
+import os
+import re
+
+from src import tracing
+
+try:
+    import tiktoken
+except ImportError:  # Optional: token counts are then estimated from the text.
+    tiktoken = None
+
+# Template version used per stage, e.g. STEMMATE_PROMPT_VERSIONS='{"solver": "1"}'
+# to go back to the original solver prompt.
+PROMPT_VERSIONS = {
+    "solver": "2",
+    "personalized_explanation": "2",
+    "question_generator": "2",
+    **json.loads(os.getenv("STEMMATE_PROMPT_VERSIONS", "{}")),
+}
+# Completion token limit per stage; "generate" applies to plain prompts.
+MAX_TOKENS = {
+    "generate": 10000,
+    "solver": 10000,
+    "personalized_explanation": 3000,
+    "question_generator": 4000,
+    "image_parser": 2048,
+    **json.loads(os.getenv("STEMMATE_MAX_TOKENS", "{}")),
+}
+# Input token budget for the solution steps quoted in explanation prompts;
+# longer steps are trimmed to fit.
+PROMPT_BUDGETS = {
+    "personalized_explanation": 1500,
+    **json.loads(os.getenv("STEMMATE_PROMPT_BUDGETS", "{}")),
+}
+# Savings are reported against the original prompts.
+BASELINE_VERSION = "1"
+
+LEGACY_SYSTEM = "You are a helpful assistant. Generate thoroughly answer for given question."
+
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+_SPACES_RE = re.compile(r"[ \t]+")
+
+
+_encoder = None
+
+
+def _encoding():
+    global _encoder
+    if _encoder is None:
+        _encoder = tiktoken.get_encoding("o200k_base")
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in the text with tiktoken, or an estimate (about 4 characters per token) without it."""
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(_encoding().encode(text, disallowed_special=()))
+    return len(_TOKEN_RE.findall(text))
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """The text cut to at most max_tokens tokens, marked with an ellipsis when cut."""
+    if max_tokens <= 0:
+        return ""
+    if tiktoken is not None:
+        tokens = _encoding().encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding().decode(tokens[:max_tokens]).rstrip() + " …"
+    matches = list(_TOKEN_RE.finditer(text))
+    return text if len(matches) <= max_tokens else text[:matches[max_tokens - 1].end()].rstrip() + " …"
+
+
+def compact(text: str) -> str:
+    """Collapse runs of spaces and blank lines, which cost tokens and carry nothing."""
+    return _BLANK_LINES_RE.sub("\n\n", _SPACES_RE.sub(" ", text)).strip()
+
+
+def fit_steps(steps: list, budget: int) -> list:
+    """
+    Trim solution steps to a total token budget. Steps under an equal share keep
+    their text and pass the rest of their share on; longer steps are cut to the
+    share that remains.
+    Args:
+        steps (list): The solution steps.
+        budget (int): Total tokens allowed for all steps.
+    Returns:
+        list: The steps, unchanged when they already fit.
+    """
+    steps = [compact(step) for step in steps]
+    counts = [count_tokens(step) for step in steps]
+    if sum(counts) <= budget or not steps:
+        return steps
+    cap, remaining = 0, budget
+    for i, count in enumerate(sorted(counts)):
+        share = remaining // (len(counts) - i)
+        if count > share:
+            cap = share
+            break
+        remaining -= count
+    return [step if count <= cap else truncate(step, cap) for step, count in zip(steps, counts)]
+
+
+class Prompt:
+    """
+    A rendered prompt: a static system message first, so providers can reuse
+    their prefix cache, then the request-specific user message.
+    """
+
+    def __init__(self, stage: str, version: str, system: str, user: str, max_tokens: int):
+        self.stage = stage
+        self.version = version
+        self.system = system
+        self.user = user
+        self.max_tokens = max_tokens
+        self.tokens = count_tokens(system) + count_tokens(user)
+        self.saved = 0
+
+    def messages(self) -> list:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user},
+        ]
+
+
+_ANSWER_FORMAT = "final answer (number or choice only, no sign or text, e.g., if answer is 42, just write 42, if answer is choice B, just write B)"
+
+
+def _solver_v1(question: str, json_mode: bool = False) -> tuple:
+    prompt = f"Solve the following problem step-by-step and provide the final answer:\n\n{question}"
+    if json_mode:
+        response_template = """{
+    "steps": ["<step 1, with calculation and reasoning>", "<step 2>", ...],
+    "answer": "<""" + _ANSWER_FORMAT + """>"
+}"""
+        return LEGACY_SYSTEM, prompt + "\n\nRespond with a JSON object exactly like below, say nothing else.\n" + response_template
+    response_template = """## Step 1: 
+...
+## Step 2:
+...
+
+## Final Answer: <""" + _ANSWER_FORMAT + """>
+    """
+    return LEGACY_SYSTEM, prompt + "\n\nResponse exactly like below template, say nothing else.\n" + response_template
+
+
+def _solver_v2(question: str, json_mode: bool = False) -> tuple:
+    system = "Solve the following problem step-by-step and provide the final answer. "
+    if json_mode:
+        system += (
+            'Respond with only a JSON object: {"steps": ["<step with calculation and reasoning>", ...], '
+            '"answer": "<number or choice letter only, e.g. 42 or B>"}'
+        )
+    else:
+        system += (
+            "Respond in exactly this format and say nothing else:\n"
+            "## Step 1: <calculation and reasoning>\n...\n"
+            "## Final Answer: <number or choice letter only, e.g. 42 or B>"
+        )
+    return system, question
+
+
+def _explanation_v1(question: str, steps: list, answer: str, lecturing_method: str, method_description: str,
+                    characteristic: str, persona: str, language: str) -> tuple:
+    prompt = f"You are {characteristic}, a tutor who is {persona}. Explain the following solution steps of the following question in a {characteristic} manner using {lecturing_method} method. Make it easy to understand and engaging.\n\nQuestion: {question}\n\nSteps:\n" + "\n".join(steps) + f"\n\nFinal Answer: {answer}\n\nTeaching Method Description: {method_description}\n\n"
+    response_template = """## Solution:
+<Solution with detailed explanation>
+...
+
+## Final Answer: <""" + _ANSWER_FORMAT + """>
+    """
+    response_language = f"\n\nThe explanation should be in {language}.\n"
+    return LEGACY_SYSTEM, prompt + "Response markdown template: \n\n" + response_template + response_language + "Response:"
+
+
+def _explanation_v2(question: str, steps: list, answer: str, lecturing_method: str, method_description: str,
+                    characteristic: str, persona: str, language: str) -> tuple:
+    system = (
+        "You are a tutor explaining a worked solution to a student, in the persona, teaching method and "
+        "language given. Make it easy to understand and engaging, and keep the final answer unchanged.\n"
+        "Respond in markdown:\n## Solution:\n<explanation>\n\n## Final Answer: <number or choice letter only>"
+    )
+    steps = fit_steps(steps, PROMPT_BUDGETS.get("personalized_explanation", 1500))
+    # The solution comes before the persona, so re-explaining the same solution
+    # in another style shares the longer prefix.
+    user = (
+        f"Question:\n{compact(question)}\n\nSteps:\n" + "\n".join(steps) + f"\n\nFinal Answer: {answer}\n\n"
+        f"Tutor: {characteristic}, {persona}\nTeaching method: {lecturing_method}. {method_description}\n"
+        f"Language: {language}"
+    )
+    return system, user
+
+
+def _question_generator_v1(sample_question: str, level: str, num_question: int) -> tuple:
+    prompt = f"Generate {num_question} new question similar to the following question for {level} students. The new question should be different in context but similar in language, difficulty level and structure. Provide the questions in markdown format.\n\nSample Question:\n{sample_question}\n\nSay nothing else.\n\nResponse Template:"
+    response_template = """## Question 1:
+...
+## Question 2: 
+..."""
+    return LEGACY_SYSTEM, prompt + response_template + "New Questions:"
+
+
+def _question_generator_v2(sample_question: str, level: str, num_question: int) -> tuple:
+    system = (
+        "Write new questions similar to a sample question: different in context but the same language, "
+        "difficulty and structure. Respond in markdown and say nothing else:\n## Question 1:\n...\n## Question 2:\n..."
+    )
+    return system, f"Number of questions: {num_question}\nStudents: {level}\n\nSample Question:\n{compact(sample_question)}"
+
+
+TEMPLATES = {
+    "solver": {"1": _solver_v1, "2": _solver_v2},
+    "personalized_explanation": {"1": _explanation_v1, "2": _explanation_v2},
+    "question_generator": {"1": _question_generator_v1, "2": _question_generator_v2},
+}
+
+
+def version_tag() -> str:
+    """Active template versions, for cache keys."""
+    return ",".join(f"{stage}={PROMPT_VERSIONS[stage]}" for stage in sorted(TEMPLATES))
+
+
+def max_tokens(stage: str) -> int:
+    return MAX_TOKENS.get(stage, MAX_TOKENS["generate"])
+
+
+def build(stage: str, **fields) -> Prompt:
+    """
+    Render the active template version of a stage and count its tokens.
+    Tokens saved against the original template are added to the
+    stemmate_prompt_tokens_saved_total counter.
+    Args:
+        stage (str): "solver", "personalized_explanation" or "question_generator".
+        **fields: The template's arguments.
+    Returns:
+        Prompt: The rendered prompt.
+    """
+    version = PROMPT_VERSIONS[stage]
+    system, user = TEMPLATES[stage][version](**fields)
+    prompt = Prompt(stage, version, system, user, max_tokens(stage))
+    if version != BASELINE_VERSION:
+        baseline = sum(count_tokens(part) for part in TEMPLATES[stage][BASELINE_VERSION](**fields))
+        prompt.saved = baseline - prompt.tokens
+    tracing.inc("stemmate_prompt_tokens_total", prompt.tokens, stage=stage)
+    tracing.inc("stemmate_prompt_tokens_saved_total", prompt.saved, stage=stage)
+    return prompt
@@ -0,0 +1,227 @@
+import array
+import asyncio
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from src import tracing
+from src.cache import CACHE_DIR, AsyncSingleFlight
+from src.services import aquestion_generator
+
+# SQLite file holding generated questions; in memory (per process) when unset
+# and STEMMATE_CACHE_DIR is not set either.
+QUESTION_BANK_PATH = os.getenv(
+    "STEMMATE_QUESTION_BANK",
+    os.path.join(CACHE_DIR, "questions.sqlite") if CACHE_DIR else ":memory:",
+)
+# Estimated Jaccard similarity above which two questions count as duplicates.
+QUESTION_DEDUP_THRESHOLD = float(os.getenv("STEMMATE_QUESTION_DEDUP_THRESHOLD", "0.7"))
+# Questions asked of the model per request; larger shortfalls are split into
+# parallel requests of this size.
+QUESTION_BATCH_SIZE = int(os.getenv("STEMMATE_QUESTION_BATCH_SIZE", "5"))
+# Generation rounds per top-up, to replace questions dropped as duplicates.
+QUESTION_TOPUP_ROUNDS = 2
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 64
+
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERMUTATIONS)]
+
+_HEADING_RE = re.compile(
+    r"^[ \t]*(?:(?:#{1,6}[ \t]*\**|\*\*)Question\b[ \t]*\d*|Question[ \t]+\d+)[ \t]*[:.]?\**[ \t]*:?",
+    re.IGNORECASE | re.MULTILINE,
+)
+_NUMBERED_RE = re.compile(r"^\s*\d+[.)]\s+", re.MULTILINE)
+
+
+def parse_questions(text: str) -> list:
+    """
+    Split generated markdown into one string per question.
+    Args:
+        text (str): Model output using the "## Question N:" template, or a numbered list.
+    Returns:
+        list: The questions, without their headings.
+    """
+    text = text or ""
+    pattern = _HEADING_RE if _HEADING_RE.search(text) else _NUMBERED_RE
+    parts = pattern.split(text)
+    # Text before the first heading is preamble ("Here are three questions").
+    if len(parts) > 1:
+        parts = parts[1:]
+    questions = []
+    for part in parts:
+        part = part.strip()
+        if part and part.strip(". ") and part != "...":
+            questions.append(part)
+    return questions
+
+
+def format_questions(questions: list) -> str:
+    """Render questions back into the "## Question N:" markdown the UI shows."""
+    return "\n\n".join(f"## Question {i}:\n{question}" for i, question in enumerate(questions, 1))
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """Character n-grams of the whitespace-normalized, lowercased text."""
+    text = _normalize(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash(text: str) -> tuple:
+    """
+    MinHash signature of the text's shingles; the fraction of equal positions in
+    two signatures estimates the Jaccard similarity of their shingle sets.
+    """
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles(text)]
+    if not hashes:
+        return (_MERSENNE,) * NUM_PERMUTATIONS
+    return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(a: tuple, b: tuple) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def source_key(question: str) -> str:
+    """Key of a source question; equal up to case and whitespace."""
+    return hashlib.sha256(_normalize(question).encode()).hexdigest()
+
+
+class QuestionBank:
+    """
+    Generated questions in SQLite, indexed by source question and level. Each
+    source keeps only questions that are not near-duplicates of each other or
+    of the source itself, and serves the least served ones first.
+    """
+
+    def __init__(self, path: str = QUESTION_BANK_PATH, threshold: float = QUESTION_DEDUP_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Opened on first use (always under the lock): the bank may live on a
+        # Modal Volume, which must not be held open in the memory snapshot.
+        if self._connection is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS questions ("
+                "id INTEGER PRIMARY KEY, source TEXT NOT NULL, level TEXT NOT NULL, text TEXT NOT NULL, "
+                "signature BLOB NOT NULL, served INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS questions_source ON questions (source, level)")
+            conn.commit()
+            self._connection = conn
+        return self._connection
+
+    def count(self, source: str, level: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE source = ? AND level = ?", (source_key(source), level)
+            ).fetchone()[0]
+
+    def add(self, source: str, level: str, questions: list) -> int:
+        """
+        Store the questions that are not near-duplicates of the source or of a
+        question already in the bank for it.
+        Returns:
+            int: Number of questions added.
+        """
+        key = source_key(source)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT signature FROM questions WHERE source = ? AND level = ?", (key, level)
+            ).fetchall()
+            seen = [minhash(source)] + [tuple(array.array("Q", row[0])) for row in rows]
+            added = 0
+            for question in questions:
+                signature = minhash(question)
+                if any(similarity(signature, other) >= self.threshold for other in seen):
+                    continue
+                seen.append(signature)
+                self._conn.execute(
+                    "INSERT INTO questions (source, level, text, signature, created) VALUES (?, ?, ?, ?, ?)",
+                    (key, level, question, array.array("Q", signature).tobytes(), time.time()),
+                )
+                added += 1
+            self._conn.commit()
+        tracing.inc("stemmate_question_bank_questions_total", added, result="added")
+        tracing.inc("stemmate_question_bank_questions_total", len(questions) - added, result="duplicate")
+        return added
+
+    def take(self, source: str, level: str, n: int) -> list:
+        """The n least served questions for the source, counted as served once more."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, text FROM questions WHERE source = ? AND level = ? ORDER BY served, id LIMIT ?",
+                (source_key(source), level, n),
+            ).fetchall()
+            self._conn.executemany("UPDATE questions SET served = served + 1 WHERE id = ?", [(row[0],) for row in rows])
+            self._conn.commit()
+        return [row[1] for row in rows]
+
+
+question_bank = QuestionBank()
+_topups = AsyncSingleFlight()
+
+
+async def _top_up(source: str, level: str, n: int, model: str):
+    """Generate questions in parallel batches until the bank holds n for the source."""
+    for _ in range(QUESTION_TOPUP_ROUNDS):
+        shortfall = n - question_bank.count(source, level)
+        if shortfall <= 0:
+            return
+        sizes = [min(QUESTION_BATCH_SIZE, shortfall - start) for start in range(0, shortfall, QUESTION_BATCH_SIZE)]
+        results = await asyncio.gather(
+            *[aquestion_generator(source, level=level, model=model, num_question=size) for size in sizes],
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for result in results:
+            if not isinstance(result, BaseException):
+                question_bank.add(source, level, parse_questions(result))
+        if len(errors) == len(results):
+            raise errors[0]
+
+
+async def aget_questions(source: str, level: str = "high school", n: int = 3, model: str = None) -> list:
+    """
+    Questions similar to the source, served from the question bank and topped
+    up by the model only for the shortfall.
+    Args:
+        source (str): The sample question.
+        level (str): The level of the students.
+        n (int): Number of questions wanted.
+        model (str): The model generating missing questions, or None for the
+            registry's cascade (see `src.model_registry`).
+    Returns:
+        list: Up to n questions; fewer only when the model keeps repeating itself.
+    """
+    stored = question_bank.count(source, level)
+    tracing.inc("stemmate_question_bank_requests_total", result="hit" if stored >= n else "topup")
+    # Concurrent requests for the same source share one top-up; a request that
+    # joined a smaller one tops up again for the rest.
+    key = f"{source_key(source)}:{level}"
+    for _ in range(2):
+        if question_bank.count(source, level) >= n:
+            break
+        await _topups.do(key, lambda: _top_up(source, level, n, model))
+    return question_bank.take(source, level, n)
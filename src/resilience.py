@@ -0,0 +1,315 @@
+import asyncio
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+from src import tracing
+from src.routing import ModelStats
+
+# Deadline in seconds for one model call of each stage, overridable with a JSON
+# mapping, e.g. STEMMATE_STAGE_TIMEOUTS='{"solver": 120}'.
+STAGE_TIMEOUTS = {
+    "image_parser": 60.0,
+    "solver": 300.0,
+    "personalized_explanation": 120.0,
+    "question_generator": 120.0,
+    "generate": 180.0,
+}
+STAGE_TIMEOUTS.update(json.loads(os.getenv("STEMMATE_STAGE_TIMEOUTS", "{}")))
+
+MAX_RETRIES = int(os.getenv("STEMMATE_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("STEMMATE_BACKOFF_BASE", "0.5"))
+BACKOFF_CAP = float(os.getenv("STEMMATE_BACKOFF_CAP", "8"))
+# Retries allowed per successful call, on top of a small reserve.
+RETRY_BUDGET_RATIO = float(os.getenv("STEMMATE_RETRY_BUDGET_RATIO", "0.2"))
+
+# Hedging sends a duplicate request once the first one is slower than the
+# HEDGE_PERCENTILE latency of that stage and model. HEDGE_MODELS maps a model to
+# the alternate model (or deployment) the duplicate goes to; default is the same.
+HEDGING = os.getenv("STEMMATE_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("STEMMATE_HEDGE_PERCENTILE", "90"))
+HEDGE_MODELS = json.loads(os.getenv("STEMMATE_HEDGE_MODELS", "{}"))
+
+
+@functools.cache
+def _retryable() -> tuple:
+    # openai is imported on the first failure instead of with the app.
+    import openai
+
+    return (
+        TimeoutError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+
+def stage_timeout(stage: str) -> float:
+    return STAGE_TIMEOUTS.get(stage, STAGE_TIMEOUTS["generate"])
+
+
+def stage_deadline(stage: str) -> float:
+    """Absolute time.monotonic() deadline of a stage call, shared by its retries and hedges."""
+    return time.monotonic() + stage_timeout(stage)
+
+
+def time_left(deadline: float, stage: str) -> float:
+    """
+    Seconds left until the deadline.
+    Raises:
+        TimeoutError: When the deadline has passed.
+    """
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError(f"{stage} exceeded its {stage_timeout(stage):.0f}s deadline")
+    return left
+
+
+class RetryBudget:
+    """
+    Token bucket bounding retries process-wide: every successful call earns
+    `ratio` of a retry and every retry spends one, so an upstream outage cannot
+    multiply the load by the per-call retry count.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, reserve: float = 10.0, capacity: float = 100.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+retry_budget = RetryBudget()
+
+
+def backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry attempt."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _retry_delay(error: Exception, attempt: int, stage: str, deadline: float = None):
+    # Seconds to back off before the next attempt, or None when it should not
+    # be made. Attempts never outlive the stage's deadline.
+    if attempt >= MAX_RETRIES or not isinstance(error, _retryable()):
+        return None
+    delay = backoff(attempt)
+    if deadline is not None and time.monotonic() + delay >= deadline:
+        return None
+    if not retry_budget.withdraw():
+        return None
+    tracing.inc("stemmate_retries_total", stage=stage, error=type(error).__name__)
+    return delay
+
+
+def with_retries(call, stage: str, deadline: float = None):
+    """Run call() with bounded, jittered retries on transient errors, until the deadline."""
+    attempt = 0
+    while True:
+        try:
+            result = call()
+        except Exception as e:
+            delay = _retry_delay(e, attempt, stage, deadline)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        retry_budget.deposit()
+        return result
+
+
+async def awith_retries(call, stage: str, deadline: float = None):
+    """Async version of `with_retries`; call() returns a coroutine."""
+    attempt = 0
+    while True:
+        try:
+            result = await call()
+        except Exception as e:
+            delay = _retry_delay(e, attempt, stage, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        retry_budget.deposit()
+        return result
+
+
+async def aretry_stream(open_stream, stage: str, deadline: float = None):
+    """
+    Retry a stream while it has not produced anything yet; once a delta has been
+    yielded the error is raised, since the caller already consumed partial output.
+    """
+    attempt = 0
+    while True:
+        started = False
+        try:
+            async for delta in open_stream():
+                started = True
+                yield delta
+        except Exception as e:
+            delay = None if started else _retry_delay(e, attempt, stage, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        retry_budget.deposit()
+        return
+
+
+def retry_stream(open_stream, stage: str, deadline: float = None):
+    """Sync version of `aretry_stream`."""
+    attempt = 0
+    while True:
+        started = False
+        try:
+            for delta in open_stream():
+                started = True
+                yield delta
+        except Exception as e:
+            delay = None if started else _retry_delay(e, attempt, stage, deadline)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        retry_budget.deposit()
+        return
+
+
+_latencies = {}
+
+
+def _on_span(name: str, seconds: float, attributes: dict):
+    model = attributes.get("model")
+    if not model or attributes.get("cache_hit") or attributes.get("error") or attributes.get("cancelled"):
+        return
+    streamed = "ttft" in attributes
+    stats = _latencies.get((name, model, streamed))
+    if stats is None:
+        stats = _latencies[(name, model, streamed)] = ModelStats()
+    stats.latencies.append(attributes["ttft"] if streamed else seconds)
+
+
+tracing.add_listener(_on_span)
+
+
+def measured_latency(stage: str, model: str):
+    """
+    Median latency of the stage's calls to the model (to the first token for
+    streams, which are only used when there are no whole calls), or None.
+    """
+    for streamed in (False, True):
+        stats = _latencies.get((stage, model, streamed))
+        if stats is not None and stats.latencies:
+            return stats.percentile(50)
+    return None
+
+
+def hedge_delay(stage: str, model: str, streamed: bool = False):
+    """
+    Seconds to wait before hedging a call, or None when hedging is off or the
+    stage/model has too little history. Streams are measured to the first token.
+    """
+    if not HEDGING:
+        return None
+    stats = _latencies.get((stage, model, streamed))
+    if stats is None or len(stats.latencies) < 20:
+        return None
+    return stats.percentile(HEDGE_PERCENTILE)
+
+
+async def ahedged(call, stage: str, model: str):
+    """
+    Await call(model); if it is slower than the hedge delay, also start
+    call(alternate) and return whichever succeeds first.
+    """
+    delay = hedge_delay(stage, model)
+    if delay is None:
+        return await call(model)
+    tasks = [asyncio.ensure_future(call(model))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tracing.inc("stemmate_hedges_total", stage=stage, model=model)
+            tasks.append(asyncio.ensure_future(call(HEDGE_MODELS.get(model, model))))
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _next(stream):
+    return await anext(stream)
+
+
+async def ahedged_stream(open_stream, stage: str, model: str):
+    """
+    Stream from open_stream(model); if no delta arrived within the hedge delay,
+    also open open_stream(alternate) and continue with whichever yields first.
+    """
+    delay = hedge_delay(stage, model, streamed=True)
+    primary = open_stream(model)
+    if delay is None:
+        async for delta in primary:
+            yield delta
+        return
+
+    racing = {asyncio.ensure_future(_next(primary)): primary}
+    winner, first_delta, error = None, None, None
+    try:
+        done, _ = await asyncio.wait(racing, timeout=delay)
+        if not done:
+            tracing.inc("stemmate_hedges_total", stage=stage, model=model)
+            hedge = open_stream(HEDGE_MODELS.get(model, model))
+            racing[asyncio.ensure_future(_next(hedge))] = hedge
+        while racing and winner is None:
+            done, _ = await asyncio.wait(racing, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                stream = racing.pop(task)
+                try:
+                    first_delta = task.result()
+                except StopAsyncIteration:
+                    winner = stream
+                    break
+                except Exception as e:
+                    error = e
+                    await stream.aclose()
+                    continue
+                winner = stream
+                break
+    finally:
+        for task, stream in racing.items():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await stream.aclose()
+    if winner is None:
+        raise error
+    if first_delta is not None:
+        yield first_delta
+    async for delta in winner:
+        yield delta
@@ -0,0 +1,117 @@
+import os
+import threading
+from collections import deque
+
+from src import tracing
+
+# Number of recent calls each model's statistics are computed over.
+ROUTER_WINDOW = int(os.getenv("STEMMATE_ROUTER_WINDOW", "200"))
+
+
+class ModelStats:
+    """Rolling latency, error and agreement statistics of one model."""
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.agreements = deque(maxlen=window)
+
+    def percentile(self, p: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        return sum(1 for outcome in self.outcomes if outcome != "ok") / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def timeout_rate(self) -> float:
+        return sum(1 for outcome in self.outcomes if outcome == "timeout") / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def agreement_rate(self) -> float:
+        # Optimistic prior so a model with no history is not pushed to the back.
+        return (sum(self.agreements) + 1) / (len(self.agreements) + 1)
+
+
+class ModelRouter:
+    """
+    Orders models for consensus by how quickly they are expected to contribute an
+    answer that survives the vote: median latency inflated by the error rate and
+    divided by the rate of agreeing with the final consensus.
+    """
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self.window = window
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def stats(self, model: str) -> ModelStats:
+        with self._lock:
+            if model not in self._stats:
+                self._stats[model] = ModelStats(self.window)
+            return self._stats[model]
+
+    def record_latency(self, model: str, seconds: float):
+        stats = self.stats(model)
+        stats.latencies.append(seconds)
+        stats.outcomes.append("ok")
+
+    def record_error(self, model: str, timeout: bool = False):
+        self.stats(model).outcomes.append("timeout" if timeout else "error")
+
+    def record_agreement(self, model: str, agreed: bool):
+        self.stats(model).agreements.append(agreed)
+
+    def score(self, model: str):
+        stats = self.stats(model)
+        latency = stats.percentile(50)
+        if latency is None:
+            return None
+        return latency * (1 + 4 * stats.error_rate) / stats.agreement_rate
+
+    def order(self, models: list) -> list:
+        """
+        Sort models best first. Models without history keep their relative order
+        and go first, so every model gets measured.
+        """
+        scores = {model: self.score(model) for model in models}
+        unknown = [model for model in models if scores[model] is None]
+        known = sorted((model for model in models if scores[model] is not None), key=scores.get)
+        return unknown + known
+
+    def snapshot(self) -> list:
+        """Per-model statistics, e.g. for a dashboard."""
+        rows = []
+        for model in list(self._stats):
+            stats = self.stats(model)
+            rows.append({
+                "model": model,
+                "p50": stats.percentile(50),
+                "p90": stats.percentile(90),
+                "p99": stats.percentile(99),
+                "error_rate": stats.error_rate,
+                "timeout_rate": stats.timeout_rate,
+                "agreement_rate": stats.agreement_rate,
+            })
+        return rows
+
+    def on_span(self, name: str, seconds: float, attributes: dict):
+        # Feed solver latencies and failures from tracing; cache hits and
+        # cancelled calls say nothing about the model.
+        if name != "solver" or attributes.get("cache_hit") or attributes.get("cancelled"):
+            return
+        model = attributes.get("model")
+        if not model:
+            return
+        error = attributes.get("error")
+        if error:
+            self.record_error(model, timeout="Timeout" in error)
+        else:
+            self.record_latency(model, seconds)
+
+
+router = ModelRouter()
+tracing.add_listener(router.on_span)
@@ -0,0 +1,244 @@
+import asyncio
+import contextvars
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from src import tracing
+
+# Priority classes, lower runs first.
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Requests running at once across all users, and the share of them bulk work
+# (question generation, background explanations) may hold.
+SCHEDULER_SLOTS = int(os.getenv("STEMMATE_SCHEDULER_SLOTS", "32"))
+BULK_SHARE = float(os.getenv("STEMMATE_BULK_SHARE", "0.5"))
+# Per-user token bucket: sustained model calls per second and burst size.
+USER_RATE = float(os.getenv("STEMMATE_USER_RATE", "0.5"))
+USER_BURST = float(os.getenv("STEMMATE_USER_BURST", "10"))
+# Longest a request may wait for tokens and a slot before it is rejected.
+MAX_QUEUE_WAIT = float(os.getenv("STEMMATE_MAX_QUEUE_WAIT", "30"))
+# Waiting requests above which solves fall back to a single model.
+SHED_QUEUE_DEPTH = int(os.getenv("STEMMATE_SHED_QUEUE_DEPTH", "8"))
+MAX_TRACKED_USERS = 10000
+
+# Priority of the work running in the current context; model semaphores serve
+# waiting calls in this order.
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+
+class Overloaded(Exception):
+    """A request was rejected by admission control."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`; requests spend tokens by cost."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, cost: float, max_wait: float) -> float:
+        """
+        Spend tokens for a request, possibly ahead of the refill.
+        Returns:
+            float: Seconds to wait before the request may start.
+        Raises:
+            Overloaded: When the wait would exceed max_wait; nothing is spent.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        cost = min(cost, self.burst)
+        wait = max(0.0, (cost - self.tokens) / self.rate) if self.rate > 0 else (0.0 if self.tokens >= cost else math.inf)
+        if wait > max_wait:
+            raise Overloaded(f"Too many requests, please try again in {math.ceil(wait)} seconds.", wait)
+        self.tokens -= cost
+        return wait
+
+
+class PrioritySemaphore:
+    """
+    Asyncio semaphore that hands freed slots to the highest-priority waiter,
+    first come first served within a priority, with optional per-priority caps.
+    Queue depth and in-flight count are exported as gauges.
+    """
+
+    def __init__(self, limit: int, class_limits: dict = None, metric: str = None, **labels):
+        self.limit = limit
+        self.class_limits = class_limits or {}
+        self.metric = metric
+        self.labels = labels
+        self.active = 0
+        self._active = {}
+        self._waiters = {}
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    def _can_take(self, priority: int) -> bool:
+        return self.active < self.limit and self._active.get(priority, 0) < self.class_limits.get(priority, self.limit)
+
+    def _take(self, priority: int):
+        self.active += 1
+        if priority in self.class_limits:
+            self._active[priority] = self._active.get(priority, 0) + 1
+
+    def _wake(self):
+        for priority in sorted(self._waiters):
+            queue = self._waiters[priority]
+            while queue and self._can_take(priority):
+                future = queue.popleft()
+                if not future.done():
+                    self._take(priority)
+                    future.set_result(None)
+
+    def _report(self):
+        if self.metric:
+            tracing.set_gauge(f"{self.metric}_queue_depth", self.waiting(), **self.labels)
+            tracing.set_gauge(f"{self.metric}_in_flight", self.active, **self.labels)
+
+    async def acquire(self, priority: int = None):
+        priority = request_priority.get() if priority is None else priority
+        ahead = any(self._waiters.get(p) for p in self._waiters if p <= priority)
+        if not ahead and self._can_take(priority):
+            self._take(priority)
+            self._report()
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(priority, deque()).append(future)
+        self._report()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancellation: pass the slot on.
+                self.release(priority)
+            else:
+                # _wake may already have dropped it while skipping cancelled waiters.
+                queue = self._waiters.get(priority, ())
+                if future in queue:
+                    queue.remove(future)
+                self._wake()
+                self._report()
+            raise
+        self._report()
+
+    def release(self, priority: int = None):
+        """Free a slot; the priority is only needed for classes with a cap."""
+        self.active -= 1
+        if priority in self.class_limits:
+            self._active[priority] -= 1
+        self._wake()
+        self._report()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class Admission:
+    """An admitted request: how long it queued and whether it should degrade."""
+
+    def __init__(self, priority: int, waited: float, degraded: bool):
+        self.priority = priority
+        self.waited = waited
+        self.degraded = degraded
+
+
+class Scheduler:
+    """
+    Admission control in front of the pipeline: a token bucket per user, a
+    bounded pool of request slots served by priority, and load shedding to
+    single-model solving when requests queue up.
+    """
+
+    def __init__(
+        self,
+        slots: int = SCHEDULER_SLOTS,
+        bulk_share: float = BULK_SHARE,
+        rate: float = USER_RATE,
+        burst: float = USER_BURST,
+        max_wait: float = MAX_QUEUE_WAIT,
+        shed_depth: int = SHED_QUEUE_DEPTH,
+    ):
+        self.slots = PrioritySemaphore(
+            slots, {BULK: max(1, int(slots * bulk_share))}, metric="stemmate_scheduler"
+        )
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.shed_depth = shed_depth
+        self._buckets = OrderedDict()
+
+    def _bucket(self, user: str) -> TokenBucket:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = self._buckets[user] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > MAX_TRACKED_USERS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user)
+        return bucket
+
+    def overloaded(self) -> bool:
+        """Whether enough requests are waiting that solves should shed work."""
+        return self.slots.waiting() >= self.shed_depth
+
+    @asynccontextmanager
+    async def admit(self, user: str, priority: int = INTERACTIVE, cost: float = 1.0):
+        """
+        Wait for the user's rate limit and a request slot, then run the body.
+        Args:
+            user (str): Session or user key the rate limit applies to.
+            priority (int): INTERACTIVE or BULK.
+            cost (float): Tokens the request spends, roughly its model calls.
+        Yields:
+            Admission: The admitted request.
+        Raises:
+            Overloaded: When the request would wait longer than max_wait.
+        """
+        name = PRIORITY_NAMES[priority]
+        start = time.monotonic()
+        try:
+            wait = self._bucket(user).reserve(cost, self.max_wait)
+        except Overloaded:
+            tracing.inc("stemmate_scheduler_requests_total", priority=name, result="rate_limited")
+            raise
+        if wait:
+            await asyncio.sleep(wait)
+        degraded = priority == INTERACTIVE and self.overloaded()
+        try:
+            async with asyncio.timeout(max(0.0, self.max_wait - wait)):
+                await self.slots.acquire(priority)
+        except TimeoutError:
+            tracing.inc("stemmate_scheduler_requests_total", priority=name, result="timeout")
+            raise Overloaded("The server is busy, please try again shortly.", self.max_wait) from None
+        waited = time.monotonic() - start
+        tracing.observe("stemmate_scheduler_wait_seconds", waited, priority=name)
+        tracing.inc("stemmate_scheduler_requests_total", priority=name, result="degraded" if degraded else "admitted")
+        token = request_priority.set(priority)
+        try:
+            yield Admission(priority, waited, degraded)
+        finally:
+            self.slots.release(priority)
+            try:
+                request_priority.reset(token)
+            except ValueError:
+                # Async generator handlers may be resumed in another context.
+                pass
+
+
+scheduler = Scheduler()
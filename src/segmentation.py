@@ -0,0 +1,86 @@
+import os
+import re
+
+# Split extracted pages with several questions and solve them concurrently.
+SEGMENT_QUESTIONS = os.getenv("STEMMATE_SEGMENT_QUESTIONS", "1") == "1"
+# Pages with more questions than this are solved as one problem.
+MAX_SEGMENTS = int(os.getenv("STEMMATE_MAX_SEGMENTS", "20"))
+MIN_NUMBERED_LENGTH = 40
+
+# "## Question 3", "**Problem 2.**", "Câu 1:", "Bài 4)" and similar labels.
+_LABEL_RE = re.compile(
+    r"^[ \t]*(?:#{1,6}[ \t]*)?(?:\*\*|__)?[ \t]*"
+    r"(?:question|problem|exercise|task|câu|bài|bài tập|cau|bai)[ \t]+(\d+)[ \t]*[:.)]?",
+    re.IGNORECASE | re.MULTILINE,
+)
+# "1." or "2)" at the very start of a line (nested lists are indented).
+_NUMBER_RE = re.compile(r"^(?:\*\*)?(\d+)[.)](?:\*\*)?[ \t]+", re.MULTILINE)
+_FENCE_RE = re.compile(r"^(```|\$\$)", re.MULTILINE)
+# What makes a numbered item a question rather than a given: a question mark,
+# an instruction or math of its own (not just a quoted number like "$60$ km").
+_REQUEST_RE = re.compile(
+    r"\?|\b(?:solve|find|compute|calculate|evaluate|determine|simplify|factor|expand|show|prove|explain|"
+    r"write|draw|graph|sketch|giải|tìm|tính|chứng minh|rút gọn|vẽ|viết)\b",
+    re.IGNORECASE,
+)
+_OWN_MATH_RE = re.compile(r"\$\$|\$[^$]*[a-zA-Z=<>^\\][^$]*\$")
+# A paragraph after the last numbered item, unless it is indented or lists the
+# item's answer choices.
+_TRAILING_RE = re.compile(r"\n[ \t]*\n(?![ \t]|\(?[A-Ea-e][.)])\S")
+
+
+def _sequential(numbers: list) -> bool:
+    return len(numbers) >= 2 and numbers == list(range(numbers[0], numbers[0] + len(numbers)))
+
+
+def _asks(item: str) -> bool:
+    return bool(_REQUEST_RE.search(item) or _OWN_MATH_RE.search(item))
+
+
+def _outside_blocks(text: str, matches: list) -> list:
+    # Drop markers inside code fences or display math.
+    toggles = [m.start() for m in _FENCE_RE.finditer(text)]
+    return [m for m in matches if sum(1 for t in toggles if t < m.start()) % 2 == 0]
+
+
+def split_questions(markdown: str) -> list:
+    """
+    Split the markdown extracted from a page into its questions. Questions are
+    recognized by labels ("Question 3", "Câu 2", ...) or, failing that, by a
+    top-level numbering 1., 2., 3., ... Text before the first question (shared
+    instructions, a table or a passage) is kept as context of every question.
+    Args:
+        markdown (str): Output of `image_parser`.
+    Returns:
+        list: The questions; a single item when the page holds one question.
+    """
+    if not SEGMENT_QUESTIONS or not markdown:
+        return [markdown]
+    for pattern in (_LABEL_RE, _NUMBER_RE):
+        matches = _outside_blocks(markdown, list(pattern.finditer(markdown)))
+        if not _sequential([int(m.group(1)) for m in matches]):
+            continue
+        ends = [m.start() for m in matches[1:]] + [len(markdown)]
+        if pattern is _NUMBER_RE:
+            items = [markdown[m.start():end].strip() for m, end in zip(matches, ends)]
+            # Short items, or items that ask nothing, are more likely parts of one
+            # question (givens, sub-steps) than questions of their own; so is a
+            # list followed by text, which may ask about all of its items.
+            if (
+                any(len(item) < MIN_NUMBERED_LENGTH or not _asks(item) for item in items)
+                or _TRAILING_RE.search(items[-1])
+            ):
+                continue
+        break
+    else:
+        return [markdown]
+    if len(matches) > MAX_SEGMENTS:
+        return [markdown]
+
+    preamble = markdown[:matches[0].start()].strip()
+    bounds = [m.start() for m in matches] + [len(markdown)]
+    questions = []
+    for start, end in zip(bounds, bounds[1:]):
+        question = markdown[start:end].strip()
+        questions.append(f"{preamble}\n\n{question}" if preamble else question)
+    return questions
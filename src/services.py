@@ -1,35 +1,339 @@
-from openai import OpenAI
-import os 
+import asyncio
+import copy
+import hashlib
+import os
+import re
+import time
+from contextlib import nullcontext
 
-from PIL import Image
+from src import tracing
+from src.cache import make_cache, SingleFlight, AsyncSingleFlight, AsyncStreamFlight
+from src.parsing import SolutionParser, parse_solution
+from src import prompts
+from src.prompts import Prompt
+from src.clients import get_client, get_async_client, model_semaphore
+from src.model_registry import registry
+from src.resilience import (
+    stage_deadline, time_left, with_retries, awith_retries, retry_stream, aretry_stream, ahedged, ahedged_stream,
+)
+
+image_cache = make_cache(
+    "image_parser",
+    max_entries=int(os.getenv("STEMMATE_IMAGE_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("STEMMATE_IMAGE_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+# Bump whenever the solver or explanation prompts or their parsing change, so
+# stale results are not reused. The active template versions are part of it.
+PROMPT_VERSION = "3:" + prompts.version_tag()
+# Ask the solver for {"steps": [...], "answer": ...} with the backend's JSON mode
+# instead of the markdown template; only enable for backends that support it.
+SOLVER_JSON_MODE = os.getenv("STEMMATE_SOLVER_JSON_MODE", "0") == "1"
 
-client = OpenAI(
-    api_key= os.getenv("OPENAI_API_KEY"),
-    base_url= os.getenv("OPENAI_API_BASE_URL")
+solution_cache = make_cache(
+    "solutions",
+    max_entries=int(os.getenv("STEMMATE_SOLUTION_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("STEMMATE_SOLUTION_CACHE_TTL", str(30 * 24 * 3600))),
 )
+explanation_cache = make_cache(
+    "explanations",
+    max_entries=int(os.getenv("STEMMATE_SOLUTION_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("STEMMATE_SOLUTION_CACHE_TTL", str(30 * 24 * 3600))),
+)
+_flight = SingleFlight()
+_async_flight = AsyncSingleFlight()
+_stream_flight = AsyncStreamFlight()
+
+
+def _generate_params(prompt, model: str, json_mode: bool = False) -> dict:
+    if isinstance(prompt, Prompt):
+        messages, max_tokens = prompt.messages(), prompt.max_tokens
+    else:
+        messages = [
+            {"role": "system", "content": prompts.LEGACY_SYSTEM},
+            {"role": "user", "content": prompt}
+        ]
+        max_tokens = prompts.max_tokens("generate")
+    params = dict(
+        model=model,
+        messages=messages,
+        max_tokens = max_tokens,
+        **registry.params(model)
+    )
+    if json_mode:
+        params["response_format"] = {"type": "json_object"}
+    return params
+
+
+def _chunk_text(chunk) -> str:
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def _stage(trace, name: str, model: str):
+    # Reuse the caller's span when there is one, otherwise time the call on its own.
+    return nullcontext(trace) if trace is not None else tracing.span(name, model=model)
+
+
+def _note_prompt(prompt, trace):
+    if isinstance(prompt, Prompt):
+        trace.set(prompt_version=prompt.version, prompt_tokens_estimate=prompt.tokens, prompt_tokens_saved=prompt.saved)
+
+
+def _complete(params: dict, trace) -> str:
+    # One deadline for the stage: retries only get the time that is left.
+    deadline = stage_deadline(trace.name)
+    response = with_retries(
+        lambda: get_client().chat.completions.create(**params, timeout=time_left(deadline, trace.name)),
+        trace.name,
+        deadline,
+    )
+    trace.set_usage(response.usage)
+    return response.choices[0].message.content
+
+
+async def _acomplete(params: dict, trace) -> str:
+    # One deadline for the stage, shared by retries and hedges; waiting for a
+    # slot of a saturated model counts against it too.
+    deadline = stage_deadline(trace.name)
+
+    async def call(model):
+        timeout = time_left(deadline, trace.name)
+        async with asyncio.timeout(timeout):
+            async with model_semaphore(model):
+                return await get_async_client().chat.completions.create(**{**params, "model": model}, timeout=timeout)
+
+    response = await awith_retries(lambda: ahedged(call, trace.name, params["model"]), trace.name, deadline)
+    trace.set_usage(response.usage)
+    return response.choices[0].message.content
+
+
+def _stream_chunks(params: dict, trace, deadline: float):
+    timeout = time_left(deadline, trace.name)
+    stream = get_client().chat.completions.create(**params, stream=True, stream_options={"include_usage": True}, timeout=timeout)
+    for chunk in stream:
+        if time.monotonic() > deadline:
+            stream.close()
+            raise TimeoutError(f"{trace.name} exceeded its deadline")
+        trace.set_usage(chunk.usage)
+        delta = _chunk_text(chunk)
+        if delta:
+            trace.mark_first_token()
+            yield delta
+
+
+async def _astream_chunks(params: dict, trace, deadline: float):
+    # The deadline bounds the whole stream, including the wait for a slot of the
+    # model and earlier attempts: every await below only gets the time left.
+    semaphore = model_semaphore(params["model"])
+    async with asyncio.timeout(time_left(deadline, trace.name)):
+        await semaphore.acquire()
+    try:
+        timeout = time_left(deadline, trace.name)
+        async with asyncio.timeout(timeout):
+            stream = await get_async_client().chat.completions.create(**params, stream=True, stream_options={"include_usage": True}, timeout=timeout)
+        try:
+            chunks = aiter(stream)
+            while True:
+                async with asyncio.timeout(time_left(deadline, trace.name)):
+                    try:
+                        chunk = await anext(chunks)
+                    except StopAsyncIteration:
+                        break
+                trace.set_usage(chunk.usage)
+                delta = _chunk_text(chunk)
+                if delta:
+                    trace.mark_first_token()
+                    yield delta
+        finally:
+            await stream.close()
+    finally:
+        semaphore.release()
+
+
+def _complete_stream(params: dict, trace):
+    deadline = stage_deadline(trace.name)
+    return retry_stream(lambda: _stream_chunks(params, trace, deadline), trace.name, deadline)
+
+
+def _acomplete_stream(params: dict, trace):
+    deadline = stage_deadline(trace.name)
+
+    def open_stream():
+        return ahedged_stream(
+            lambda model: _astream_chunks({**params, "model": model}, trace, deadline), trace.name, params["model"]
+        )
+
+    return aretry_stream(open_stream, trace.name, deadline)
+
+
+_QUESTIONS_RE = re.compile(r"^\s*(?:#{1,6}\s*|\*\*)?(?:question\b|\d+[.)]\s)", re.IGNORECASE | re.MULTILINE)
+# Explanations are written in the user's language, where the response format's
+# headings may be translated too.
+_FINAL_ANSWER_RE = re.compile(
+    r"final answer|đáp án|đáp số|kết quả|respuesta final|réponse finale|答案", re.IGNORECASE
+)
+_HEADING_RE = re.compile(r"^#{1,6}[ \t]+\S", re.MULTILINE)
+
+
+def _valid_explanation(text: str) -> bool:
+    # A final-answer line in some language, or the format's sections.
+    return bool(text) and (_FINAL_ANSWER_RE.search(text) is not None or len(_HEADING_RE.findall(text)) >= 2)
+
+
+# Output checks per stage; a model whose output fails is escalated from.
+VALIDATORS = {
+    "image_parser": lambda text: bool(text and text.strip()),
+    "question_generator": lambda text: bool(text) and _QUESTIONS_RE.search(text) is not None,
+    "personalized_explanation": _valid_explanation,
+}
+
+
+def _cascade_models(stage: str, model: str, policy: str, prompt: Prompt = None) -> list:
+    # The model asked for, or the registry's cascade for the stage.
+    if model:
+        return [model]
+    return registry.cascade(stage, policy, prompt.tokens if prompt else 0, prompts.max_tokens(stage))
+
+
+def _model_label(stage: str, model: str, policy: str) -> str:
+    # Cache keys and cache-hit spans of cascaded calls name the policy.
+    return model or "policy=" + registry.policy(stage, policy)
+
+
+def _cascade(stage: str, models: list, call):
+    """
+    Return call(model) for the first model whose output passes the stage's
+    validation; errors also escalate. The last model's output is returned as is.
+    """
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        try:
+            output = call(model)
+        except Exception:
+            if last:
+                raise
+            registry.escalated(stage, model, "error")
+            continue
+        if last or VALIDATORS[stage](output):
+            return output
+        registry.escalated(stage, model, "invalid")
+
+
+async def _acascade(stage: str, models: list, call):
+    """Async version of `_cascade`."""
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        try:
+            output = await call(model)
+        except Exception:
+            if last:
+                raise
+            registry.escalated(stage, model, "error")
+            continue
+        if last or VALIDATORS[stage](output):
+            return output
+        registry.escalated(stage, model, "invalid")
+
+
+def _cascade_stream(stage: str, models: list, open_stream):
+    """
+    Streaming version of `_cascade`. Text already shown cannot be taken back, so
+    streams only escalate from models that fail or stay empty before their
+    first delta.
+    """
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        started = False
+        try:
+            for delta in open_stream(model):
+                started = True
+                yield delta
+        except Exception:
+            if started or last:
+                raise
+            registry.escalated(stage, model, "error")
+            continue
+        if started or last:
+            return
+        registry.escalated(stage, model, "empty")
+
+
+async def _acascade_stream(stage: str, models: list, open_stream):
+    """Async version of `_cascade_stream`."""
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        started = False
+        try:
+            async for delta in open_stream(model):
+                started = True
+                yield delta
+        except Exception:
+            if started or last:
+                raise
+            registry.escalated(stage, model, "error")
+            continue
+        if started or last:
+            return
+        registry.escalated(stage, model, "empty")
+
 
 def generate(
-    prompt: str,
-    model: str = "gpt-4o"
+    prompt,
+    model: str = "gpt-4o",
+    trace: tracing.Span = None,
+    json_mode: bool = False
 ) -> str:
     """Generate a response from the given prompt using the specified model.
     Args:
-        prompt (str): The input prompt.
+        prompt (str | Prompt): The input prompt, or a prompt built by `src.prompts`.
         model (str): The model to use for generation.
+        trace (Span): Span of the calling stage to attach token usage to.
+        json_mode (bool): Request a JSON object response from the backend.
     Returns:
         str: The generated response.
     """
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant. Generate thoroughly answer for given question."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens = 10000,
-        reasoning_effort="low",
-        top_p=0.7
-    )
-    return response.choices[0].message.content
+    with _stage(trace, "generate", model) as trace:
+        _note_prompt(prompt, trace)
+        return _complete(_generate_params(prompt, model, json_mode), trace)
+
+
+async def agenerate(
+    prompt,
+    model: str = "gpt-4o",
+    trace: tracing.Span = None,
+    json_mode: bool = False
+) -> str:
+    """Async version of `generate`, bounded by the per-model concurrency limit."""
+    with _stage(trace, "generate", model) as trace:
+        _note_prompt(prompt, trace)
+        return await _acomplete(_generate_params(prompt, model, json_mode), trace)
+
+
+def generate_stream(
+    prompt,
+    model: str = "gpt-4o",
+    trace: tracing.Span = None,
+    json_mode: bool = False
+):
+    """Stream the response of `generate`, yielding text deltas as they arrive."""
+    with _stage(trace, "generate", model) as trace:
+        _note_prompt(prompt, trace)
+        yield from _complete_stream(_generate_params(prompt, model, json_mode), trace)
+
+
+async def agenerate_stream(
+    prompt,
+    model: str = "gpt-4o",
+    trace: tracing.Span = None,
+    json_mode: bool = False
+):
+    """Async version of `generate_stream`."""
+    with _stage(trace, "generate", model) as trace:
+        _note_prompt(prompt, trace)
+        async for delta in _acomplete_stream(_generate_params(prompt, model, json_mode), trace):
+            yield delta
 
 
 def process_response(response: str) -> dict:
@@ -40,27 +344,54 @@ def process_response(response: str) -> dict:
     Returns:
         dict: A dictionary containing the steps and final answer.
     """
-    step_pattern = "## Step"
-    answer_parttern = "## Final Answer:"
-    steps = []
-    current_step = ""
-    answer = ""
-    steps = []
-    for i in response.split("\n"):
-        if answer_parttern in i:
-            answer = i.split(answer_parttern)[-1].strip() + "\n\n"
-        elif step_pattern in i:
-            if current_step.strip() != "":
-                steps.append(current_step.strip())
-            current_step = i.strip()+ "\n\n"
-        else:
-            current_step += i.strip() + "\n\n" 
-    if current_step:
-        steps.append(current_step.strip())
-    return {
-        "steps": steps,
-        "answer": answer
-    }
+    return parse_solution(response)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonicalize question markdown so trivially different extractions share a cache key:
+    LaTeX spacing commands are dropped, whitespace is collapsed and removed around
+    operators and delimiters.
+    Args:
+        question (str): The question markdown.
+    Returns:
+        str: The normalized question.
+    """
+    question = re.sub(r"\\[,;:! ]|\\q?quad\b", " ", question)
+    question = re.sub(r"\\(left|right)\b", "", question)
+    question = re.sub(r"\s+", " ", question)
+    question = re.sub(r"\s*([=+\-*/^_{}()\[\],.:;<>|$&])\s*", r"\1", question)
+    return question.strip()
+
+
+def _cached(cache, key: str, stage: str, model: str):
+    start = time.perf_counter()
+    value = cache.get(key)
+    if value is not None:
+        tracing.record(stage, time.perf_counter() - start, model=model, cache_hit=True)
+    return value
+
+
+async def _acached(cache, key: str, stage: str, model: str):
+    start = time.perf_counter()
+    value = await cache.aget(key)
+    if value is not None:
+        tracing.record(stage, time.perf_counter() - start, model=model, cache_hit=True)
+    return value
+
+
+def _cache_key(*parts: str) -> str:
+    return hashlib.sha256("\0".join((PROMPT_VERSION,) + parts).encode("utf-8")).hexdigest()
+
+
+def _solver_prompt(question: str) -> Prompt:
+    return prompts.build("solver", question=question, json_mode=SOLVER_JSON_MODE)
+
+
+def _parse_solver_response(response: str) -> dict:
+    with tracing.span("process_response"):
+        return parse_solution(response, json_mode=SOLVER_JSON_MODE)
+
 
 def solver(
     question: str,
@@ -75,24 +406,82 @@ def solver(
     Returns:
         dict: A dictionary containing the steps and final answer.
     """
-    prompt = f"Solve the following problem step-by-step and provide the final answer:\n\n{question}"
-    # response_template = """{{
-    # "steps": [<list of solution steps, with calculation and reasoning>],
-    # "answer": <final answer>
-# }}"""
-    response_template = """## Step 1: 
-...
-## Step 2:
-...
+    key = _cache_key("solver", model, normalize_question(question))
+    solution = _cached(solution_cache, key, "solver", model)
+    if solution is None:
+        solution = _flight.do(key, lambda: _solve_and_cache(key, question, model))
+    return copy.deepcopy(solution)
+
+
+def _solve_and_cache(key: str, question: str, model: str) -> dict:
+    with tracing.span("solver", model=model, cache_hit=False) as trace:
+        response = generate(_solver_prompt(question), model=model, trace=trace, json_mode=SOLVER_JSON_MODE)
+    solution = _parse_solver_response(response)
+    if solution.get("answer"):
+        solution_cache.set(key, solution)
+    return solution
+
+
+async def asolver(
+    question: str,
+    model: str = "gpt-4o"
+) -> dict:
+    """Async version of `solver`."""
+    key = _cache_key("solver", model, normalize_question(question))
+    solution = await _acached(solution_cache, key, "solver", model)
+    if solution is None:
+        solution = await _async_flight.do(key, lambda: _asolve_and_cache(key, question, model))
+    return copy.deepcopy(solution)
+
+
+async def _asolve_and_cache(key: str, question: str, model: str) -> dict:
+    with tracing.span("solver", model=model, cache_hit=False) as trace:
+        response = await agenerate(_solver_prompt(question), model=model, trace=trace, json_mode=SOLVER_JSON_MODE)
+    solution = _parse_solver_response(response)
+    if solution.get("answer"):
+        await solution_cache.aset(key, solution)
+    return solution
+
 
-## Final Answer: <final answer (number or choice only, no sign or text, e.g., if answer is 42, just write 42, if answer is choice B, just write B)>
+async def asolver_stream(
+    question: str,
+    model: str = "gpt-4o"
+):
+    """
+    Streaming version of `asolver`.
+    Args:
+        question (str): The question to be solved.
+        model (str): The model to use for solving the question.
+    Yields:
+        tuple: ("steps", list of completed steps) whenever a step completes, then
+        ("solution", dict) with the steps and final answer.
     """
-    response = generate(prompt + "\n\nResponse exactly like below template, say nothing else.\n" + response_template, model=model)
-    print(f"Raw response from model {model}: {response}")
-    if "</think>" in response:
-        response = response.split("</think>")[-1].strip()
+    key = _cache_key("solver", model, normalize_question(question))
+    solution = await _acached(solution_cache, key, "solver", model)
+    if solution is not None:
+        yield "solution", copy.deepcopy(solution)
+        return
+    # Concurrent requests for the same question share one model stream.
+    async for kind, payload in _stream_flight.follow(key, lambda: _asolve_stream_and_cache(key, question, model)):
+        yield kind, copy.deepcopy(payload)
 
-    return process_response(response)  # Using eval for simplicity; consider safer parsing in production
+
+async def _asolve_stream_and_cache(key: str, question: str, model: str):
+    parser = SolutionParser(json_mode=SOLVER_JSON_MODE)
+    parse_seconds = 0.0
+    with tracing.span("solver", model=model, cache_hit=False, streamed=True) as trace:
+        async for delta in agenerate_stream(_solver_prompt(question), model=model, trace=trace, json_mode=SOLVER_JSON_MODE):
+            start = time.perf_counter()
+            completed = parser.feed(delta)
+            parse_seconds += time.perf_counter() - start
+            if completed:
+                yield "steps", list(parser.steps)
+    start = time.perf_counter()
+    solution = parser.finish()
+    tracing.record("process_response", parse_seconds + time.perf_counter() - start, model=model, streamed=True)
+    if solution.get("answer"):
+        await solution_cache.aset(key, copy.deepcopy(solution))
+    yield "solution", solution
 
 
 teaching_methods = {
@@ -122,54 +511,154 @@ chacteristics_examples = {
 
 
 
+def _explanation_prompt(
+    question: str,
+    processed_response: dict,
+    lecturing_method: str,
+    characteristic: str,
+    language: str
+) -> Prompt:
+    return prompts.build(
+        "personalized_explanation",
+        question=question,
+        steps=processed_response.get("steps", []),
+        answer=processed_response.get("answer", ""),
+        lecturing_method=lecturing_method,
+        method_description=teaching_methods.get(lecturing_method, ""),
+        characteristic=characteristic,
+        persona=chacteristics_examples.get(characteristic, ""),
+        language=language,
+    )
+
+
 def personalized_explanation(
     question= "",
     processed_response = {},
     lecturing_method = "Socratic/Questioning",
     characteristic = "Yoda",
     language = "Vietnamese",
-    model: str = "gpt-4o"
+    model: str = None,
+    policy: str = None
 ) -> str:
     """
     Generate a personalized explanation of the solution steps based on the user's level.
     Args:
         processed_response (dict): The processed response containing steps and answer.
         user_level (str): The user's level (e.g., "high school", "college").
-        model (str): The model to use for generating the explanation.
+        model (str): The model to use, or None to cascade through the stage's models in `src.model_registry`.
+        policy (str): "fastest", "cheapest" or "most_accurate" cascade when no model is given.
     Returns:
         str: The personalized explanation of the solution steps.
     """
-    steps = processed_response.get("steps", [])
-    answer = processed_response.get("answer", "")
-    if not steps or not answer:
+    if not processed_response.get("steps") or not processed_response.get("answer"):
         return processed_response
-    # prompt = f"Explain the following solution steps of the following question in a {characteristic} manner using {lecturing_method} method. Make it easy to understand and engaging.\n\nQuestion: {question}\n\nSteps:\n" + "\n".join(steps) + f"\n\nFinal Answer: {answer}\n\nTeaching Method Description: {teaching_methods.get(lecturing_method, '')}\n\n"
-    prompt = f"You are {characteristic}, a tutor who is {chacteristics_examples.get(characteristic, '')}. Explain the following solution steps of the following question in a {characteristic} manner using {lecturing_method} method. Make it easy to understand and engaging.\n\nQuestion: {question}\n\nSteps:\n" + "\n".join(steps) + f"\n\nFinal Answer: {answer}\n\nTeaching Method Description: {teaching_methods.get(lecturing_method, '')}\n\n"
+    label = _model_label("personalized_explanation", model, policy)
+    key = _explanation_key(question, processed_response, lecturing_method, characteristic, language, label)
+    response = _cached(explanation_cache, key, "personalized_explanation", label)
+    if response is None:
+        response = _flight.do(key, lambda: _explain_and_cache(key, question, processed_response, lecturing_method, characteristic, language, model, policy))
+    return response
 
-    response_template = """## Solution:
-<Solution with detailed explanation>
-...
 
-## Final Answer: <final answer (number or choice only, no sign or text, e.g., if answer is 42, just write 42, if answer is choice B, just write B)>
-    """
+def _explanation_key(question, processed_response, lecturing_method, characteristic, language, model) -> str:
+    return _cache_key(
+        "explanation", model, lecturing_method, characteristic, language,
+        normalize_question(question),
+        "\n".join(processed_response.get("steps", [])),
+        processed_response.get("answer", ""),
+    )
+
 
-    response_language = f"\n\nThe explanation should be in {language}.\n"
-    response = generate(prompt + "Response markdown template: \n\n" + response_template + response_language + "Response:", model=model)
+def _explain_and_cache(key, question, processed_response, lecturing_method, characteristic, language, model, policy) -> str:
+    prompt = _explanation_prompt(question, processed_response, lecturing_method, characteristic, language)
+
+    def call(model):
+        with tracing.span("personalized_explanation", model=model, cache_hit=False) as trace:
+            return generate(prompt, model=model, trace=trace)
+
+    response = _cascade("personalized_explanation", _cascade_models("personalized_explanation", model, policy, prompt), call)
+    if response:
+        explanation_cache.set(key, response)
     return response
 
-def image_parser(
-    image_str: str,
-    model: str = "gpt-4o"
+
+async def apersonalized_explanation(
+    question= "",
+    processed_response = {},
+    lecturing_method = "Socratic/Questioning",
+    characteristic = "Yoda",
+    language = "Vietnamese",
+    model: str = None,
+    policy: str = None
 ) -> str:
-    """
-    Parse the image to extract question, choices and context in markdown format.
-    Args:
-        image_str (str): The base64 encoded string of the image.
-        model (str): The model to use for parsing the image.
-    Returns:
-    str: The extracted question, choices and context in markdown format.
-    """
-    chat_ = [
+    """Async version of `personalized_explanation`."""
+    if not processed_response.get("steps") or not processed_response.get("answer"):
+        return processed_response
+    label = _model_label("personalized_explanation", model, policy)
+    key = _explanation_key(question, processed_response, lecturing_method, characteristic, language, label)
+    response = await _acached(explanation_cache, key, "personalized_explanation", label)
+    if response is None:
+        response = await _async_flight.do(key, lambda: _aexplain_and_cache(key, question, processed_response, lecturing_method, characteristic, language, model, policy))
+    return response
+
+
+async def _aexplain_and_cache(key, question, processed_response, lecturing_method, characteristic, language, model, policy) -> str:
+    prompt = _explanation_prompt(question, processed_response, lecturing_method, characteristic, language)
+
+    async def call(model):
+        with tracing.span("personalized_explanation", model=model, cache_hit=False) as trace:
+            return await agenerate(prompt, model=model, trace=trace)
+
+    response = await _acascade("personalized_explanation", _cascade_models("personalized_explanation", model, policy, prompt), call)
+    if response:
+        await explanation_cache.aset(key, response)
+    return response
+
+
+async def apersonalized_explanation_stream(
+    question= "",
+    processed_response = {},
+    lecturing_method = "Socratic/Questioning",
+    characteristic = "Yoda",
+    language = "Vietnamese",
+    model: str = None,
+    policy: str = None
+):
+    """Streaming version of `apersonalized_explanation`, yielding text deltas."""
+    if not processed_response.get("steps") or not processed_response.get("answer"):
+        return
+    label = _model_label("personalized_explanation", model, policy)
+    key = _explanation_key(question, processed_response, lecturing_method, characteristic, language, label)
+    response = await _acached(explanation_cache, key, "personalized_explanation", label)
+    if response is not None:
+        yield response
+        return
+    async for delta in _stream_flight.follow(key, lambda: _aexplain_stream_and_cache(
+        key, question, processed_response, lecturing_method, characteristic, language, model, policy
+    )):
+        yield delta
+
+
+async def _aexplain_stream_and_cache(key, question, processed_response, lecturing_method, characteristic, language, model, policy):
+    prompt = _explanation_prompt(question, processed_response, lecturing_method, characteristic, language)
+
+    async def open_stream(model):
+        with tracing.span("personalized_explanation", model=model, cache_hit=False, streamed=True) as trace:
+            async for delta in agenerate_stream(prompt, model=model, trace=trace):
+                yield delta
+
+    parts = []
+    models = _cascade_models("personalized_explanation", model, policy, prompt)
+    async for delta in _acascade_stream("personalized_explanation", models, open_stream):
+        parts.append(delta)
+        yield delta
+    response = "".join(parts)
+    if response:
+        await explanation_cache.aset(key, response)
+
+
+def _image_parser_messages(image_str: str, mime_type: str = "image/png") -> list:
+    return [
         {"role": "system", "content": "You are a helpful assistant that can analyze images."},
         {
             "role": "user", 
@@ -178,41 +667,181 @@ def image_parser(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{image_str}",
+                        "url": f"data:{mime_type};base64,{image_str}",
                     },
                 },
             ],
         }
     ]
-    response = client.chat.completions.create(
+
+
+def _image_parser_params(image_str: str, model: str, mime_type: str) -> dict:
+    return dict(
         model=model,
-        messages=chat_,
-        top_p=0.7,
+        messages=_image_parser_messages(image_str, mime_type),
+        max_tokens=prompts.max_tokens("image_parser"),
+        **registry.params(model)
     )
-    return response.choices[0].message.content
+
+
+def _image_cache_key(image_str: str, model: str) -> str:
+    # The base64 text maps one-to-one to the encoded image bytes, so hashing it
+    # addresses the content without decoding it again.
+    return hashlib.sha256(image_str.encode("ascii")).hexdigest() + ":" + model
+
+
+def image_parser(
+    image_str: str,
+    model: str = None,
+    mime_type: str = "image/png",
+    policy: str = None
+) -> str:
+    """
+    Parse the image to extract question, choices and context in markdown format.
+    Args:
+        image_str (str): The base64 encoded string of the image.
+        model (str): The model to use, or None to cascade through the stage's models in `src.model_registry`.
+        mime_type (str): The mime type of the encoded image.
+        policy (str): "fastest", "cheapest" or "most_accurate" cascade when no model is given.
+    Returns:
+    str: The extracted question, choices and context in markdown format.
+    """
+    label = _model_label("image_parser", model, policy)
+    key = _image_cache_key(image_str, label)
+    cached = _cached(image_cache, key, "image_parser", label)
+    if cached is not None:
+        return cached
+
+    def call(model):
+        with tracing.span("image_parser", model=model, cache_hit=False) as trace:
+            return _complete(_image_parser_params(image_str, model, mime_type), trace)
+
+    question = _cascade("image_parser", _cascade_models("image_parser", model, policy), call)
+    if VALIDATORS["image_parser"](question):
+        image_cache.set(key, question)
+    return question
+
+
+async def aimage_parser(
+    image_str: str,
+    model: str = None,
+    mime_type: str = "image/png",
+    policy: str = None
+) -> str:
+    """Async version of `image_parser`."""
+    label = _model_label("image_parser", model, policy)
+    key = _image_cache_key(image_str, label)
+    cached = await _acached(image_cache, key, "image_parser", label)
+    if cached is not None:
+        return cached
+
+    async def call(model):
+        with tracing.span("image_parser", model=model, cache_hit=False) as trace:
+            return await _acomplete(_image_parser_params(image_str, model, mime_type), trace)
+
+    question = await _acascade("image_parser", _cascade_models("image_parser", model, policy), call)
+    if VALIDATORS["image_parser"](question):
+        await image_cache.aset(key, question)
+    return question
+
+
+def image_parser_stream(
+    image_str: str,
+    model: str = None,
+    mime_type: str = "image/png",
+    policy: str = None
+):
+    """Streaming version of `image_parser`, yielding text deltas."""
+    label = _model_label("image_parser", model, policy)
+    key = _image_cache_key(image_str, label)
+    cached = _cached(image_cache, key, "image_parser", label)
+    if cached is not None:
+        yield cached
+        return
+
+    def open_stream(model):
+        with tracing.span("image_parser", model=model, cache_hit=False, streamed=True) as trace:
+            yield from _complete_stream(_image_parser_params(image_str, model, mime_type), trace)
+
+    parts = []
+    for delta in _cascade_stream("image_parser", _cascade_models("image_parser", model, policy), open_stream):
+        parts.append(delta)
+        yield delta
+    question = "".join(parts)
+    if VALIDATORS["image_parser"](question):
+        image_cache.set(key, question)
+
+
+async def aimage_parser_stream(
+    image_str: str,
+    model: str = None,
+    mime_type: str = "image/png",
+    policy: str = None
+):
+    """Async version of `image_parser_stream`."""
+    label = _model_label("image_parser", model, policy)
+    key = _image_cache_key(image_str, label)
+    cached = await _acached(image_cache, key, "image_parser", label)
+    if cached is not None:
+        yield cached
+        return
+
+    async def open_stream(model):
+        with tracing.span("image_parser", model=model, cache_hit=False, streamed=True) as trace:
+            async for delta in _acomplete_stream(_image_parser_params(image_str, model, mime_type), trace):
+                yield delta
+
+    parts = []
+    async for delta in _acascade_stream("image_parser", _cascade_models("image_parser", model, policy), open_stream):
+        parts.append(delta)
+        yield delta
+    question = "".join(parts)
+    if VALIDATORS["image_parser"](question):
+        await image_cache.aset(key, question)
+
+
+def _question_generator_prompt(sample_question: str, level: str, num_question: int) -> Prompt:
+    return prompts.build("question_generator", sample_question=sample_question, level=level, num_question=num_question)
 
 
 def question_generator(
     sample_question = "",
     level = "high school",
-    model: str = "gpt-4o",
-    num_question: int = 3
+    model: str = None,
+    num_question: int = 3,
+    policy: str = None
 ):
     """
     Generate a new question similar to the sample question for the specified level.
     Args:
         sample_question (str): The sample question to base the new question on.
         level (str): The level of the students (e.g., "high school", "college").
-        model (str): The model to use for generating the question.
+        model (str): The model to use, or None to cascade through the stage's models in `src.model_registry`.
+        policy (str): "fastest", "cheapest" or "most_accurate" cascade when no model is given.
     Returns:
         str: The generated question.
     """
-    prompt = f"Generate {num_question} new question similar to the following question for {level} students. The new question should be different in context but similar in language, difficulty level and structure. Provide the questions in markdown format.\n\nSample Question:\n{sample_question}\n\nSay nothing else.\n\nResponse Template:"
-    response_template = """## Question 1:
-...
-## Question 2: 
-..."""
-    response = generate(prompt + response_template + "New Questions:", model=model)
+    prompt = _question_generator_prompt(sample_question, level, num_question)
+
+    def call(model):
+        with tracing.span("question_generator", model=model) as trace:
+            return generate(prompt, model=model, trace=trace)
+
+    return _cascade("question_generator", _cascade_models("question_generator", model, policy, prompt), call)
+
+
+async def aquestion_generator(
+    sample_question = "",
+    level = "high school",
+    model: str = None,
+    num_question: int = 3,
+    policy: str = None
+):
+    """Async version of `question_generator`."""
+    prompt = _question_generator_prompt(sample_question, level, num_question)
+
+    async def call(model):
+        with tracing.span("question_generator", model=model) as trace:
+            return await agenerate(prompt, model=model, trace=trace)
 
-    print(response)
-    return response
\ No newline at end of file
+    return await _acascade("question_generator", _cascade_models("question_generator", model, policy, prompt), call)
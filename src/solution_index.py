@@ -0,0 +1,173 @@
+import array
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from src import tracing
+from src.cache import CACHE_DIR
+from src.question_bank import NUM_PERMUTATIONS, minhash, similarity
+
+# Reuse the consensus solution of a near-identical question solved before, such
+# as the same textbook problem photographed again. Off until tuned on real traffic.
+SIMILAR_LOOKUP = os.getenv("STEMMATE_SIMILAR_LOOKUP", "0") == "1"
+# SQLite file of the index; in memory (per process) when unset and
+# STEMMATE_CACHE_DIR is not set either.
+SOLUTION_INDEX_PATH = os.getenv(
+    "STEMMATE_SOLUTION_INDEX",
+    os.path.join(CACHE_DIR, "solutions.sqlite") if CACHE_DIR else ":memory:",
+)
+# Estimated Jaccard similarity from which two questions count as the same.
+SIMILAR_THRESHOLD = float(os.getenv("STEMMATE_SIMILAR_THRESHOLD", "0.95"))
+# Solutions kept; the least recently used are dropped beyond this.
+SOLUTION_INDEX_MAX_ENTRIES = int(os.getenv("STEMMATE_SOLUTION_INDEX_MAX_ENTRIES", "100000"))
+
+# 16 bands of 4 signature rows: questions above ~0.7 similarity almost always
+# share a band, those below ~0.3 rarely do.
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+
+# Markup that changes between extractions of the same page.
+_MARKUP_RE = re.compile(r"\\(?:left|right|displaystyle|[,;!: ])|\$|\\[()\[\]]|[{}\s]")
+_TIMES_RE = re.compile(r"\\(?:times|cdot)|×|·")
+# Numbers with their sign, so "x - 3" and "x + 3" differ.
+_NUMBER_RE = re.compile(r"([+\-−]?)\s*(\d+(?:[.,]\d+)*)")
+_COMMAND_RE = re.compile(r"\\[a-zA-Z]+")
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def canonical(question: str) -> str:
+    """The question lowercased, without whitespace and formatting markup."""
+    return _MARKUP_RE.sub("", _TIMES_RE.sub("*", question.lower()))
+
+
+def numbers(question: str) -> str:
+    """The signed numbers of the question in order, e.g. "3 +4 =10" -> "3,+4,10"."""
+    return ",".join(sign.replace("−", "-") + number for sign, number in _NUMBER_RE.findall(question))
+
+
+def words(question: str) -> str:
+    """
+    The distinct words of the question, sorted, without numbers and LaTeX
+    commands; "maximum" and "minimum" questions never match.
+    """
+    return " ".join(sorted(set(_WORD_RE.findall(_COMMAND_RE.sub(" ", question.lower())))))
+
+
+def _band_hashes(signature: tuple) -> list:
+    hashes = []
+    for band in range(LSH_BANDS):
+        rows = array.array("Q", signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]).tobytes()
+        hashes.append(int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), "big", signed=True))
+    return hashes
+
+
+class SolutionIndex:
+    """
+    Solved questions in SQLite with a MinHash LSH index. Lookups only compare
+    against questions sharing an LSH band, exactly the same numbers and the same
+    words, so a photo of the same problem matches while a variant with other
+    values or asking for something else does not.
+    """
+
+    # Trimming to max_entries runs once every this many inserts.
+    PRUNE_EVERY = 256
+
+    def __init__(self, path: str = SOLUTION_INDEX_PATH, threshold: float = SIMILAR_THRESHOLD,
+                 max_entries: int = SOLUTION_INDEX_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Opened on first use (always under the lock), like the question bank's.
+        if self._connection is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS solutions ("
+                "id INTEGER PRIMARY KEY, numbers TEXT NOT NULL, words TEXT NOT NULL DEFAULT '', signature BLOB NOT NULL, "
+                "model TEXT NOT NULL, solution TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(solutions)")}
+            if "words" not in columns:
+                # Indexes from before the word check; their entries never match again.
+                conn.execute("ALTER TABLE solutions ADD COLUMN words TEXT NOT NULL DEFAULT ''")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, hash INTEGER NOT NULL, id INTEGER NOT NULL, "
+                "PRIMARY KEY (band, hash, id)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used)")
+            conn.commit()
+            self._connection = conn
+        return self._connection
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+    def add(self, question: str, model: str, solution: dict):
+        """Index the consensus solution of a question."""
+        signature = minhash(canonical(question))
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO solutions (numbers, words, signature, model, solution, created, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (numbers(question), words(question), array.array("Q", signature).tobytes(), model, json.dumps(solution), now, now),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO bands (band, hash, id) VALUES (?, ?, ?)",
+                [(band, value, cursor.lastrowid) for band, value in enumerate(_band_hashes(signature))],
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        stale = "SELECT id FROM solutions ORDER BY used DESC LIMIT -1 OFFSET ?"
+        self._conn.execute(f"DELETE FROM bands WHERE id IN ({stale})", (self.max_entries,))
+        self._conn.execute(f"DELETE FROM solutions WHERE id IN ({stale})", (self.max_entries,))
+
+    def lookup(self, question: str):
+        """
+        Find the most similar indexed question with the same numbers and words.
+        Args:
+            question (str): The question to be solved.
+        Returns:
+            tuple | None: (model, solution, similarity) of the match, or None.
+        """
+        signature = minhash(canonical(question))
+        hashes = _band_hashes(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT s.id, s.signature, s.model, s.solution FROM bands b JOIN solutions s ON s.id = b.id "
+                "WHERE s.numbers = ? AND s.words = ? AND (" + " OR ".join(["(b.band = ? AND b.hash = ?)"] * LSH_BANDS) + ")",
+                [numbers(question), words(question)] + [v for band, value in enumerate(hashes) for v in (band, value)],
+            ).fetchall()
+            best = None
+            for row_id, blob, model, solution in rows:
+                score = similarity(signature, tuple(array.array("Q", blob)))
+                if score >= self.threshold and (best is None or score > best[0]):
+                    best = (score, row_id, model, solution)
+            if best is not None:
+                self._conn.execute("UPDATE solutions SET used = ? WHERE id = ?", (time.time(), best[1]))
+                self._conn.commit()
+        tracing.inc("stemmate_solution_index_lookups_total", result="miss" if best is None else "hit")
+        if best is None:
+            return None
+        score, _, model, solution = best
+        return model, json.loads(solution), score
+
+
+solution_index = SolutionIndex()
@@ -0,0 +1,191 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Optional JSON-lines sink receiving one record per finished span.
+TRACE_FILE = os.getenv("STEMMATE_TRACE_FILE")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Consensus round of the model calls made in the current context; set by the
+# pipeline before it fans out, inherited by the tasks it creates.
+consensus_round = contextvars.ContextVar("consensus_round", default=None)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_listeners = []
+
+
+class Span:
+    """Timing and attributes of one pipeline stage."""
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.first_token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def mark_first_token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+
+    def set_usage(self, usage):
+        """Copy prompt/completion token counts from an OpenAI `response.usage`."""
+        if usage is not None:
+            self.attributes["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+            self.attributes["completion_tokens"] = getattr(usage, "completion_tokens", None)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a stage and record it when the block exits, marking errors.
+    Args:
+        name (str): Stage name, e.g. "solver".
+        **attributes: Extra attributes such as model or cache_hit.
+    Yields:
+        Span: The span, to attach token usage and other attributes.
+    """
+    if consensus_round.get() is not None:
+        attributes.setdefault("round", consensus_round.get())
+    current = Span(name, attributes)
+    try:
+        yield current
+    except (GeneratorExit, asyncio.CancelledError):
+        current.set(cancelled=True)
+        raise
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _record(current.name, time.perf_counter() - current.start, current.first_token, current.attributes)
+
+
+def record(name: str, seconds: float, **attributes):
+    """Record a stage measured elsewhere, e.g. a cache hit or accumulated parse time."""
+    if consensus_round.get() is not None:
+        attributes.setdefault("round", consensus_round.get())
+    _record(name, seconds, None, attributes)
+
+
+def add_listener(listener):
+    """
+    Call listener(name, seconds, attributes) for every finished span; streamed
+    spans carry their time to first token as attributes["ttft"].
+    """
+    _listeners.append(listener)
+
+
+def _record(name: str, seconds: float, first_token: float, attributes: dict):
+    model = attributes.get("model", "")
+    status = "error" if "error" in attributes else "cancelled" if attributes.get("cancelled") else "ok"
+    with _lock:
+        _inc("stemmate_stage_total", (("stage", name), ("model", model), ("status", status)))
+        _observe("stemmate_stage_seconds", (("stage", name), ("model", model)), seconds)
+        if first_token is not None:
+            _observe("stemmate_time_to_first_token_seconds", (("stage", name), ("model", model)), first_token)
+        for kind in ("prompt", "completion"):
+            tokens = attributes.get(f"{kind}_tokens")
+            if tokens:
+                _inc("stemmate_tokens_total", (("stage", name), ("model", model), ("kind", kind)), tokens)
+        if "encoded_bytes" in attributes:
+            # Upload sizes before and after encoding; the difference is what re-encoding saved.
+            mode = (("mode", "passthrough" if attributes.get("passthrough") else "reencoded"),)
+            _inc("stemmate_image_bytes_total", (("kind", "original"),) + mode, attributes["original_bytes"])
+            _inc("stemmate_image_bytes_total", (("kind", "encoded"),) + mode, attributes["encoded_bytes"])
+            _inc("stemmate_image_bytes_saved_total", mode, attributes["original_bytes"] - attributes["encoded_bytes"])
+        if "cache_hit" in attributes:
+            result = "hit" if attributes["cache_hit"] else "miss"
+            _inc("stemmate_cache_total", (("stage", name), ("result", result)))
+    if TRACE_FILE:
+        line = {"ts": time.time(), "span": name, "seconds": round(seconds, 6), **attributes}
+        if first_token is not None:
+            line["ttft"] = round(first_token, 6)
+        with _lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+    if _listeners:
+        if first_token is not None:
+            attributes = {**attributes, "ttft": first_token}
+        for listener in _listeners:
+            listener(name, seconds, attributes)
+
+
+def _inc(name: str, labels: tuple, value: float = 1):
+    key = (name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def _observe(name: str, labels: tuple, value: float):
+    key = (name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if value <= bound:
+            histogram["buckets"][i] += 1
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Increment a custom counter, exported alongside the stage metrics."""
+    with _lock:
+        _inc(name, tuple(sorted(labels.items())), value)
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Set a custom gauge to its current value."""
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+def observe(name: str, value: float, **labels):
+    """Add an observation to a custom histogram."""
+    with _lock:
+        _observe(name, tuple(sorted(labels.items())), value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def prometheus_text() -> str:
+    """Render every counter, gauge and histogram in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        seen = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in sorted(_gauges.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} gauge")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(_histograms.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
@@ -1,20 +1,235 @@
-from src.services import image_parser, solver, personalized_explanation, question_generator
-import numpy as np
+from src.services import (
+    image_parser, solver,
+    aimage_parser, asolver_stream,
+    apersonalized_explanation, apersonalized_explanation_stream,
+    chacteristics_examples,
+)
+import asyncio
 from collections import Counter
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from src.imaging import prepare_image
+from src import tracing
+from src.routing import router
+from src.consensus import AnswerTally, answers_match, model_weight
+from src import verifier
+from src.solution_index import SIMILAR_LOOKUP, solution_index
+from src.cache import make_cache
+from src.question_bank import aget_questions, format_questions
+from src.scheduler import BULK, request_priority
+from src.segmentation import split_questions
+from src.extraction import extract
+import os
+import uuid
 
 
-from PIL import Image
-import base64
-import io
+# Start explaining the first solution before consensus is reached, discarding
+# it if that solution loses the vote. Lower latency, more explanation tokens.
+SPECULATIVE_EXPLANATION = os.getenv("STEMMATE_SPECULATIVE_EXPLANATION", "0") == "1"
+# Number of most requested personas whose explanations are generated in the
+# background after a solve, so switching persona is served from the cache.
+PREGENERATE_PERSONAS = int(os.getenv("STEMMATE_PREGENERATE_PERSONAS", "0"))
 
 
+# Finished solves by session id. The browser session only holds the id, so with
+# a shared cache tier "Re-explain" works on whichever replica serves it.
+session_store = make_cache(
+    "sessions",
+    max_entries=int(os.getenv("STEMMATE_SESSION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("STEMMATE_SESSION_TTL", str(24 * 3600))),
+)
+
+# How often each persona was asked for, used to pick what to pre-generate.
+persona_requests = Counter()
+_background_tasks = set()
+
 model_queue = [
     # "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8",
     "Qwen/Qwen3-235B-A22B-fp8-tput",
     "Qwen/Qwen3-Next-80B-A3B-Thinking",
     "openai/gpt-oss-20b"
 ]
+
+
+def solve_concurrently(question: str, models: list, round: int = 1):
+    """
+    Send the question to every model at once and yield solutions as they land.
+    Closing the generator (e.g. breaking out once a majority is reached) cancels
+    the calls that have not started and stops waiting for the ones in flight.
+    Args:
+        question (str): The question to be solved.
+        models (list): The models to fan the question out to.
+        round (int): Consensus round, recorded on the solver spans.
+    Yields:
+        tuple: (model, solution) in completion order.
+    """
+    def run(model):
+        tracing.consensus_round.set(round)
+        return solver(question, model=model)
+
+    executor = ThreadPoolExecutor(max_workers=max(len(models), 1))
+    futures = {executor.submit(run, model): model for model in models}
+    try:
+        for future in as_completed(futures):
+            model = futures[future]
+            try:
+                solution = future.result()
+            except Exception as e:
+                # The solver span already carries the error; the vote goes on without it.
+                tracing.inc("stemmate_solver_failures_total", model=model, error=type(e).__name__)
+                continue
+            yield model, solution
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def asolve_concurrently(question: str, models: list, round: int = 1):
+    """
+    Async, streaming version of `solve_concurrently`. Every model streams its
+    output concurrently; closing the generator cancels every call still in
+    flight, so use it under `contextlib.aclosing`.
+    Args:
+        question (str): The question to be solved.
+        models (list): The models to fan the question out to.
+        round (int): Consensus round, recorded on the solver spans.
+    Yields:
+        tuple: (model, "steps", list of completed steps) while a model is
+        streaming, (model, "solution", dict) once it has finished, or
+        (model, "abstain", reason) if it timed out or failed.
+    """
+    queue = asyncio.Queue()
+
+    async def run(model):
+        tracing.consensus_round.set(round)
+        try:
+            async for kind, payload in asolver_stream(question, model=model):
+                queue.put_nowait((model, kind, payload))
+        except Exception as e:
+            # A model that times out or fails abstains instead of failing the request.
+            tracing.inc("stemmate_solver_failures_total", model=model, error=type(e).__name__)
+            queue.put_nowait((model, "abstain", f"{type(e).__name__}: {e}"))
+        finally:
+            queue.put_nowait((model, "done", None))
+
+    tasks = [asyncio.create_task(run(model)) for model in models]
+    running = len(tasks)
+    try:
+        while running:
+            model, kind, payload = await queue.get()
+            if kind == "done":
+                running -= 1
+                continue
+            yield model, kind, payload
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def winning_solution(solutions: list, answer: str) -> tuple:
+    """
+    Pick the first solution that gave the consensus answer.
+    Args:
+        solutions (list): (model, solution) pairs in arrival order.
+        answer (str): The consensus answer.
+    Returns:
+        tuple: (model, solution), falling back to the first solution, or (None, None).
+    """
+    for model, solution in solutions:
+        if answer is not None and answers_match(solution.get("answer", ""), answer):
+            return model, solution
+    return solutions[0] if solutions else (None, None)
+
+
+def steps_markdown(steps_by_model: dict) -> str:
+    """Render the steps of each model as markdown sections."""
+    return "\n\n===\n\n".join([f"### Steps from {k}\n\n" + "\n\n".join(v) for k, v in steps_by_model.items()])
+
+
+async def aconsensus(question: str, models: list, quorum: int):
+    """
+    Solve by consensus in escalating rounds. The first round asks only the `quorum`
+    best models according to the router. Answers are compared by value (see
+    `src.consensus`) and weighted per model; collection stops as soon as no
+    model still to answer could change the outcome, and more models are added
+    only while it is undecided.
+    When the answer can be checked locally (see `src.verifier`), the first round
+    asks only the best model: a verified answer is final, an unverified one is
+    confirmed by `quorum - 1` more models, and a wrong one gets no vote.
+    A question close enough to one solved before, with the same numbers, reuses
+    that solution without asking any model (see `src.solution_index`).
+    Args:
+        question (str): The question to be solved.
+        models (list): Candidate models.
+        quorum (int): Number of models asked in the first round.
+    Yields:
+        tuple: (model, "steps" | "solution" | "abstain", payload) events as in
+        `asolve_concurrently`, then (None, "consensus", answer), where answer
+        is None if the vote stayed undecided.
+    """
+    if SIMILAR_LOOKUP:
+        match = solution_index.lookup(question)
+        if match is not None:
+            model, solution, _ = match
+            tracing.inc("stemmate_consensus_questions_total", resolution="index")
+            yield model, "solution", solution
+            yield None, "consensus", solution.get("answer", "")
+            return
+
+    ordered = router.order(models)
+    weights = {model: model_weight(model) for model in ordered}
+    check = verifier.prepare(question) if verifier.LOCAL_VERIFICATION and len(ordered) > 1 else None
+    # Models to add after the checked round; all of the quorum if it abstains.
+    escalate = quorum if check is not None else None
+    wave, reserve = (ordered[:1], ordered[1:]) if check is not None else (ordered[:quorum], ordered[quorum:])
+    waiting = set(ordered)
+    tally = AnswerTally()
+    solutions = []
+    verified = False
+    round = 1
+    while wave:
+        async with aclosing(asolve_concurrently(question, wave, round)) as results:
+            async for model, kind, payload in results:
+                yield model, kind, payload
+                if kind == "steps":
+                    continue
+                waiting.discard(model)
+                if kind == "solution":
+                    weight = weights[model]
+                    if check is not None:
+                        result = check.verify(payload)
+                        verifier.record(result)
+                        check = None
+                        verified = result.status == verifier.VERIFIED
+                        if result.status == verifier.FAILED:
+                            weight = 0.0
+                        else:
+                            escalate = max(1, quorum - 1)
+                    solutions.append((model, payload))
+                    tally.add(model, payload.get("answer", ""), weight)
+                if verified or tally.decided(sum(weights[m] for m in waiting)):
+                    break
+        remaining = sum(weights[m] for m in waiting)
+        if verified or tally.decided(remaining):
+            break
+        if escalate is not None:
+            needed, escalate = escalate, None
+        else:
+            needed = tally.models_needed([weights[m] for m in reserve], remaining)
+        wave, reserve = reserve[:needed], reserve[needed:]
+        round += 1
+
+    answer = tally.answer() if verified or tally.decided(sum(weights[m] for m in waiting)) else None
+    if answer is not None:
+        for model, *_ in tally.votes:
+            router.record_agreement(model, tally.agrees(model))
+        # Only answers confirmed by a second model or a local check are reused.
+        if SIMILAR_LOOKUP and (verified or len(tally.leader()["models"]) > 1):
+            solution_index.add(question, *winning_solution(solutions, answer))
+    tracing.inc("stemmate_consensus_questions_total", resolution="verified" if verified else "models")
+    yield None, "consensus", answer
+
+
 def process_image_and_solve(image) -> dict:
     """
     Process the image from the given URL, extract the question, and solve it using multiple models.
@@ -23,77 +238,131 @@ def process_image_and_solve(image) -> dict:
     Returns:
         dict: A dictionary containing the question, steps, and final answer.
     """
-    image_bytes = io.BytesIO()
-    image.save(image_bytes, format='PNG')
-    image_bytes = image_bytes.getvalue()
-    image_str = base64.b64encode(image_bytes).decode('utf-8')
+    encoded = prepare_image(image)
     question = image_parser(
-        image_str, 
-        model = "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"
+        encoded.data, 
+        mime_type = encoded.mime_type
     )
-    print(f"Extracted question: {question}")
 
-    answer = None
     solutions = []
-    model_idx=0
-    while True:
-        solution = solver(question, model = model_queue[model_idx])
-        solutions.append(solution)
-        print(f"Model {model_queue[model_idx]} produced solution: {solution}")
-        unique_answers = Counter([sol.get("answer", "") for sol in solutions])
-        unique_answers = list(unique_answers.items())
-        if unique_answers[0][1]>1:
-            answer = unique_answers[0][0]
-            break
-
-        model_idx += 1
-        if model_idx >= len(model_queue):
+    tally = AnswerTally()
+    waiting = {model: model_weight(model) for model in model_queue}
+    for model, solution in solve_concurrently(question, model_queue):
+        solutions.append((model, solution))
+        tally.add(model, solution.get("answer", ""), waiting.pop(model))
+        if tally.decided(sum(waiting.values())):
             break
-    if answer is None:
-        answer = solutions[0].get("answer", "").strip()
+    answer = tally.answer()
     
     final_steps = {}
-    for idx, sol in enumerate(solutions):
-        final_steps[f"Model_{model_queue[idx]}"] = sol.get("steps", [])
-    # for idx, sol in enemuate(solutions):
-    #     if i.get("answer", "") == answer:
-    #         final_steps[f""] = i.get("steps", [])
-    #         break
+    for model, sol in solutions:
+        final_steps[f"Model_{model}"] = sol.get("steps", [])
 
     return  question, final_steps, answer
 
 
 
 
-def process_image_and_solve_with_progress(image, enable_multi_model=True, selected_models=None, progress=None, lecturing_methods="" , characteristic="") -> tuple:
+async def solve_image(
+    image,
+    models: list = None,
+    lecturing_method: str = "Lecture/Direct Instruction",
+    characteristic: str = "Yoda",
+    language: str = "Vietnamese",
+    explain: bool = True
+) -> dict:
+    """
+    Non-interactive counterpart of `process_image_and_solve_with_progress`, used for
+    batch runs: extract the question, solve it by consensus and explain the winner.
+    Pages with several questions are split and their questions solved concurrently.
+    Args:
+        image: PIL Image, image bytes or file path containing the question.
+        models (list): Models to use for consensus, defaults to `model_queue`.
+        lecturing_method (str): Teaching method for the explanation.
+        characteristic (str): Tutor persona for the explanation.
+        language (str): Language of the explanation.
+        explain (bool): Whether to generate the personalized explanation.
+    Returns:
+        dict: The question, final answer, steps per model and explanation, plus
+        one such dict per question under "parts" for multi-question pages.
+    """
+    encoded = await asyncio.to_thread(prepare_image, image)
+    question = await aimage_parser(
+        encoded.data,
+        mime_type = encoded.mime_type
+    )
+
+    models = models or model_queue
+    parts = split_questions(question)
+    if len(parts) == 1:
+        return await _asolve_question(question, models, lecturing_method, characteristic, language, explain)
+
+    results = await asyncio.gather(*[
+        _asolve_question(part, models, lecturing_method, characteristic, language, explain) for part in parts
+    ])
+    return {
+        "question": question,
+        "answer": "\n".join(f"{i}. {result['answer']}" for i, result in enumerate(results, 1)),
+        "steps": {f"Q{i} {model}": steps for i, result in enumerate(results, 1) for model, steps in result["steps"].items()},
+        "explanation": "\n\n".join(f"## Question {i}\n\n{result['explanation']}" for i, result in enumerate(results, 1)),
+        "parts": results,
+    }
+
+
+async def _asolve_question(question: str, models: list, lecturing_method: str, characteristic: str, language: str, explain: bool) -> dict:
+    answer = None
+    solutions = []
+    async with aclosing(aconsensus(question, models, len(models) // 2 + 1)) as results:
+        async for model, kind, payload in results:
+            if kind == "solution":
+                solutions.append((model, payload))
+            elif kind == "consensus":
+                answer = payload
+    if answer is None and solutions:
+        answer = solutions[0][1].get("answer", "")
+
+    explanation = ""
+    if explain and solutions:
+        _, winner = winning_solution(solutions, answer)
+        explanation = await apersonalized_explanation(
+            question,
+            winner,
+            lecturing_method,
+            characteristic,
+            language
+        )
+        if not isinstance(explanation, str):
+            explanation = ""
+
+    return {
+        "question": question,
+        "answer": (answer or "").strip(),
+        "steps": {model: sol.get("steps", []) for model, sol in solutions},
+        "explanation": explanation,
+    }
+
+
+async def process_image_and_solve_with_progress(image, enable_multi_model=True, selected_models=None, progress=None, lecturing_methods="" , characteristic="") -> tuple:
     """
     Process the image from the given URL, extract the question, and solve it using multiple models.
     Args:
-        image: PIL Image containing the question.
+        image: Path to the uploaded file, image bytes or a PIL Image containing the question.
         enable_multi_model (bool): Whether to use multiple models for consensus.
         selected_models (list): List of models to use.
         progress: Gradio progress tracker.
     Returns:
-        tuple: A tuple containing the question, steps, and final answer.
+        tuple: The question, steps, final answer, explanation, model comparison
+            rows and, on the last update, the session id accepted by `reexplain`.
     """
-    if progress:
-        progress(0.2, desc="Converting image...")
-    
-    image_bytes = io.BytesIO()
-    image.save(image_bytes, format='PNG')
-    image_bytes = image_bytes.getvalue()
-    image_str = base64.b64encode(image_bytes).decode('utf-8')
-    
     if progress:
         progress(0.4, desc="Extracting question...")
-    
-    question = image_parser(
-        image_str, 
-        model = "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"
-    )
-    print(f"Extracted question: {question}")
 
-    yield question, "", "", ""
+    # Usually already running since the upload, possibly finished.
+    extraction = extract(image)
+    question = ""
+    async with aclosing(extraction.follow()) as extracted:
+        async for question in extracted:
+            yield question, "", "", "", [], None
 
     # Use selected models or default queue
     active_models = selected_models if selected_models else model_queue
@@ -104,88 +373,342 @@ def process_image_and_solve_with_progress(image, enable_multi_model=True, select
     if progress:
         progress(0.6, desc="Solving with AI models...")
 
+    parts = split_questions(question)
+    if len(parts) > 1:
+        async with aclosing(_solve_sections(parts, active_models, progress, lecturing_methods, characteristic)) as sections:
+            async for update in sections:
+                yield (question, *update)
+        return
+
     answer = None
     solutions = []
-    
-    for idx, model in enumerate(active_models):
-        if progress:
-            progress(0.6 + 0.3 * (idx + 1) / len(active_models), desc=f"Using {model.split('/')[-1]}...")
-        
-        solution = solver(question, model=model)
-
-        
-        temp_steps= {model.split('/')[-1]: solution.get("steps", [])}
-        temp_markdown = "===".join([f"### Steps from {k}\n\n" + "\n\n".join(v) for k, v in temp_steps.items()])
-        print(f"Model {model} produced solution: {temp_markdown}")
-        yield question, temp_markdown, "Temporary answer: " + solution.get("answer", "").strip(), ""
-
-        temp_explanation = personalized_explanation(
-            question, 
-            solution, 
-            lecturing_methods, 
-            characteristic,
-            model="google/gemma-3n-E4B-it"
-        )
-        solution["explanation"] = temp_explanation
-
-        print(f"Personalized explanation: {temp_explanation}")
-         
-        solutions.append(solution)
-
-        yield question, temp_markdown, "Temporary answer: " + solution.get("answer", "").strip(), temp_explanation
-        
-        if enable_multi_model:
-            unique_answers = Counter([sol.get("answer", "") for sol in solutions])
-            unique_answers = list(unique_answers.items())
-            if len(unique_answers) > 0 and unique_answers[0][1] > 1:
-                answer = unique_answers[0][0]
+    quorum = len(active_models) // 2 + 1
+    live_steps = {}
+    speculative = None
+    comparison = AnswerTally()
+
+    async with aclosing(aconsensus(question, active_models, quorum)) as results:
+        async for model, kind, payload in results:
+            if kind == "consensus":
+                answer = payload
                 break
-        else:
-            answer = solution.get("answer", "").strip()
-            break
+            name = model.split('/')[-1]
+            if kind == "abstain":
+                live_steps.pop(name, None)
+                continue
+            if kind == "steps":
+                live_steps[name] = payload
+                yield question, steps_markdown(live_steps), "", "", comparison.rows(), None
+                continue
+
+            solution = payload
+            live_steps[name] = solution.get("steps", [])
+            solutions.append((model, solution))
+            comparison.add(model, solution.get("answer", ""), model_weight(model))
+            if progress:
+                progress(0.6 + 0.3 * len(solutions) / len(active_models), desc=f"Received {name}...")
+            yield question, steps_markdown(live_steps), "Temporary answer: " + solution.get("answer", "").strip(), "", comparison.rows(), None
+
+            # Optionally start explaining the first solution while the others are
+            # still solving; it is only kept if that solution wins the vote.
+            # Solutions without steps or an answer have nothing to explain.
+            if SPECULATIVE_EXPLANATION and speculative is None and solution.get("steps") and solution.get("answer"):
+                speculative = (solution, asyncio.create_task(apersonalized_explanation(
+                    question, solution, lecturing_methods, characteristic
+                )))
     
-    if answer is None and solutions:
-        answer = solutions[0].get("answer", "").strip()
+    if answer is None:
+        # Undecided vote: fall back to the plurality answer.
+        answer = comparison.answer() or ""
     
     final_steps = {}
-    for idx, sol in enumerate(solutions):
-        model_name = active_models[idx].split('/')[-1] if idx < len(active_models) else f"Model_{idx}"
-        final_steps[model_name] = sol.get("steps", [])
+    for model, sol in solutions:
+        final_steps[model.split('/')[-1]] = sol.get("steps", [])
+    final_markdown = steps_markdown(final_steps)
+
+    if progress:
+        progress(0.95, desc="Explaining...")
+
+    winner_model, winner = winning_solution(solutions, answer)
+    persona_requests[characteristic] += 1
+    explanation = ""
+    header = _explanation_header(winner_model)
+    try:
+        if speculative is not None and speculative[0] is winner:
+            try:
+                explanation = await speculative[1]
+                if not isinstance(explanation, str):
+                    explanation = ""
+                tracing.inc("stemmate_speculative_explanations_total", result="used")
+            except Exception:
+                tracing.inc("stemmate_speculative_explanations_total", result="failed")
+                winner_needs_stream = True
+            else:
+                winner_needs_stream = False
+        else:
+            if speculative is not None:
+                speculative[1].cancel()
+                tracing.inc("stemmate_speculative_explanations_total", result="wasted")
+            winner_needs_stream = winner is not None
+        if winner_needs_stream:
+            async for delta in apersonalized_explanation_stream(
+                question, 
+                winner, 
+                lecturing_methods, 
+                characteristic
+            ):
+                explanation += delta
+                yield question, final_markdown, answer, header + explanation, comparison.rows(), None
+    finally:
+        if speculative is not None:
+            speculative[1].cancel()
 
     if progress:
         progress(1.0, desc="Complete!")
 
-    final_markdown = "\n\n===\n\n".join([f"### Steps from {k}\n\n" + "\n\n".join(v) for k, v in final_steps.items()])
-    final_explanation = "\n\n".join([f"### Explanation from {active_models[idx].split('/')[-1] if idx < len(active_models) else f'Model_{idx}'}\n\n" + sol.get("explanation", "") for idx, sol in enumerate(solutions)])
-    yield question, final_markdown, answer, final_explanation
+    session_id = None
+    if winner is not None:
+        session_result = {"question": question, "answer": answer, "model": winner_model, "solution": winner}
+        session_id = uuid.uuid4().hex
+        await session_store.aset(session_id, session_result)
+        pregenerate_explanations(session_result, lecturing_methods)
+    yield question, final_markdown, answer, header + explanation, comparison.rows(), session_id
     # return question, final_steps, answer
 
 
-def process_image_and_augment_questions(image, num_augmented=3) -> tuple:
+def _explanation_header(model: str) -> str:
+    return f"### Explanation from {model.split('/')[-1]}\n\n" if model else ""
+
+
+def _render_sections(states: list) -> tuple:
+    steps = "\n\n---\n\n".join(
+        f"## Question {i}\n\n" + steps_markdown(state["steps"]) for i, state in enumerate(states, 1)
+    )
+    answers = "\n".join(
+        f"{i}. " + (state["answer"].strip() if state["answer"] is not None else "…") for i, state in enumerate(states, 1)
+    )
+    explanations = "\n\n".join(
+        f"## Question {i}\n\n" + _explanation_header(state["model"]) + state["explanation"]
+        for i, state in enumerate(states, 1) if state["explanation"] or state["error"]
+    )
+    rows = [[f"Q{i} {row[0]}", *row[1:]] for i, state in enumerate(states, 1) for row in state["tally"].rows()]
+    return steps, answers, explanations, rows
+
+
+async def _solve_sections(parts: list, active_models: list, progress=None, lecturing_methods="", characteristic=""):
+    """
+    Solve and explain the questions of a multi-question page concurrently, so
+    the page takes about as long as its slowest question. Each question goes
+    through consensus and explanation on its own and hits the caches on its own.
+    Yields:
+        tuple: (steps, answers, explanations, comparison rows, session id) with one
+        section per question; the session id is set on the last update only.
+    """
+    states = [
+        {"question": part, "steps": {}, "solutions": [], "tally": AnswerTally(), "answer": None,
+         "model": None, "winner": None, "explanation": "", "error": None}
+        for part in parts
+    ]
+    updates = asyncio.Queue()
+    quorum = len(active_models) // 2 + 1
+    persona_requests[characteristic] += 1
+
+    async def run(state):
+        try:
+            async with aclosing(aconsensus(state["question"], active_models, quorum)) as results:
+                async for model, kind, payload in results:
+                    if kind == "consensus":
+                        state["answer"] = payload
+                        break
+                    name = model.split('/')[-1]
+                    if kind == "abstain":
+                        state["steps"].pop(name, None)
+                    elif kind == "steps":
+                        state["steps"][name] = payload
+                    else:
+                        state["steps"][name] = payload.get("steps", [])
+                        state["solutions"].append((model, payload))
+                        state["tally"].add(model, payload.get("answer", ""), model_weight(model))
+                    updates.put_nowait(state)
+            if state["answer"] is None:
+                state["answer"] = state["tally"].answer() or ""
+            state["model"], state["winner"] = winning_solution(state["solutions"], state["answer"])
+            updates.put_nowait(state)
+            if state["winner"] is not None:
+                async for delta in apersonalized_explanation_stream(
+                    state["question"], state["winner"], lecturing_methods, characteristic
+                ):
+                    state["explanation"] += delta
+                    updates.put_nowait(state)
+        except Exception as e:
+            state["error"] = e
+            state["explanation"] = f"Error: {e}"
+            if state["answer"] is None:
+                state["answer"] = ""
+        finally:
+            updates.put_nowait(None)
+
+    tasks = [asyncio.create_task(run(state)) for state in states]
+    running = len(tasks)
+    try:
+        while running:
+            update = await updates.get()
+            # Render once per batch of updates rather than once per token.
+            while True:
+                if update is None:
+                    running -= 1
+                    if progress:
+                        progress(0.6 + 0.35 * (len(tasks) - running) / len(tasks), desc=f"Solved {len(tasks) - running}/{len(tasks)} questions...")
+                if updates.empty():
+                    break
+                update = updates.get_nowait()
+            yield (*_render_sections(states), None)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if progress:
+        progress(1.0, desc="Complete!")
+    session_parts = [
+        {"question": state["question"], "answer": state["answer"], "model": state["model"], "solution": state["winner"]}
+        for state in states if state["winner"] is not None
+    ]
+    session_id = None
+    if session_parts:
+        session_id = uuid.uuid4().hex
+        await session_store.aset(session_id, {"parts": session_parts})
+        for session_result in session_parts:
+            pregenerate_explanations(session_result, lecturing_methods)
+    yield (*_render_sections(states), session_id)
+
+
+async def reexplain(session_id, lecturing_methods="", characteristic="", language="Vietnamese"):
+    """
+    Re-style the explanation of a finished solve without extracting or solving again.
+    Args:
+        session_id (str): Id from the last update of `process_image_and_solve_with_progress`.
+        lecturing_methods (str): New teaching method.
+        characteristic (str): New tutor persona.
+        language (str): Language of the explanation.
+    Yields:
+        str: The explanation so far.
+    """
+    session_result = await session_store.aget(session_id) if session_id else None
+    if not session_result:
+        yield "Solve a question first."
+        return
+    persona_requests[characteristic] += 1
+    if "parts" in session_result:
+        async with aclosing(_reexplain_sections(session_result["parts"], lecturing_methods, characteristic, language)) as sections:
+            async for explanation in sections:
+                yield explanation
+        return
+    header = _explanation_header(session_result["model"])
+    explanation = ""
+    async for delta in apersonalized_explanation_stream(
+        session_result["question"],
+        session_result["solution"],
+        lecturing_methods,
+        characteristic,
+        language
+    ):
+        explanation += delta
+        yield header + explanation
+    yield header + explanation
+
+
+async def _reexplain_sections(parts: list, lecturing_methods: str, characteristic: str, language: str):
+    explanations = [""] * len(parts)
+    updates = asyncio.Queue()
+
+    async def run(i, part):
+        try:
+            async for delta in apersonalized_explanation_stream(
+                part["question"], part["solution"], lecturing_methods, characteristic, language
+            ):
+                explanations[i] += delta
+                updates.put_nowait(i)
+        except Exception as e:
+            explanations[i] = f"Error: {e}"
+        finally:
+            updates.put_nowait(None)
+
+    def render():
+        return "\n\n".join(
+            f"## Question {i}\n\n" + _explanation_header(part["model"]) + explanation
+            for i, (part, explanation) in enumerate(zip(parts, explanations), 1)
+        )
+
+    tasks = [asyncio.create_task(run(i, part)) for i, part in enumerate(parts)]
+    running = len(tasks)
+    try:
+        while running:
+            if await updates.get() is None:
+                running -= 1
+            while not updates.empty():
+                if updates.get_nowait() is None:
+                    running -= 1
+            yield render()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def popular_personas(n: int) -> list:
+    """The n most requested personas, topped up in `chacteristics_examples` order."""
+    ranked = [persona for persona, _ in persona_requests.most_common() if persona in chacteristics_examples]
+    ranked += [persona for persona in chacteristics_examples if persona not in ranked]
+    return ranked[:n]
+
+
+def pregenerate_explanations(session_result: dict, lecturing_methods: str, language: str = "Vietnamese", top_n: int = None):
     """
-    Process the image from the given URL, extract the question, and generate augmented questions.
+    Generate explanations for the most popular personas in the background; they
+    land in the explanation cache, so a later `reexplain` returns immediately.
     Args:
-        image: PIL Image containing the question.
+        session_result (dict): The finished solve.
+        lecturing_methods (str): Teaching method to pre-generate for.
+        language (str): Language of the explanations.
+        top_n (int): Number of personas, defaults to PREGENERATE_PERSONAS.
+    Returns:
+        asyncio.Task | None: The background task, or None when disabled.
+    """
+    top_n = PREGENERATE_PERSONAS if top_n is None else top_n
+    if top_n <= 0 or not session_result:
+        return None
+
+    async def run():
+        # Background work: students' own solves get the model slots first.
+        request_priority.set(BULK)
+        await asyncio.gather(*[
+            apersonalized_explanation(
+                session_result["question"],
+                session_result["solution"],
+                lecturing_methods,
+                persona,
+                language
+            )
+            for persona in popular_personas(top_n)
+        ], return_exceptions=True)
+
+    # Keep a reference so the task is not garbage collected while running.
+    task = asyncio.create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def process_image_and_augment_questions(image, num_augmented=3) -> str:
+    """
+    Process the image, extract the question, and serve similar questions from the
+    question bank, generating only the ones it does not hold yet.
+    Args:
+        image: Path to the uploaded file, image bytes or a PIL Image containing the question.
         num_augmented (int): Number of augmented questions to generate.
     Returns:
-        tuple: A tuple containing the original question and a list of augmented questions.
+        str: The questions as "## Question N:" markdown.
     """
-    image_bytes = io.BytesIO()
-    image.save(image_bytes, format='PNG')
-    image_bytes = image_bytes.getvalue()
-    image_str = base64.b64encode(image_bytes).decode('utf-8')
-    
-    question = image_parser(
-        image_str, 
-        model = "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"
-    )
-    print(f"Extracted question: {question}")
+    question = await extract(image).result()
 
-    questions_str = question_generator(
-        question, 
-        num_question=num_augmented,
-        model = "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"
-    )
-    # augmented_questions = [q.strip() for q in questions_str.split("## Question") if q.strip()]
-    
-    return questions_str
\ No newline at end of file
+    questions = await aget_questions(question, n=int(num_augmented))
+    return format_questions(questions)
\ No newline at end of file
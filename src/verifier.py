@@ -0,0 +1,337 @@
+import ast
+import math
+import os
+import re
+
+from src import tracing
+from src.consensus import Answer, rounds_to
+
+try:
+    import sympy
+except ImportError:  # Optional: non-linear equations are then left unchecked.
+    sympy = None
+
+# Check the first solution locally on questions that allow it and skip the
+# other models when it holds.
+LOCAL_VERIFICATION = os.getenv("STEMMATE_LOCAL_VERIFICATION", "1") == "1"
+
+VERIFIED = "verified"
+FAILED = "failed"
+UNCHECKED = "unchecked"
+
+_MATH_RE = re.compile(r"\$\$(.+?)\$\$|\$(.+?)\$|\\\((.+?)\\\)|\\\[(.+?)\\\]", re.DOTALL)
+# "Solve: 3x + 4 = 10" without math delimiters.
+_PLAIN_MATH_RE = re.compile(r"^(?:[^:\n]*:)?\s*([0-9a-z+\-*/^()., =]+?)\s*[.?]?$", re.IGNORECASE)
+_CHOICE_RE = re.compile(r"(?:^|\s)\(?([A-E])[.)]\s*(.+?)(?=\s+\(?[A-E][.)]\s|$)", re.MULTILINE)
+_COMPUTE_RE = re.compile(
+    r"\b(?:compute|calculate|evaluate|simplify|what is|find the value|tính|tinh|rút gọn)\b", re.IGNORECASE
+)
+_SOLVE_RE = re.compile(r"\b(?:solve|find|giải|tìm|determine)\b", re.IGNORECASE)
+# Anything asking for a result; a check is only conclusive for questions with one.
+_REQUEST_RE = re.compile(
+    r"\b(?:solve|find|compute|calculate|evaluate|simplify|determine|what|which|how|show|prove|then|hence|"
+    r"giải|tìm|tính|tinh|rút gọn|chứng minh|rồi|sau đó)\b",
+    re.IGNORECASE,
+)
+# Math left outside delimiters, e.g. the "5x" of "... then find 5x".
+_LOOSE_MATH_RE = re.compile(r"\d\s*[a-z]\b|[=+*/^]|\b[a-z]\s*\(", re.IGNORECASE)
+_LETTER_RE = re.compile(r"\b[b-z]\b", re.IGNORECASE)
+_LIST_SPLIT_RE = re.compile(r"\s*(?:,|;|\band\b|\bor\b|\bvà\b|\bhoặc\b)\s*", re.IGNORECASE)
+_LATEX_TO_PYTHON = (
+    (re.compile(r"\\[dt]?frac\{([^{}]*)\}\{([^{}]*)\}"), r"((\1)/(\2))"),
+    (re.compile(r"\\sqrt\{([^{}]*)\}"), r"sqrt(\1)"),
+    (re.compile(r"\\left|\\right|\\,|\\!|\\;"), ""),
+    (re.compile(r"\\cdot|\\times"), "*"),
+    (re.compile(r"\\div"), "/"),
+    (re.compile(r"\\pi"), "pi"),
+    (re.compile(r"\\(ln|sin|cos|tan|log|exp)"), r"\1"),
+    (re.compile(r"[{\[]"), "("),
+    (re.compile(r"[}\]]"), ")"),
+    (re.compile(r"(?<=\d),(?=\d{3}\b)"), ""),
+    (re.compile(r"\^"), "**"),
+    (re.compile(r"(?<=[\d)])\s*(?=[a-z(])"), "*"),
+)
+# Only functions without conventions to guess: "log" may be base 10 or e and
+# trigonometry may be in degrees, so expressions using them stay unchecked.
+_FUNCTIONS = {"sqrt": math.sqrt, "ln": math.log, "exp": math.exp}
+_CONSTANTS = {"pi": math.pi, "e": math.e}
+_SAMPLE_POINTS = (0.5, 1.0, 2.0, 3.5, -1.7)
+_MAX_EXPONENT = 64
+
+
+class Verification:
+    """Outcome of a local check: VERIFIED, FAILED or UNCHECKED, with what was checked."""
+
+    def __init__(self, status: str, method: str = "", detail: str = ""):
+        self.status = status
+        self.method = method
+        self.detail = detail
+
+    def __bool__(self):
+        return self.status == VERIFIED
+
+    def __repr__(self):
+        return f"Verification({self.status!r}, {self.method!r}, {self.detail!r})"
+
+
+def _to_python(latex: str) -> str:
+    text = latex.strip().lower()
+    for pattern, replacement in _LATEX_TO_PYTHON:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _evaluate(node, variables: dict) -> float:
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, variables)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return float(node.value)
+    if isinstance(node, ast.Name):
+        if node.id in variables:
+            return variables[node.id]
+        if node.id in _CONSTANTS:
+            return _CONSTANTS[node.id]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _evaluate(node.operand, variables)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp):
+        left, right = _evaluate(node.left, variables), _evaluate(node.right, variables)
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+        if isinstance(node.op, ast.Mult):
+            return left * right
+        if isinstance(node.op, ast.Div):
+            return left / right
+        if isinstance(node.op, ast.Pow) and abs(right) <= _MAX_EXPONENT:
+            return float(left ** right)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS and len(node.args) == 1:
+        return _FUNCTIONS[node.func.id](_evaluate(node.args[0], variables))
+    raise ValueError("unsupported expression")
+
+
+def _compile(latex: str):
+    """(parsed expression, free variable names), or None when it is not plain arithmetic."""
+    try:
+        tree = ast.parse(_to_python(latex), mode="eval")
+    except SyntaxError:
+        return None
+    names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+    calls = {node.func.id for node in ast.walk(tree) if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)}
+    variables = names - calls - set(_CONSTANTS)
+    if calls - set(_FUNCTIONS) or any(len(name) > 1 for name in variables):
+        return None
+    return tree, variables
+
+
+def _value(tree, variables: dict = None):
+    try:
+        value = _evaluate(tree, variables or {})
+    except (ValueError, ZeroDivisionError, OverflowError, TypeError):
+        return None
+    return value if isinstance(value, float) and math.isfinite(value) else None
+
+
+def _close(expected: float, answer: Answer) -> bool:
+    return math.isclose(expected, float(answer.value), rel_tol=1e-6, abs_tol=1e-9)
+
+
+def _close_or_rounded(expected: float, answer: Answer) -> bool:
+    # A rounded answer precise enough to stand for the value, e.g. 1.33 but not 1.3 for 4/3.
+    return _close(expected, answer) or rounds_to(answer, expected)
+
+
+def _math_segments(text: str) -> list:
+    segments = [next(group for group in match.groups() if group is not None) for match in _MATH_RE.finditer(text)]
+    if not segments:
+        plain = _PLAIN_MATH_RE.match(text.strip())
+        if plain and re.search(r"\d", plain.group(1)):
+            segments = [plain.group(1)]
+    return segments
+
+
+def _choices(question: str) -> dict:
+    return {letter.upper(): text.strip() for letter, text in _CHOICE_RE.findall(question)}
+
+
+class Check:
+    """What a question lets us check, prepared once before any model answers."""
+
+    def __init__(self, method: str, expected: list, choices: dict):
+        self.method = method
+        self.expected = expected
+        self.choices = choices
+
+    def verify(self, solution: dict) -> Verification:
+        """
+        Check a solver result against the question and its own arithmetic.
+        Args:
+            solution (dict): {"steps": [...], "answer": ...} from the solver.
+        Returns:
+            Verification: VERIFIED only when the answer provably fits the question.
+                A wrong-looking step only makes it UNCHECKED, since the step may
+                use a convention the check does not know; so does an answer that
+                is right only after rounding.
+        """
+        mistake = check_steps(solution.get("steps", []))
+        if mistake:
+            return Verification(UNCHECKED, "steps", mistake)
+        answer = Answer(solution.get("answer", ""))
+        if answer.kind == "choice" and self.choices:
+            matching = [letter for letter, text in self.choices.items() if self._matches(Answer(text))]
+            if len(matching) != 1:
+                return Verification(UNCHECKED, self.method, f"{len(matching)} options match")
+            if answer.value == matching[0]:
+                return Verification(VERIFIED, self.method, f"option {answer.value}")
+            return Verification(FAILED, self.method, f"expected option {matching[0]}")
+        values = _answer_values(solution.get("answer", ""))
+        if values is None:
+            return Verification(UNCHECKED, self.method, "answer is not numeric")
+        expected = ", ".join(f"{value:g}" for value in self.expected)
+        if not all(any(_close_or_rounded(root, value) for root in self.expected) for value in values):
+            return Verification(FAILED, self.method, f"expected {expected}")
+        if not all(any(_close(root, value) for root in self.expected) for value in values):
+            # Right only after rounding: other models still have to confirm it.
+            return Verification(UNCHECKED, self.method, f"rounded, exactly {expected}")
+        if len(values) == len(self.expected):
+            return Verification(VERIFIED, self.method, expected)
+        # Some roots left out, maybe by a condition in the question ("x > 0").
+        return Verification(UNCHECKED, self.method, f"roots are {expected}")
+
+    def _matches(self, option: Answer) -> bool:
+        return option.kind == "number" and len(self.expected) == 1 and _close_or_rounded(self.expected[0], option)
+
+
+def _answer_values(raw: str):
+    text = raw.strip().strip("$")
+    if text.startswith(("\\pm", "±")):
+        answer = Answer(text[3:] if text.startswith("\\pm") else text[1:])
+        return [answer, Answer(f"-{answer.text}")] if answer.kind == "number" else None
+    answers = [Answer(part) for part in _LIST_SPLIT_RE.split(text) if part.strip()]
+    return answers if answers and all(answer.kind == "number" for answer in answers) else None
+
+
+def _solve_equation(lhs, rhs, variable: str):
+    """Real roots of lhs = rhs, or None when they cannot be determined."""
+    def f(x):
+        left, right = _value(lhs, {variable: x}), _value(rhs, {variable: x})
+        return None if left is None or right is None else left - right
+
+    samples = [(x, f(x)) for x in _SAMPLE_POINTS]
+    if all(y is not None for _, y in samples):
+        (x0, y0), (x1, y1) = samples[:2]
+        slope = (y1 - y0) / (x1 - x0)
+        # Linear when every sample lies on one line: exactly one root.
+        if slope and all(math.isclose(y, y0 + slope * (x - x0), rel_tol=1e-9, abs_tol=1e-9) for x, y in samples):
+            return [x0 - y0 / slope]
+    if sympy is None:
+        return None
+    try:
+        symbol = sympy.Symbol(variable)
+        namespace = {variable: symbol, "sqrt": sympy.sqrt, "pi": sympy.pi, "e": sympy.E, "ln": sympy.log,
+                     "exp": sympy.exp}
+        equation = sympy.sympify(ast.unparse(lhs), locals=namespace) - sympy.sympify(ast.unparse(rhs), locals=namespace)
+        if not equation.is_polynomial(symbol):
+            return None
+        roots = [complex(root) for root in sympy.solve(equation, symbol)]
+    except Exception:
+        return None
+    return sorted(root.real for root in roots if abs(root.imag) < 1e-12)
+
+
+def _single_request(question: str, segments: list, variable: str = None) -> bool:
+    """
+    Whether the question asks for one thing only: the unknown itself or the
+    value of its one expression. A second request ("... and then find 5x"), math
+    outside the delimiters or another letter make a check inconclusive.
+    """
+    text = _MATH_RE.sub(" ", question)
+    for segment in segments:
+        text = text.replace(segment, " ")
+    text = _CHOICE_RE.sub(" ", text)
+    if len(_REQUEST_RE.findall(text)) != 1 or _LOOSE_MATH_RE.search(text):
+        return False
+    return all(letter.lower() == variable for letter in _LETTER_RE.findall(text))
+
+
+def prepare(question: str):
+    """
+    Find something checkable in the question: a single equation in one unknown
+    to solve, or a single arithmetic expression to compute, asked for directly.
+    Args:
+        question (str): The extracted question.
+    Returns:
+        Check | None: The check, or None when the question cannot be checked locally.
+    """
+    segments = _math_segments(question or "")
+    compiled = []
+    for segment in segments:
+        sides = [_compile(side) for side in segment.split("=")] if segment.count("=") <= 1 else [None]
+        compiled.append((segment, sides))
+    equations = [(segment, sides) for segment, sides in compiled if len(sides) == 2]
+    choices = _choices(question)
+
+    if len(equations) == 1 and _SOLVE_RE.search(question):
+        segment, (lhs, rhs) = equations[0]
+        if lhs is None or rhs is None:
+            return None
+        variables = lhs[1] | rhs[1]
+        if len(variables) != 1:
+            return None
+        variable = variables.pop()
+        # Any other expression with unknowns may be what is asked for; the
+        # unknown on its own ("solve for $x$") is fine.
+        others = [
+            s for s, sides in compiled
+            if s is not segment and _to_python(s) != variable and any(side is None or side[1] for side in sides)
+        ]
+        if others or not _single_request(question, segments, variable):
+            return None
+        roots = _solve_equation(lhs[0], rhs[0], variable)
+        return Check("equation", roots, choices) if roots else None
+
+    expressions = [sides[0] for segment, sides in compiled if len(sides) == 1 and sides[0] is not None]
+    if (
+        not equations and len(segments) == 1 and len(expressions) == 1 and not expressions[0][1]
+        and _COMPUTE_RE.search(question) and _single_request(question, segments)
+    ):
+        value = _value(expressions[0][0])
+        return Check("arithmetic", [value], choices) if value is not None else None
+    return None
+
+
+def check_steps(steps: list) -> str:
+    """
+    Re-evaluate purely numeric chains like "$\\frac{120}{1.5} = 80$" in the steps.
+    Returns:
+        str: The first wrong equality, or "" when none is found.
+    """
+    for i, step in enumerate(steps, 1):
+        for segment in _math_segments(step):
+            if "=" not in segment:
+                continue
+            values = []
+            for side in segment.split("="):
+                compiled = _compile(side)
+                values.append(_value(compiled[0]) if compiled and not compiled[1] else None)
+            sides = segment.split("=")
+            for (a, value_a), (b, value_b) in zip(zip(sides, values), zip(sides[1:], values[1:])):
+                if value_a is None or value_b is None:
+                    continue
+                rounded = Answer(b.strip())
+                if not (math.isclose(value_a, value_b, rel_tol=1e-6, abs_tol=1e-9) or (rounded.kind == "number" and _close_or_rounded(value_a, rounded))):
+                    return f"step {i}: {a.strip()} ≠ {b.strip()}"
+    return ""
+
+
+def verify(question: str, solution: dict) -> Verification:
+    """Check a solution against the question; UNCHECKED when the question cannot be checked."""
+    check = prepare(question)
+    if check is None:
+        return Verification(UNCHECKED)
+    return check.verify(solution)
+
+
+def record(result: Verification):
+    tracing.inc("stemmate_verifier_total", result=result.status, method=result.method or "none")
@@ -0,0 +1,20 @@
+from src.consensus import AnswerTally, answers_match
+
+
+def test_equivalent_answers_match():
+    assert answers_match("0.5", "1/2")
+    assert answers_match("0.33", "1/3")
+    assert answers_match("(B)", "B")
+
+
+def test_coarse_rounding_does_not_match():
+    assert not answers_match("0.3", "1/3")
+    assert not answers_match("0.1", "1/8")
+
+
+def test_coarse_rounding_is_not_a_quorum():
+    tally = AnswerTally()
+    tally.add("model-a", "0.3")
+    tally.add("model-b", "1/3")
+    assert len(tally.groups) == 2
+    assert not tally.decided(remaining_weight=1.0)
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src import resilience, services
+
+STAGE_TIMEOUT = 0.3
+
+
+@pytest.fixture
+def hung_client(monkeypatch):
+    """A client whose every call hangs, with fast retries on timeouts."""
+    monkeypatch.setitem(resilience.STAGE_TIMEOUTS, "solver", STAGE_TIMEOUT)
+    monkeypatch.setattr(resilience, "_retryable", lambda: (TimeoutError,))
+    monkeypatch.setattr(resilience, "BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(resilience, "MAX_RETRIES", 2)
+    calls = []
+
+    class Completions:
+        async def create(self, **kwargs):
+            calls.append(kwargs["timeout"])
+            await asyncio.sleep(3600)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=Completions()))
+    monkeypatch.setattr(services, "get_async_client", lambda: client)
+    return calls
+
+
+def _trace():
+    return SimpleNamespace(name="solver", set_usage=lambda usage: None, mark_first_token=lambda: None)
+
+
+def test_hung_call_finishes_within_one_stage_timeout(hung_client):
+    async def run():
+        await services._acomplete({"model": "test-model", "messages": []}, _trace())
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(run())
+    assert time.monotonic() - start < STAGE_TIMEOUT * 1.5
+    assert all(timeout <= STAGE_TIMEOUT for timeout in hung_client)
+
+
+def test_hung_stream_finishes_within_one_stage_timeout(hung_client):
+    async def run():
+        async for _ in services._acomplete_stream({"model": "test-model", "messages": []}, _trace()):
+            pass
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(run())
+    assert time.monotonic() - start < STAGE_TIMEOUT * 1.5
+
+
+def test_retries_stop_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(resilience, "_retryable", lambda: (TimeoutError,))
+    monkeypatch.setattr(resilience, "MAX_RETRIES", 100)
+    monkeypatch.setattr(resilience, "BACKOFF_BASE", 0.001)
+    attempts = []
+
+    async def call():
+        attempts.append(time.monotonic())
+        await asyncio.sleep(0.05)
+        raise TimeoutError()
+
+    deadline = time.monotonic() + 0.2
+    with pytest.raises(TimeoutError):
+        asyncio.run(resilience.awith_retries(call, "solver", deadline))
+    assert attempts[-1] < deadline
+    assert len(attempts) < 10
@@ -0,0 +1,19 @@
+from src.verifier import FAILED, UNCHECKED, VERIFIED, verify
+
+
+def test_exact_answer_is_verified():
+    assert verify("Solve for $x$: $3x + 4 = 10$.", {"steps": [], "answer": "2"}).status == VERIFIED
+
+
+def test_wrong_answer_fails():
+    assert verify("Solve for $x$: $3x + 4 = 10$.", {"steps": [], "answer": "3"}).status == FAILED
+
+
+def test_imprecise_rounding_is_not_verified():
+    assert verify("Solve $8x = 1$", {"steps": [], "answer": "0.1"}).status == FAILED
+    assert verify("Calculate $1/3$", {"steps": [], "answer": "0.3"}).status == FAILED
+
+
+def test_rounding_only_match_is_unchecked():
+    assert verify("Calculate $1/3$", {"steps": [], "answer": "0.33"}).status == UNCHECKED
+    assert verify("Calculate $1/3$", {"steps": [], "answer": "1/3"}).status == VERIFIED